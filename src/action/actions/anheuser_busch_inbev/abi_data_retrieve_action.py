@@ -4,10 +4,10 @@ from typing import Optional
 
 import pandas as pd
 from gluon_meson_sdk.models.abstract_models.chat_message_preparation import ChatMessagePreparation
-from gluon_meson_sdk.models.scenario_model_registry.base import DefaultScenarioModelRegistryCenter
 from loguru import logger
 
 from action.base import Action, ActionResponse, ResponseMessageType, ChatResponseAnswer, GeneralResponse
+from models.chat_model.instrumented import InstrumentedScenarioModelRegistryCenter
 from utils.data_extractor import extract_data_set
 
 RETRY_TIMES, SORRY = 3, '抱歉'
@@ -227,9 +227,18 @@ def query_from_db(sql: str) -> tuple[str, Optional[Exception]]:
 
 class AbiDataRetrieveAction(Action):
     def __init__(self):
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = self.get_name() + "_action"
-        self.data_set = extract_data_set(FILE_PATH, [1, 2, 3, 4, 5])
+        self._data_set = None
+
+    @property
+    def data_set(self):
+        if self._data_set is None:
+            self._data_set = extract_data_set(FILE_PATH, [1, 2, 3, 4, 5])
+        return self._data_set
+
+    def warm_up(self):
+        _ = self.data_set
 
     def get_name(self) -> str:
         return "abi_data_retrieve"
@@ -238,7 +247,7 @@ class AbiDataRetrieveAction(Action):
         logger.info(f"exec action:\n {self.get_name()} ")
         chat_model = await self.scenario_model_registry.get_model(self.scenario_model, context.conversation.session_id)
 
-        history = context.conversation.get_history().format_string()
+        history = context.conversation.get_history_window(self.scenario_model).format_string()
         question = summarize_question(chat_model, summarize_prompt, history=history)
 
         result = reply_question(chat_model, chat_prompt, question, history=history)
@@ -12,10 +12,11 @@ from action.base import (
     ResponseMessageType,
 )
 from action.context import ActionContext
+from action.stream import achat_with_stream
+from models.chat_model.instrumented import InstrumentedScenarioModelRegistryCenter
 from nlu.forms import FormStore
 from nlu.intent_with_entity import Intent, Slot
 from prompt_manager.base import PromptManager
-from gluon_meson_sdk.models.scenario_model_registry.base import DefaultScenarioModelRegistryCenter
 
 
 class EndDialogueAction(Action):
@@ -38,7 +39,7 @@ class SlotFillingAction(Action):
         self.prompt_template = prompt_manager.load(name="slot_filling")
         self.intent = intent
         self.slots = slots[0]
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = "slot_filling_action"
 
     def get_slot_names(self):
@@ -60,7 +61,7 @@ class SlotFillingAction(Action):
             fill_slots=json.dumps(slots),
             intent_name=self.intent.name,
             intent_description=self.intent.description,
-            history=context.conversation.get_history().format_string(),
+            history=context.conversation.get_history_window(self.scenario_model).format_string(),
         )
         chat_message_preparation.log(logger)
 
@@ -78,7 +79,7 @@ class IntentConfirmAction(Action):
     def __init__(self, intent: Intent, prompt_manager: PromptManager):
         self.prompt_template = prompt_manager.load(name="intent_confirm")
         self.intent = intent
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = "intent_confirmation_action"
 
     async def run(self, context):
@@ -89,7 +90,7 @@ class IntentConfirmAction(Action):
             "system",
             self.prompt_template.template,
             intent=self.intent.description,
-            history=context.conversation.get_history().format_string(),
+            history=context.conversation.get_history_window(self.scenario_model).format_string(),
         )
         chat_message_preparation.log(logger)
 
@@ -108,7 +109,7 @@ class IntentFillingAction(Action):
     def __init__(self, prompt_manager: PromptManager, form_store: FormStore):
         self.prompt_template = prompt_manager.load(name="intent_filling")
         self.intents = form_store.intent_list_config.get_intent_list()
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = "intent_filling_action"
 
     async def run(self, context):
@@ -120,7 +121,7 @@ class IntentFillingAction(Action):
         chat_message_preparation.add_message(
             "system",
             self.prompt_template.template,
-            history=context.conversation.get_history().format_string(),
+            history=context.conversation.get_history_window(self.scenario_model).format_string(),
             intent_list=json.dumps(filtered_intents),
         )
         chat_message_preparation.log(logger)
@@ -140,7 +141,7 @@ class AskForIntentChoosingAction(Action):
 
     def __init__(self, prompt_manager: PromptManager):
         self.prompt_template = prompt_manager.load(name="intent_choosing")
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = "intent_choosing_action"
 
     async def run(self, context: ActionContext):
@@ -156,7 +157,7 @@ class AskForIntentChoosingAction(Action):
         chat_message_preparation.add_message(
             "system",
             self.prompt_template.template,
-            history=context.conversation.get_history().format_string(),
+            history=context.conversation.get_history_window(self.scenario_model).format_string(),
             intent_list=json.dumps(filtered_intents),
             disabled_intents=json.dumps(disabled_intents),
         )
@@ -179,7 +180,7 @@ class SlotConfirmAction(Action):
         self.prompt_template = prompt_manager.load(name="slot_confirm")
         self.intent = intent
         self.slot = slot
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = "slot_confirm_action"
 
     async def run(self, context):
@@ -193,7 +194,7 @@ class SlotConfirmAction(Action):
             intent=self.intent.description,
             slot=self.slot.description,
             slot_value=self.slot.value,
-            history=context.conversation.get_history().format_string(),
+            history=context.conversation.get_history_window(self.scenario_model).format_string(),
         )
         chat_message_preparation.log(logger)
 
@@ -213,7 +214,7 @@ class ChitChatAction(Action):
         return "chitchat"
 
     def __init__(self):
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = "chit_chat_action"
 
     async def run(self, context) -> ActionResponse:
@@ -232,7 +233,9 @@ class ChitChatAction(Action):
         )
         chat_message_preparation.log(logger)
 
-        result = (await chat_model.achat(**chat_message_preparation.to_chat_params(), max_length=1024)).response
+        result = await achat_with_stream(
+            chat_model, context.answer_stream, **chat_message_preparation.to_chat_params(), max_length=1024
+        )
 
         answer = ChatResponseAnswer(messageType=ResponseMessageType.FORMAT_TEXT, content=result)
         return GeneralResponse(code=200, message="success", answer=answer, jump_out_flag=False)
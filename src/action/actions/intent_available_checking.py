@@ -1,5 +1,4 @@
 from gluon_meson_sdk.models.abstract_models.chat_message_preparation import ChatMessagePreparation
-from gluon_meson_sdk.models.scenario_model_registry.base import DefaultScenarioModelRegistryCenter
 from loguru import logger
 
 from action.base import (
@@ -10,6 +9,7 @@ from action.base import (
     ResponseMessageType,
 )
 from action.context import ActionContext
+from models.chat_model.instrumented import InstrumentedScenarioModelRegistryCenter
 
 prompt = """## Role
 you are a chatbot, you need tell user the current feature is suspended
@@ -31,7 +31,7 @@ based on the disabled feature and user input, concisely tell user the specific f
 
 class IntentAvailableCheckingAction(Action):
     def __init__(self):
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = self.get_name() + "_action"
 
     def get_name(self) -> str:
@@ -2,11 +2,11 @@ import asyncio
 from abc import ABC
 from typing import Union
 
-from gluon_meson_sdk.models.scenario_model_registry.base import DefaultScenarioModelRegistryCenter
 from loguru import logger
 
 from action.base import Action, Attachment
 from action.context import ActionContext
+from models.chat_model.instrumented import InstrumentedScenarioModelRegistryCenter
 from third_system.search_entity import SearchResponse
 from third_system.unified_search import UnifiedSearch
 
@@ -22,33 +22,37 @@ def decode_bytes(contents: Union[bytes, None]) -> str:
 class TBGuruAction(Action, ABC):
     def __init__(self) -> None:
         self.unified_search = UnifiedSearch()
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = self.get_name() + "_action"
 
+    async def download_processed_file(self, context: ActionContext, url: str) -> SearchResponse:
+        file = await context.conversation.file_fetch_cache.get_or_fetch(
+            "processed", url, self.unified_search.download_file_from_minio
+        )
+        # the cached response is shared by the whole turn, hand out a copy callers are free to change
+        return file.model_copy(deep=True)
+
+    async def download_raw_file_contents(self, context: ActionContext, url: str) -> Union[Attachment, None]:
+        file = await context.conversation.file_fetch_cache.get_or_fetch(
+            "raw", url, self.unified_search.download_raw_file_from_minio
+        )
+        if file:
+            return file.model_copy(update={"contents": decode_bytes(file.contents)})
+        return None
+
     async def download_first_processed_file(self, context: ActionContext) -> Union[SearchResponse, None]:
         if len(context.conversation.uploaded_file_urls) == 0:
             return None
-        return await self.unified_search.download_file_from_minio(context.conversation.uploaded_file_urls[0])
+        return await self.download_processed_file(context, context.conversation.uploaded_file_urls[0])
 
     async def download_first_file_contents(self, context: ActionContext) -> Union[Attachment, None]:
         if len(context.conversation.uploaded_file_urls) == 0:
             return None
-        file = await self.unified_search.download_raw_file_from_minio(context.conversation.uploaded_file_urls[0])
-        if file:
-            file.contents = decode_bytes(file.contents)
-            return file
-        return None
+        return await self.download_raw_file_contents(context, context.conversation.uploaded_file_urls[0])
 
     async def download_files_contents(self, context: ActionContext) -> list[Attachment]:
         if len(context.conversation.uploaded_file_urls) == 0:
             return []
-        tasks = [
-            self.unified_search.download_raw_file_from_minio(url) for url in context.conversation.uploaded_file_urls
-        ]
+        tasks = [self.download_raw_file_contents(context, url) for url in context.conversation.uploaded_file_urls]
         files_res = await asyncio.gather(*tasks)
-        result = []
-        for f in files_res:
-            if f:
-                f.contents = decode_bytes(f.contents)
-                result.append(f)
-        return result
+        return [f for f in files_res if f]
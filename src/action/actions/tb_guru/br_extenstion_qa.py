@@ -7,6 +7,7 @@ from action.base import (
     GeneralResponse,
 )
 from action.actions.tb_guru.base import TBGuruAction
+from action.stream import achat_with_stream
 from third_system.search_entity import SearchParam
 
 prompt = """
@@ -50,7 +51,7 @@ class BRExtensionQAAction(TBGuruAction):
 
         chat_model = await self.scenario_model_registry.get_model(self.scenario_model, context.conversation.session_id)
         user_input = context.conversation.current_user_input
-        history = context.conversation.get_history().format_string()
+        history = context.conversation.get_history_window(self.scenario_model).format_string()
         chat_message_preparation = ChatMessagePreparation()
         chat_message_preparation.add_message("user", summary_prompt, user_input=user_input, chat_history=history)
         chat_message_preparation.log(logger)
@@ -81,11 +82,13 @@ search the BR requirements
         chat_message_preparation.add_message("system", prompt, user_input=user_input, br_extension_content=response)
         chat_message_preparation.log(logger)
 
-        result = (
-            await chat_model.achat(
-                **chat_message_preparation.to_chat_params(), max_length=2048, sub_scenario="final_question"
-            )
-        ).response
+        result = await achat_with_stream(
+            chat_model,
+            context.answer_stream,
+            **chat_message_preparation.to_chat_params(),
+            max_length=2048,
+            sub_scenario="final_question",
+        )
         logger.info(f"chat result: {result}")
         references = []
         for res in response:
@@ -16,6 +16,7 @@ from action.base import (
 )
 from action.actions.tb_guru.base import TBGuruAction
 from action.df_processor import DfProcessor
+from dialog_manager.deadline import DeadlineExceededException, deadline_scope
 from third_system.search_entity import SearchParam, SearchResponse
 from tracker.context import ConversationContext
 from utils.common import generate_tmp_dir
@@ -26,6 +27,13 @@ Dear user, your first {{max_row}} questions has been answered.
 We are sorry your question count has reached the system capacity, we can not answer the questions after the {{max_row}}th.
 Please put them into another request, we will serve you there.
 """
+ROW_TIMEOUT_ANSWER = "not answered within the time limit, please ask it again in another request"
+PARTIAL_ANSWER_MSG = """
+Dear user, {{answered_count}} of your {{total_count}} questions have been answered.
+The rest took too long to answer, please put them into another request, we will serve you there.
+"""
+# keep part of the request budget to build and upload the answer file after the questions are answered
+ANSWER_FILE_RESERVE_SECONDS = 10
 
 prompt = """## Role
 you are a chatbot, you need to answer the question from user
@@ -56,7 +64,7 @@ class FileBatchAction(TBGuruAction):
         return "file_batch_qa"
 
     def get_function_with_chat_model(self, chat_model, tags, conversation):
-        async def get_result_from_llm(question, index):
+        async def answer_question(question, index):
             response: list[SearchResponse] = await self.unified_search.search(
                 SearchParam(query=question, tags=tags), conversation.session_id
             )
@@ -102,6 +110,12 @@ class FileBatchAction(TBGuruAction):
 
             return result, context_info, source_name, score
 
+        async def get_result_from_llm(question, index):
+            try:
+                return await answer_question(question, index)
+            except DeadlineExceededException:
+                return ROW_TIMEOUT_ANSWER, "", "", None
+
         return get_result_from_llm
 
     async def run(self, context) -> ActionResponse:
@@ -143,11 +157,25 @@ class FileBatchAction(TBGuruAction):
 
         chat_model = await self.scenario_model_registry.get_model(self.scenario_model, conversation.session_id)
         get_result_from_llm = self.get_function_with_chat_model(chat_model, {"basic_type": "faq", **tags}, conversation)
-        tasks = [
-            get_result_from_llm(row[questions_column], index)
-            for index, row in enumerate(answer_df.to_dict(orient="records"))
-        ]
-        search_res = await asyncio.gather(*tasks)
+        rows_deadline = context.deadline.reserve(ANSWER_FILE_RESERVE_SECONDS) if context.deadline else None
+        # tasks created in the scope inherit the rows deadline
+        with deadline_scope(rows_deadline):
+            tasks = [
+                asyncio.ensure_future(get_result_from_llm(row[questions_column], index))
+                for index, row in enumerate(answer_df.to_dict(orient="records"))
+            ]
+        try:
+            search_res = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        timeout_count = sum(1 for res in search_res if res[0] == ROW_TIMEOUT_ANSWER)
+        if timeout_count:
+            logger.warning(f"{timeout_count} questions are not answered before the deadline")
+            answer_msg = ChatMessage.format_jinjia_template(
+                PARTIAL_ANSWER_MSG, answered_count=len(search_res) - timeout_count, total_count=df.shape[0]
+            )
         search_df = pd.DataFrame(search_res, columns=["answers", "reference_question", "reference_name", "score"])
         search_df["reference_answer"] = search_df["answers"]
         df = df[[questions_column]].merge(search_df, left_index=True, right_index=True, how="left").reset_index()
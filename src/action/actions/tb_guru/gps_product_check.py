@@ -4,6 +4,7 @@ from loguru import logger
 
 from action.base import ActionResponse, ResponseMessageType, ChatResponseAnswer, GeneralResponse
 from action.actions.tb_guru.base import TBGuruAction
+from action.stream import achat_with_stream
 from third_system.search_entity import SearchParam
 
 prompt = """## Role
@@ -61,7 +62,9 @@ class GPSProductCheckAction(TBGuruAction):
         chat_message_preparation.add_message("user", prompt, gps_products=gsp_products.to_string(), user_input=user_input)
         chat_message_preparation.log(logger)
 
-        result = (await chat_model.achat(**chat_message_preparation.to_chat_params(), max_length=2048)).response
+        result = await achat_with_stream(
+            chat_model, context.answer_stream, **chat_message_preparation.to_chat_params(), max_length=2048
+        )
         logger.info(f"chat result: {result}")
 
         answer = ChatResponseAnswer(
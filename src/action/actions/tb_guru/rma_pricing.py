@@ -9,6 +9,7 @@ from loguru import logger
 from action.actions.general import SlotFillingAction
 from action.base import ActionResponse, GeneralResponse
 from action.actions.tb_guru.base import TBGuruAction
+from action.stream import achat_with_stream
 from prompt_manager.base import BasePromptManager
 from third_system.search_entity import SearchParam
 
@@ -343,7 +344,7 @@ class RMAPricingAction(TBGuruAction):
             country_of_rma_or_bic=country_of_rma_holder or bic_code
         )
         chat_message_preparation.log(logger)
-        final_result = (
-            await chat_model.achat(**chat_message_preparation.to_chat_params(), max_length=2048)).response
+        final_result = await achat_with_stream(
+            chat_model, context.answer_stream, **chat_message_preparation.to_chat_params(), max_length=2048)
         logger.info(f"final result: {final_result}")
         return GeneralResponse.normal_success_text_response(final_result, intent, all_banks)
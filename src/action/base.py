@@ -248,6 +248,10 @@ class Action(ABC):
     def get_name(self) -> str:
         pass
 
+    def warm_up(self):
+        """Load heavy resources ahead of the first run."""
+        pass
+
 
 class DynamicAction(Action, ABC):
     @abstractmethod
@@ -1,5 +1,9 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
+from action.stream import AnswerStream
+from dialog_manager.deadline import Deadline
 from nlu.forms import FormStore
 from prompt_manager.base import PromptManager
 from tracker.context import ConversationContext
@@ -8,9 +12,16 @@ from tracker.context import ConversationContext
 class ActionContext:
     """Holds context information for executing actions."""
 
-    def __init__(self, conversation: ConversationContext):
+    def __init__(
+        self,
+        conversation: ConversationContext,
+        answer_stream: Optional[AnswerStream] = None,
+        deadline: Optional[Deadline] = None,
+    ):
         """Initialize empty context."""
         self.conversation = conversation
+        self.answer_stream = answer_stream
+        self.deadline = deadline
 
     def set_status(self, status):
         """Set the status of the conversation."""
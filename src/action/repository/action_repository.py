@@ -15,6 +15,10 @@ class ActionRepository:
     def find_by_name(self, name) -> Union[Action, None]:
         pass
 
+    @abstractmethod
+    def warm_up(self):
+        pass
+
 
 class MemoryBasedActionRepository(ActionRepository):
     def __init__(self):
@@ -28,6 +32,10 @@ class MemoryBasedActionRepository(ActionRepository):
             return None
         return self.actions[name]
 
+    def warm_up(self):
+        for action in self.actions.values():
+            action.warm_up()
+
 
 action_repository = MemoryBasedActionRepository()
 action_repository.save(AbiDataRetrieveAction())
@@ -0,0 +1,77 @@
+import asyncio
+from typing import AsyncIterator, Optional
+
+from loguru import logger
+
+from dialog_manager.deadline import DeadlineExceededException, run_within_deadline
+from metrics import count_error
+
+# types of chat models already warned about, the fallback would otherwise be logged on every streamed turn
+unstreamable_model_types: set[str] = set()
+
+
+class AnswerStream:
+    """Carries answer deltas from the running action to the SSE response before the turn finishes."""
+
+    def __init__(self):
+        self.queue: asyncio.Queue[Optional[str]] = asyncio.Queue()
+        self.has_delta = False
+        self.closed = False
+
+    async def put(self, delta: str):
+        if self.closed or not delta:
+            return
+        self.has_delta = True
+        await self.queue.put(delta)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.queue.put_nowait(None)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        while True:
+            delta = await self.queue.get()
+            if delta is None:
+                return
+            yield delta
+
+
+async def achat_with_stream(chat_model, answer_stream: Optional[AnswerStream], **chat_params) -> str:
+    """
+    Call the chat model for a final answer, forwarding token deltas to the answer stream when one is attached.
+    Falls back to a single ``achat`` call when the turn is not streamed or the model cannot stream.
+    When the request deadline expires mid-stream, the part streamed so far is returned as the answer.
+    """
+    if answer_stream is None:
+        return (await chat_model.achat(**chat_params)).response
+    if not hasattr(chat_model, "astream"):
+        model_type = type(getattr(chat_model, "chat_model", chat_model)).__name__
+        if model_type not in unstreamable_model_types:
+            unstreamable_model_types.add(model_type)
+            logger.warning(f"chat model {model_type} has no astream, streamed turns fall back to achat")
+        count_error("stream", "fallback_to_achat")
+        return (await chat_model.achat(**chat_params)).response
+
+    deltas = []
+    deltas_iterator = chat_model.astream(**chat_params).__aiter__()
+    try:
+        while True:
+            try:
+                delta = await run_within_deadline(deltas_iterator.__anext__(), "streaming answer")
+            except StopAsyncIteration:
+                break
+            except DeadlineExceededException:
+                if not deltas:
+                    raise
+                logger.warning("deadline exceeded while streaming, answer with the partial content")
+                deltas.append(" ...")
+                await answer_stream.put(" ...")
+                break
+            deltas.append(delta)
+            await answer_stream.put(delta)
+    finally:
+        # the model stops generating and releases its connection, instead of when the iterator is collected
+        if hasattr(deltas_iterator, "aclose"):
+            await deltas_iterator.aclose()
+    return "".join(deltas)
@@ -10,23 +10,32 @@ from urllib.request import Request
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, UploadFile, Form, Depends
-from gluon_meson_sdk.models.longging.pg_log_service import PGModelLogService
 from gluon_meson_sdk.models.exceptions import TokenLimitExceededException, ChatModelRequestException
 from loguru import logger
 from sse_starlette import EventSourceResponse
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 from uvicorn import run
 
 from action.base import ErrorResponse, AttachmentResponse, JumpOutResponse, ActionResponse, ChatResponseAnswer
+from action.stream import AnswerStream
+from dialog_manager.admission_control import AdmissionController, AdmissionRejectedException
 from dialog_manager.base import BaseDialogManager, DialogManagerFactory
+from dialog_manager.deadline import Deadline, DeadlineExceededException
+from dialog_manager.session_turn import StaleTurnCancelledException
+from dialog_manager.startup import StartupTracker
 from emailbot.emailbot import get_config, EmailBot, EmailBotSettings
 from logging_intercept_handler import InterceptHandler
+from metrics import registry as metrics_registry
+from model_log_sink import BatchedModelLogSink, create_model_log_sink
 from promptflow.command import ScoreCommand
 from router import api_router
 from third_system.atom_service import AtomService
 from third_system.microsoft_graph import Graph
 from third_system.unified_search import UnifiedSearch
+from tracker.expiry import SessionExpiryWorker
+from tracker.file_store import UploadQuotaExceededException
+from tracker.session_store import SessionVersionConflictException
 from utils.common import get_value_or_default_from_dict
 
 config = configparser.ConfigParser()
@@ -63,7 +72,53 @@ def init_logging():
         logger.configure(handlers=log_handler, extra={"application_name": "thought agent"})
 
 
-dialog_manager: BaseDialogManager = DialogManagerFactory.create_dialog_manager()
+startup_tracker = StartupTracker()
+dialog_manager: Optional[BaseDialogManager] = None
+admission_controller = AdmissionController()
+# created on startup, the pg writer connects to its database when it is created
+model_log_sink: Optional[BatchedModelLogSink] = None
+session_expiry_worker: Optional[SessionExpiryWorker] = None
+
+
+async def init_dialog_manager():
+    global dialog_manager, session_expiry_worker
+    try:
+        dialog_manager = await DialogManagerFactory.acreate_dialog_manager(startup_tracker)
+    except Exception:
+        logger.error(f"failed to start dialog manager: {traceback.format_exc()}")
+        return
+    session_expiry_worker = SessionExpiryWorker(dialog_manager.conversation_tracker.aexpire_conversations)
+    session_expiry_worker.start()
+
+
+async def init_model_log_sink():
+    global model_log_sink
+    try:
+        model_log_sink = await startup_tracker.init_component("model_log_sink", create_model_log_sink)
+    except Exception:
+        return
+    model_log_sink.start()
+
+
+@app.on_event("startup")
+async def startup():
+    # initialize in background, so /healthy/ answers while the process is still warming up
+    app.state.model_log_sink_task = asyncio.create_task(init_model_log_sink())
+    app.state.startup_task = asyncio.create_task(init_dialog_manager())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if session_expiry_worker:
+        await session_expiry_worker.shutdown()
+    if dialog_manager:
+        await dialog_manager.history_summarizer.shutdown()
+        if dialog_manager.embedding_client:
+            await dialog_manager.embedding_client.shutdown()
+        await asyncio.to_thread(dialog_manager.conversation_tracker.close)
+    if model_log_sink:
+        await model_log_sink.shutdown()
+
 
 if is_local_mode:
     origins = [
@@ -113,6 +168,131 @@ async def parse_file_name(file_url):
     return file_url.split("/")[-1]
 
 
+async def resolve_first_file_name(unified_search: UnifiedSearch, file_urls: list[str]) -> Optional[str]:
+    if not file_urls or not file_urls[0]:
+        return None
+    file_name = await unified_search.fetch_raw_file_name(file_urls[0])
+    if file_name is None:
+        return None
+    return file_name or await parse_file_name(file_urls[0])
+
+
+def format_error_message(err: Exception) -> str:
+    if isinstance(err, TokenLimitExceededException):
+        limit = err.message.split(":")[1].replace("This model's maximum context length is", "We allow")
+        err_msg = "Dear user, your current context has exceeded the allowed token numbers." + limit
+        return (
+            err_msg.replace("Your messages has exceeded the model's maximum context length. ", "")
+            + " Please start a new conversation, thanks."
+        )
+    elif isinstance(err, StaleTurnCancelledException):
+        return "Dear user, this message is skipped since a newer message of the conversation is being processed."
+    elif isinstance(err, SessionVersionConflictException):
+        return "Dear user, the conversation is updated by another message at the same time, please try again."
+    elif isinstance(err, UploadQuotaExceededException):
+        return "Dear user, the uploaded files are too large, please remove some files or upload smaller ones."
+    elif isinstance(err, DeadlineExceededException):
+        return "Dear user, it takes too long to answer your message, please try again later or simplify your question."
+    elif isinstance(err, ChatModelRequestException):
+        if err.model_source == "HSBC":
+            return "Ops.... share platform broke down, please contact your IT team for further assistance."
+        else:
+            return "Ops.... GM model broke down, please contact your IT team for further assistance."
+    return "Ops.... seems we hit problem to serve you, please contact your IT team for further assistance."
+
+
+async def log_overall_turn(score_command: ScoreCommand, result, conversation, err_msg: str):
+    if model_log_sink is None:
+        logger.warning(f"model log sink is not running, drop the overall log of {score_command.conversation_id}")
+        return
+    full_history = []
+    if conversation is not None:
+        full_history = conversation.history.format_messages()
+    await model_log_sink.log(
+        score_command.conversation_id,
+        "overall",
+        "no_model",
+        full_history[:-1] if len(full_history) > 0 else [],
+        full_history[-1]["content"] if len(full_history) > 0 and "content" in full_history[-1] else "",
+        {**score_command.model_dump(), "extra_info": result.answer.extra_info if result else {}},
+        err_msg,
+    )
+
+
+def busy_response(score_command: ScoreCommand, err: AdmissionRejectedException) -> EventSourceResponse:
+    logger.info(f"session {score_command.conversation_id} {err}")
+    answer = "Dear user, we are serving too many requests now, please try again later."
+    return EventSourceResponse(
+        generate_answer_with_len_limited(answer, session_id=score_command.conversation_id, busy=True),
+        status_code=429,
+    )
+
+
+async def stream_score(
+    score_command: ScoreCommand, unified_search: UnifiedSearch, file_urls: list[str], deadline: Deadline
+) -> EventSourceResponse:
+    """the caller has been admitted, the turn releases the admission when it finishes"""
+    session_id = score_command.conversation_id
+    answer_stream = AnswerStream()
+
+    async def run_turn():
+        try:
+            first_file_name = await deadline.run(
+                resolve_first_file_name(unified_search, file_urls), "file name resolution"
+            )
+            return await dialog_manager.handle_message(
+                message=score_command.question,
+                session_id=session_id,
+                first_file_name=first_file_name,
+                file_urls=file_urls,
+                answer_stream=answer_stream,
+                deadline=deadline,
+            )
+        finally:
+            answer_stream.close()
+            admission_controller.release()
+
+    # started before the response, so the admission is released even if the client never reads the stream
+    turn = asyncio.create_task(run_turn())
+
+    async def generator():
+        async for delta in answer_stream:
+            yield {"data": json.dumps({"answer": delta, "session_id": session_id})}
+
+        err_msg = ""
+        result = None
+        conversation = None
+        try:
+            result, conversation = await turn
+        except Exception as err:
+            logger.info(traceback.format_exc())
+            err_msg = format_error_message(err)
+
+        if not result:
+            answer = {"answer": err_msg if err_msg else "unknown error occurred"}
+        elif isinstance(result, JumpOutResponse):
+            answer = {"answer": "Sorry, I can't help you with that."}
+        else:
+            # the streamed deltas already carried the content, the trailing event only adds the extra info
+            answer = {
+                "answer": "\n\n<br>" + result.answer.get_extra_info()
+                if answer_stream.has_delta
+                else result.answer.get_content_with_extra_info(),
+                "session_id": session_id,
+                **(
+                    dict(attachments=[a.model_dump_json() for a in result.attachments])
+                    if isinstance(result, AttachmentResponse)
+                    else {}
+                ),
+            }
+        async for answer in generate_answer_with_len_limited(**answer):
+            yield answer
+        await asyncio.sleep(0.1)
+        await log_overall_turn(score_command, result, conversation, err_msg)
+
+    return EventSourceResponse(generator())
+
+
 @app.post("/score/")
 async def score(
     score_command: ScoreCommand,
@@ -127,46 +307,55 @@ async def score(
     conversation = None
     session_id = score_command.conversation_id
     user_id = score_command.user_id
+    # the budget starts when the request arrives, so the time waiting for admission is counted as well
+    deadline = Deadline.for_request(score_command.from_email)
     file_urls = []
     if score_command.file_urls:
         file_urls = score_command.file_urls
     elif score_command.file_url:
         file_urls = [score_command.file_url]
 
+    if not startup_tracker.ready:
+        return EventSourceResponse(
+            generate_answer_with_len_limited(
+                "Dear user, the service is starting, please try again later.", session_id=session_id
+            ),
+            status_code=503,
+        )
+
+    try:
+        await admission_controller.acquire()
+    except AdmissionRejectedException as err:
+        return busy_response(score_command, err)
+
+    # recorded once admitted, a rejected email does not leave a message without an answer in the conversation
     if score_command.from_email:
-        await atom_service.create_human_message(session_id, user_id, score_command.question)
+        try:
+            await atom_service.create_human_message(session_id, user_id, score_command.question)
+        except BaseException:
+            admission_controller.release()
+            raise
+
+    if score_command.stream and not score_command.from_email:
+        return await stream_score(score_command, unified_search, file_urls, deadline)
 
     try:
-        first_file = (
-            await unified_search.download_raw_file_from_minio(file_urls[0]) if file_urls and file_urls[0] else None
-        )
+        first_file_name = await deadline.run(resolve_first_file_name(unified_search, file_urls), "file name resolution")
         result, conversation = await dialog_manager.handle_message(
             message=score_command.question,
             session_id=session_id,
-            first_file_name=await parse_file_name(file_urls[0]) if first_file else None,
+            first_file_name=first_file_name,
             file_urls=file_urls,
             is_email_request=score_command.from_email,
+            deadline=deadline,
         )
     except Exception as err:
         logger.info(traceback.format_exc())
         if conversation:
             conversation.reset_history()
-
-        if isinstance(err, TokenLimitExceededException):
-            err_msg = "Dear user, your current context has exceeded the allowed token numbers." + err.message.split(
-                ":"
-            )[1].replace("This model's maximum context length is", "We allow")
-            err_msg = (
-                err_msg.replace("Your messages has exceeded the model's maximum context length. ", "")
-                + " Please start a new conversation, thanks."
-            )
-        elif isinstance(err, ChatModelRequestException):
-            if err.model_source == "HSBC":
-                err_msg = "Ops.... share platform broke down, please contact your IT team for further assistance."
-            else:
-                err_msg = "Ops.... GM model broke down, please contact your IT team for further assistance."
-        else:
-            err_msg = "Ops.... seems we hit problem to serve you, please contact your IT team for further assistance."
+        err_msg = format_error_message(err)
+    finally:
+        admission_controller.release()
 
     async def generator():
         if not result:
@@ -201,21 +390,8 @@ async def score(
 
         async for answer in generate_answer_with_len_limited(**answer):
             yield answer
-        full_history = []
-        if conversation is not None:
-            full_history = conversation.history.format_messages()
         await asyncio.sleep(0.1)
-        asyncio.create_task(
-            PGModelLogService().async_log(
-                session_id,
-                "overall",
-                "no_model",
-                full_history[:-1] if len(full_history) > 0 else [],
-                full_history[-1]["content"] if len(full_history) > 0 and "content" in full_history[-1] else "",
-                {**score_command.model_dump(), "extra_info": result.answer.extra_info if result else {}},
-                err_msg,
-            )
-        )
+        await log_overall_turn(score_command, result, conversation, err_msg)
 
     return EventSourceResponse(generator())
 
@@ -225,6 +401,44 @@ async def healthcheck():
     return {"status": "alive"}
 
 
+@app.get("/ready/")
+async def readiness_check():
+    return JSONResponse(status_code=200 if startup_tracker.ready else 503, content=startup_tracker.status())
+
+
+@app.get("/admission/stats/")
+async def admission_stats():
+    return admission_controller.stats()
+
+
+@app.get("/model_log/stats/")
+async def model_log_stats():
+    if model_log_sink is None:
+        return JSONResponse(status_code=503, content={"status": "not running"})
+    return model_log_sink.stats()
+
+
+@app.get("/tracker/stats/")
+async def tracker_stats():
+    conversation_tracker = dialog_manager.conversation_tracker if dialog_manager else None
+    if not hasattr(conversation_tracker, "memory_stats"):
+        return {}
+    return conversation_tracker.memory_stats()
+
+
+@app.get("/intent_result_cache/stats/")
+async def intent_result_cache_stats():
+    intent_result_cache = dialog_manager.intent_result_cache if dialog_manager else None
+    if intent_result_cache is None:
+        return {}
+    return intent_result_cache.stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 async def start_emailbot():
     logger.info("Starting emailbot")
     emailbot_configuration = get_config(EmailBotSettings)
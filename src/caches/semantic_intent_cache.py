@@ -0,0 +1,142 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+
+import numpy as np
+
+from caches.base import Cache
+from metrics import count_cache_lookup
+
+intent_result_cache_feature_toggle = os.getenv("INTENT_RESULT_CACHE_FEATURE_TOGGLE", "False") == "True"
+intent_result_cache_max_entries = int(os.getenv("INTENT_RESULT_CACHE_MAX_ENTRIES", 5000))
+# cosine distance, the same measure as the lancedb cache
+intent_result_cache_max_distance = float(os.getenv("INTENT_RESULT_CACHE_MAX_DISTANCE", 0.05))
+
+
+def normalize_utterance(content: str) -> str:
+    return " ".join(content.lower().split())
+
+
+class ScopedEntries:
+    """entries of one scope, the oldest one is overwritten when they are full"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.vectors: np.ndarray = None
+        self.contents: list[str] = []
+        self.responses: list[str] = []
+        self.rows: dict[str, int] = {}
+        self.next_row = 0
+
+    def add(self, content: str, vector: np.ndarray, response: str):
+        if self.vectors is None:
+            self.vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+        row = self.next_row % self.max_entries
+        if row < len(self.contents):
+            del self.rows[self.contents[row]]
+            self.contents[row], self.responses[row] = content, response
+        else:
+            self.contents.append(content)
+            self.responses.append(response)
+        self.vectors[row] = vector
+        self.rows[content] = row
+        self.next_row += 1
+
+    def nearest(self, vector: np.ndarray) -> tuple[float, str]:
+        distances = 1 - self.vectors[: len(self.contents)] @ vector
+        row = int(np.argmin(distances))
+        return float(distances[row]), self.responses[row]
+
+
+class SemanticIntentCache(Cache):
+    """
+    Intent results of utterances, found again by the same utterance or one with a similar embedding.
+    Entries are scoped, e.g. by the intent layer they were classified in. The cache is built for one version of the
+    scenes and kept in memory only, so results of outdated scenes are never served.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[str], list[float]],
+        scene_version: str,
+        max_entries: int = intent_result_cache_max_entries,
+        max_distance: float = intent_result_cache_max_distance,
+    ):
+        self.embed = embed
+        self.scene_version = scene_version
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.scopes: dict[str, ScopedEntries] = {}
+        self.hits = 0
+        self.misses = 0
+        # embeddings of the latest searched utterances, reused when their intent result is added after a miss
+        self.recent_vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+        # searched and added from worker threads, since the embedding call blocks
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: list[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _embed(self, content: str) -> np.ndarray:
+        with self.lock:
+            vector = self.recent_vectors.get(content)
+        if vector is not None:
+            return vector
+        vector = self._normalize(self.embed(content))
+        with self.lock:
+            self.recent_vectors[content] = vector
+            if len(self.recent_vectors) > 256:
+                self.recent_vectors.popitem(last=False)
+        return vector
+
+    def search(
+        self,
+        content: str,
+        exact_match: bool = False,
+        similarity_score_threshold: float = None,
+        limit=None,
+        scope: str = "",
+        vector: Optional[list[float]] = None,
+    ) -> Union[str, None]:
+        """vector is the embedding of the content when the caller has it already, e.g. from an async client"""
+        content = normalize_utterance(content)
+        with self.lock:
+            entries = self.scopes.get(scope)
+            response = entries.responses[entries.rows[content]] if entries and content in entries.rows else None
+        if response is None and not exact_match and entries:
+            vector = self._embed(content) if vector is None else self._normalize(vector)
+            with self.lock:
+                distance, nearest_response = entries.nearest(vector)
+            if distance <= (self.max_distance if similarity_score_threshold is None else similarity_score_threshold):
+                response = nearest_response
+        with self.lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        count_cache_lookup("intent_result", response is not None)
+        return response
+
+    def add_cache(self, content: str, response: str, scope: str = "", vector: Optional[list[float]] = None) -> None:
+        content = normalize_utterance(content)
+        vector = self._embed(content) if vector is None else self._normalize(vector)
+        with self.lock:
+            if scope not in self.scopes:
+                self.scopes[scope] = ScopedEntries(self.max_entries)
+            if content not in self.scopes[scope].rows:
+                self.scopes[scope].add(content, vector, response)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "scene_version": self.scene_version,
+                "entries": sum(len(entries.contents) for entries in self.scopes.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from loguru import logger
+
+max_in_flight_turns = int(os.getenv("MAX_IN_FLIGHT_TURNS", 32))
+max_queued_turns = int(os.getenv("MAX_QUEUED_TURNS", 64))
+max_queue_wait_seconds = float(os.getenv("MAX_QUEUE_WAIT_SECONDS", 10))
+
+
+class AdmissionRejectedException(Exception):
+    def __init__(self, reason: str):
+        super().__init__(f"turn is rejected: {reason}")
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Bounds the number of turns handled at once; extra turns wait in a bounded queue for a limited time
+    and are rejected when the queue is full or the wait expires, so latency stays bounded under load.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = max_in_flight_turns,
+        max_queue_depth: int = max_queued_turns,
+        max_queue_wait: float = max_queue_wait_seconds,
+        wait_time_window: int = 1000,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait = max_queue_wait
+        # created lazily so it binds to the event loop serving the requests
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.admitted_count = 0
+        self.rejected_queue_full_count = 0
+        self.rejected_wait_timeout_count = 0
+        self.recent_wait_times: deque[float] = deque(maxlen=wait_time_window)
+        self.max_wait_time = 0.0
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    async def acquire(self):
+        if self.in_flight >= self.max_in_flight and self.queue_depth >= self.max_queue_depth:
+            self.rejected_queue_full_count += 1
+            logger.warning(f"reject turn, queue is full with {self.queue_depth} turns")
+            raise AdmissionRejectedException("queue is full")
+
+        self.queue_depth += 1
+        start_time = time.monotonic()
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.max_queue_wait)
+        except asyncio.TimeoutError:
+            self.rejected_wait_timeout_count += 1
+            logger.warning(f"reject turn, waited more than {self.max_queue_wait}s in queue")
+            raise AdmissionRejectedException("queue wait timeout")
+        finally:
+            self.queue_depth -= 1
+
+        wait_time = time.monotonic() - start_time
+        self.recent_wait_times.append(wait_time)
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        self.admitted_count += 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    @asynccontextmanager
+    async def admit(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        wait_times = sorted(self.recent_wait_times)
+
+        def percentile(p: float) -> float:
+            return wait_times[min(len(wait_times) - 1, int(len(wait_times) * p))] if wait_times else 0.0
+
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue_depth": self.max_queue_depth,
+            "max_queue_wait": self.max_queue_wait,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "admitted": self.admitted_count,
+            "rejected_queue_full": self.rejected_queue_full_count,
+            "rejected_wait_timeout": self.rejected_wait_timeout_count,
+            "wait_time_p50": percentile(0.5),
+            "wait_time_p99": percentile(0.99),
+            "wait_time_max": self.max_wait_time,
+        }
@@ -1,5 +1,6 @@
+import asyncio
 import os
-from typing import Any
+from typing import Any, Optional
 
 from fastapi import UploadFile
 from gluon_meson_sdk.dbs.milvus.milvus_connection import MilvusConnection
@@ -10,11 +11,21 @@ from loguru import logger
 
 from action.base import JumpOutResponse
 from action.context import ActionContext
+from action.repository.action_repository import action_repository
 from action.runner import ActionRunner, SimpleActionRunner
+from action.stream import AnswerStream
+from caches.semantic_intent_cache import SemanticIntentCache, intent_result_cache_feature_toggle
+from dialog_manager.deadline import Deadline, DeadlineExceededException, deadline_scope
+from dialog_manager.session_turn import SessionTurnScheduler
+from dialog_manager.startup import StartupTracker, prime_tiktoken_encodings
+from metrics import stage_timer
+from models.embedding_model.batched import BatchedEmbeddingClient
 from nlu.forms import FormStore
 from nlu.intent_config import IntentListConfig
 from nlu.llm.entity import LLMEntityExtractor
 from nlu.llm.intent import LLMIntentClassifier
+from nlu.llm.intent_example_index import IntentExampleIndex, hash_scenes, intent_example_index_feature_toggle
+from nlu.mlm.lexical_router import LexicalIntentRouter, lexical_intent_router_feature_toggle
 from nlu.mlm.integrated import IntegratedNLU
 from output_adapter.base import BaseOutputAdapter, OutputAdapter
 from output_adapter.email_output_adapter import EmailOutputAdapter
@@ -26,10 +37,11 @@ from prompt_manager.base import BasePromptManager
 from reasoner.base import Reasoner
 from reasoner.llm_reasoner import LlmReasoner
 from tracker.HistorySummarizer import HistorySummarizer
-from tracker.base import BaseConversationTracker, ConversationTracker
+from tracker.base import ConversationTracker, create_conversation_tracker
 from tracker.context import ConversationContext
 
 summarize_history_feature_toggle = os.getenv("SUMMARIZE_HISTORY_FEATURE_TOGGLE", "False") == "True"
+cancel_stale_turn_feature_toggle = os.getenv("CANCEL_STALE_TURN_FEATURE_TOGGLE", "False") == "True"
 
 
 class BaseDialogManager:
@@ -40,20 +52,28 @@ class BaseDialogManager:
         action_runner: ActionRunner,
         output_adapters: list[OutputAdapter],
         history_summarizer: HistorySummarizer,
+        cancel_stale_turn: bool = cancel_stale_turn_feature_toggle,
+        embedding_client: Optional[BatchedEmbeddingClient] = None,
+        intent_result_cache: Optional[SemanticIntentCache] = None,
     ):
         self.conversation_tracker = conversation_tracker
+        # shared by the components of the reasoner, kept here to be shut down with the dialog manager
+        self.embedding_client = embedding_client
+        # used by the intent classifier of the reasoner, kept here for its stats
+        self.intent_result_cache = intent_result_cache
         self.action_runner = action_runner
         self.output_adapters = output_adapters
         self.reasoner = reasoner
         self.history_summarizer = history_summarizer
+        self.session_turn_scheduler = SessionTurnScheduler(cancel_stale_turn)
 
     async def greet(self, user_id: str) -> Any:
-        conversation = self.conversation_tracker.load_conversation(user_id)
+        conversation = await self.conversation_tracker.aload_conversation(user_id)
 
         action = self.reasoner.greet(conversation)
         action_response = self.action_runner.run(action, ActionContext(conversation))
         response = await self.output_adapter.process_output(action_response)
-        self.conversation_tracker.save_conversation(user_id, conversation)
+        await self.conversation_tracker.asave_conversation(user_id, conversation)
         return response
 
     async def handle_message(
@@ -64,62 +84,204 @@ class BaseDialogManager:
         files: list[UploadFile] = None,
         file_urls: list[str] = None,
         is_email_request=False,
+        answer_stream: AnswerStream = None,
+        deadline: Deadline = None,
+    ) -> tuple[Any, ConversationContext]:
+        with stage_timer("turn"):
+            return await self.session_turn_scheduler.run(
+                session_id,
+                lambda: self._handle_message(
+                    message, session_id, first_file_name, files, file_urls, is_email_request, answer_stream, deadline
+                ),
+            )
+
+    async def _handle_message(
+        self,
+        message: Any,
+        session_id: str,
+        first_file_name: str = None,
+        files: list[UploadFile] = None,
+        file_urls: list[str] = None,
+        is_email_request=False,
+        answer_stream: AnswerStream = None,
+        deadline: Deadline = None,
     ) -> tuple[Any, ConversationContext]:
         if files is None:
             files = []
         if file_urls is None:
             file_urls = []
-        self.conversation_tracker.clear_inactive_conversations()
-        conversation = self.conversation_tracker.load_conversation(session_id)
-        conversation.start_one_chat()
-        logger.info(f"current intent is {conversation.current_intent}")
-        conversation.current_user_input = message
-        conversation.current_new_request = None
-        conversation.append_user_history(message, first_file_name)
-        conversation.add_files(files)
-        conversation.add_file_urls(file_urls)
-        conversation.set_email_request(is_email_request)
-
-        plan = await self.reasoner.think(conversation)
-
-        action_response = await self.action_runner.run(plan.action, ActionContext(conversation))
-        for output_adapter in self.output_adapters:
-            action_response = await output_adapter.process_output(action_response, conversation)
+        conversation = await self.conversation_tracker.aload_conversation(session_id)
+        # an aborted turn leaves the session as it was before, not only its history
+        turn_state = conversation.save_turn_state()
+        try:
+            conversation.start_one_chat()
+            logger.info(f"current intent is {conversation.current_intent}")
+            conversation.current_user_input = message
+            conversation.current_new_request = None
+            # stored before the history changes, a rejected upload leaves the conversation as it was
+            await conversation.add_files(files)
+            conversation.append_user_history(message, first_file_name)
+            conversation.add_file_urls(file_urls)
+            conversation.set_email_request(is_email_request)
+
+            with deadline_scope(deadline):
+                plan = await self.reasoner.think(conversation)
+
+                # email answers are rewritten by the email output adapter, so their raw deltas are never streamed
+                if is_email_request:
+                    answer_stream = None
+                action_context = ActionContext(conversation, answer_stream, deadline)
+                with stage_timer("action"):
+                    action_response = await self.action_runner.run(plan.action, action_context)
+                for output_adapter in self.output_adapters:
+                    with stage_timer(f"output_adapter.{type(output_adapter).__name__}"):
+                        action_response = await output_adapter.process_output(action_response, conversation)
+        except (asyncio.CancelledError, DeadlineExceededException) as err:
+            logger.info(f"turn of session {conversation.session_id} is aborted by {err!r}, roll back its state")
+            conversation.restore_turn_state(turn_state)
+            raise
         response = action_response
         conversation.append_assistant_history(response.answer)
-        if summarize_history_feature_toggle is True:
-            await self.history_summarizer.summarize_history(conversation)
-        self.conversation_tracker.save_conversation(conversation.session_id, conversation)
         conversation.current_round += 1
         if isinstance(response, JumpOutResponse):
             conversation.set_start_new_question(True)
+        # saved after the last change of the turn, a store backed tracker keeps a copy instead of the object
+        await self.conversation_tracker.asave_conversation(conversation.session_id, conversation)
+        if summarize_history_feature_toggle is True:
+            # the summary is merged in the background and saved into the session, off the response path
+            self.history_summarizer.summarize_in_background(conversation, self.save_history_summary)
         return response, conversation
 
+    async def save_history_summary(self, session_id: str, summary: str, summarized_through_round_id: int):
+        async def save():
+            conversation = await self.conversation_tracker.aload_conversation(session_id)
+            if conversation.apply_history_summary(summary, summarized_through_round_id):
+                await self.conversation_tracker.asave_conversation(session_id, conversation)
+
+        await self.session_turn_scheduler.run_between_turns(session_id, save)
+
 
 class DialogManagerFactory:
+    model_type = "azure-gpt-3.5-2"
+    action_model_type = "azure-gpt-3.5-2"
+
+    pwd = os.path.dirname(os.path.abspath(__file__))
+    intent_config_file_path = os.path.join(pwd, "../", "resources", "scenes")
+    prompt_template_folder = os.path.join(pwd, "..", "resources", "prompt_templates")
+
     @classmethod
     def create_dialog_manager(cls):
-        model_type = "azure-gpt-3.5-2"
-        action_model_type = "azure-gpt-3.5-2"
+        embedding_model = EmbeddingModel()
+        embedding_client = cls.create_embedding_client(embedding_model)
+        intent_result_cache = cls.create_intent_result_cache(embedding_model)
+        reasoner = cls.create_reasoner(
+            cls.model_type,
+            cls.action_model_type,
+            embedding_model,
+            MilvusForLangchain(embedding_model, MilvusConnection()),
+            IntentListConfig.from_scenes(cls.intent_config_file_path),
+            BasePromptManager(cls.prompt_template_folder),
+            cls.create_intent_example_index(embedding_model, embedding_client),
+            embedding_client,
+            intent_result_cache,
+        )
+        return cls.assemble_dialog_manager(
+            reasoner, create_conversation_tracker(), embedding_client, intent_result_cache
+        )
+
+    @classmethod
+    async def acreate_dialog_manager(cls, startup_tracker: StartupTracker):
+        """initialize independent components concurrently, then wire them up and mark the process as ready"""
+        embedding_model, intent_list_config, prompt_manager, conversation_tracker, _, _ = await asyncio.gather(
+            startup_tracker.init_component("embedding_model", EmbeddingModel),
+            startup_tracker.init_component(
+                "intent_list_config", IntentListConfig.from_scenes, cls.intent_config_file_path
+            ),
+            startup_tracker.init_component("prompt_manager", cls.create_prompt_manager),
+            # a journaled tracker replays its journal when created
+            startup_tracker.init_component("conversation_tracker", create_conversation_tracker),
+            startup_tracker.init_component("action_repository", action_repository.warm_up),
+            startup_tracker.init_component("tiktoken_encodings", prime_tiktoken_encodings),
+        )
+        embedding_client = cls.create_embedding_client(embedding_model)
+        milvus_for_langchain, intent_example_index, intent_result_cache = await asyncio.gather(
+            startup_tracker.init_component("milvus", lambda: MilvusForLangchain(embedding_model, MilvusConnection())),
+            startup_tracker.init_component(
+                "intent_example_index", cls.create_intent_example_index, embedding_model, embedding_client
+            ),
+            startup_tracker.init_component("intent_result_cache", cls.create_intent_result_cache, embedding_model),
+        )
+        reasoner = await startup_tracker.init_component(
+            "reasoner",
+            cls.create_reasoner,
+            cls.model_type,
+            cls.action_model_type,
+            embedding_model,
+            milvus_for_langchain,
+            intent_list_config,
+            prompt_manager,
+            intent_example_index,
+            embedding_client,
+            intent_result_cache,
+        )
+        dialog_manager = cls.assemble_dialog_manager(
+            reasoner, conversation_tracker, embedding_client, intent_result_cache
+        )
+        startup_tracker.mark_ready()
+        return dialog_manager
 
-        pwd = os.path.dirname(os.path.abspath(__file__))
-        intent_config_file_path = os.path.join(pwd, "../", "resources", "scenes")
-        pwd = os.path.dirname(os.path.abspath(__file__))
-        prompt_template_folder = os.path.join(pwd, "..", "resources", "prompt_templates")
+    @classmethod
+    def create_embedding_client(cls, embedding_model: EmbeddingModel) -> BatchedEmbeddingClient:
+        """embeds utterances on the serving path, concurrent ones in one call of the embedding model"""
+        return BatchedEmbeddingClient(
+            model=getattr(embedding_model, "model_name", type(embedding_model).__name__),
+            embed_documents=embedding_model.embed_documents,
+        )
 
-        reasoner = cls.create_reasoner(
-            model_type,
-            action_model_type,
-            intent_config_file_path,
-            prompt_template_folder,
+    @classmethod
+    def create_intent_example_index(
+        cls, embedding_model: EmbeddingModel, embedding_client: Optional[BatchedEmbeddingClient] = None
+    ) -> Optional[IntentExampleIndex]:
+        if not intent_example_index_feature_toggle:
+            return None
+        return IntentExampleIndex.from_scenes(
+            cls.intent_config_file_path, embedding_model, embedding_client=embedding_client
         )
 
+    @classmethod
+    def create_intent_result_cache(cls, embedding_model: EmbeddingModel) -> Optional[SemanticIntentCache]:
+        if not intent_result_cache_feature_toggle:
+            return None
+        return SemanticIntentCache(embedding_model.embed_query, hash_scenes(cls.intent_config_file_path))
+
+    @classmethod
+    def create_lexical_intent_router(cls, intent_list_config: IntentListConfig) -> Optional[LexicalIntentRouter]:
+        if not lexical_intent_router_feature_toggle:
+            return None
+        return LexicalIntentRouter.from_intent_list_config(intent_list_config)
+
+    @classmethod
+    def create_prompt_manager(cls) -> BasePromptManager:
+        prompt_manager = BasePromptManager(cls.prompt_template_folder)
+        prompt_manager.preload()
+        return prompt_manager
+
+    @classmethod
+    def assemble_dialog_manager(
+        cls,
+        reasoner: Reasoner,
+        conversation_tracker: ConversationTracker,
+        embedding_client: Optional[BatchedEmbeddingClient] = None,
+        intent_result_cache: Optional[SemanticIntentCache] = None,
+    ) -> BaseDialogManager:
         return BaseDialogManager(
-            BaseConversationTracker(),
+            conversation_tracker,
             reasoner,
             SimpleActionRunner(),
             [BaseOutputAdapter(), EmailOutputAdapter()],
             HistorySummarizer(),
+            embedding_client=embedding_client,
+            intent_result_cache=intent_result_cache,
         )
 
     @classmethod
@@ -127,20 +289,24 @@ class DialogManagerFactory:
         cls,
         model_type,
         action_model_type,
-        intent_config_file_path,
-        prompt_template_folder,
+        embedding_model: EmbeddingModel,
+        milvus_for_langchain: MilvusForLangchain,
+        intent_list_config: IntentListConfig,
+        prompt_manager: BasePromptManager,
+        intent_example_index: Optional[IntentExampleIndex] = None,
+        embedding_client: Optional[BatchedEmbeddingClient] = None,
+        intent_result_cache: Optional[SemanticIntentCache] = None,
     ):
-        embedding_model = EmbeddingModel()
-
-        intent_list_config = IntentListConfig.from_scenes(intent_config_file_path)
-        prompt_manager = BasePromptManager(prompt_template_folder)
-
         classifier = LLMIntentClassifier(
             embedding_model=embedding_model,
-            milvus_for_langchain=MilvusForLangchain(embedding_model, MilvusConnection()),
+            milvus_for_langchain=milvus_for_langchain,
             intent_list_config=intent_list_config,
             model_type=model_type,
             prompt_manager=prompt_manager,
+            intent_example_index=intent_example_index,
+            intent_result_cache=intent_result_cache,
+            lexical_intent_router=cls.create_lexical_intent_router(intent_list_config),
+            embedding_client=embedding_client,
         )
 
         form_store = FormStore(intent_list_config)
@@ -0,0 +1,81 @@
+import asyncio
+import inspect
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Optional, TypeVar
+
+from loguru import logger
+
+ui_request_timeout_seconds = float(os.getenv("UI_REQUEST_TIMEOUT_SECONDS", 90))
+email_request_timeout_seconds = float(os.getenv("EMAIL_REQUEST_TIMEOUT_SECONDS", 300))
+
+T = TypeVar("T")
+
+
+class DeadlineExceededException(Exception):
+    def __init__(self, operation: str):
+        super().__init__(f"deadline exceeded before {operation} finished")
+        self.operation = operation
+
+
+class Deadline:
+    """The time budget of one request, shared by every LLM and search call made while serving it."""
+
+    def __init__(self, timeout: float, expires_at: float = None):
+        self.timeout = timeout
+        self.expires_at = expires_at if expires_at is not None else time.monotonic() + timeout
+
+    @classmethod
+    def for_request(cls, is_email_request: bool) -> "Deadline":
+        return cls(email_request_timeout_seconds if is_email_request else ui_request_timeout_seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def reserve(self, seconds: float) -> "Deadline":
+        """an earlier deadline that keeps some budget back, e.g. to assemble a partial answer after sub calls"""
+        return Deadline(self.timeout, self.expires_at - seconds)
+
+    def check(self, operation: str):
+        if self.expired():
+            raise DeadlineExceededException(operation)
+
+    async def run(self, awaitable: Awaitable[T], operation: str) -> T:
+        """await with the remaining budget as timeout, the awaitable is cancelled when the budget runs out"""
+        if self.expired():
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceededException(operation)
+        try:
+            return await asyncio.wait_for(awaitable, timeout=self.remaining())
+        except asyncio.TimeoutError:
+            # a timeout raised by the call itself, not by the deadline
+            if not self.expired():
+                raise
+            logger.warning(f"deadline exceeded, {operation} is cancelled")
+            raise DeadlineExceededException(operation)
+
+
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar("current_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]):
+    """calls made in this scope, including tasks created in it, are bounded by the deadline"""
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+async def run_within_deadline(awaitable: Awaitable[T], operation: str) -> T:
+    deadline = current_deadline.get()
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(awaitable, operation)
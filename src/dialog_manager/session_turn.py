@@ -0,0 +1,88 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from loguru import logger
+
+
+class StaleTurnCancelledException(Exception):
+    def __init__(self, session_id: str):
+        super().__init__(f"turn of session {session_id} is cancelled by a newer message")
+        self.session_id = session_id
+
+
+class SessionTurnScheduler:
+    """
+    Runs the turns of one session one after another, so they never mutate the same conversation concurrently.
+    With cancel_stale_turn, a newer message of the session cancels the in-flight turn and drops the queued ones.
+    """
+
+    def __init__(self, cancel_stale_turn: bool = False):
+        self.cancel_stale_turn = cancel_stale_turn
+        self.locks: dict[str, asyncio.Lock] = {}
+        self.pending_turns: dict[str, int] = {}
+        self.latest_tickets: dict[str, int] = {}
+        self.running_turns: dict[str, asyncio.Task] = {}
+        self.stale_turns: set[asyncio.Task] = set()
+
+    def _enter(self, session_id: str) -> int:
+        self.locks.setdefault(session_id, asyncio.Lock())
+        self.pending_turns[session_id] = self.pending_turns.get(session_id, 0) + 1
+        ticket = self.latest_tickets.get(session_id, 0) + 1
+        self.latest_tickets[session_id] = ticket
+        return ticket
+
+    def _leave(self, session_id: str):
+        self.pending_turns[session_id] -= 1
+        if self.pending_turns[session_id] == 0:
+            del self.pending_turns[session_id]
+            del self.locks[session_id]
+            self.latest_tickets.pop(session_id, None)
+
+    def _cancel_running_turn(self, session_id: str):
+        running_turn = self.running_turns.get(session_id)
+        if running_turn and not running_turn.done():
+            logger.info(f"cancel stale turn of session {session_id}")
+            self.stale_turns.add(running_turn)
+            running_turn.cancel()
+
+    async def run(self, session_id: str, turn: Callable[[], Awaitable[Any]]) -> Any:
+        if not session_id:
+            return await turn()
+
+        ticket = self._enter(session_id)
+        try:
+            if self.cancel_stale_turn:
+                self._cancel_running_turn(session_id)
+            async with self.locks[session_id]:
+                if self.cancel_stale_turn and ticket != self.latest_tickets[session_id]:
+                    raise StaleTurnCancelledException(session_id)
+                task = asyncio.ensure_future(turn())
+                self.running_turns[session_id] = task
+                try:
+                    return await task
+                except asyncio.CancelledError:
+                    if task in self.stale_turns:
+                        raise StaleTurnCancelledException(session_id)
+                    raise
+                finally:
+                    self.stale_turns.discard(task)
+                    if self.running_turns.get(session_id) is task:
+                        del self.running_turns[session_id]
+        finally:
+            self._leave(session_id)
+
+    async def run_between_turns(self, session_id: str, work: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        run work on the session while none of its turns runs, e.g. saving a result computed in the background.
+        It neither cancels a turn nor makes a queued turn stale
+        """
+        self.locks.setdefault(session_id, asyncio.Lock())
+        self.pending_turns[session_id] = self.pending_turns.get(session_id, 0) + 1
+        try:
+            async with self.locks[session_id]:
+                return await work()
+        finally:
+            self._leave(session_id)
+
+    def in_flight_session_count(self) -> int:
+        return len(self.pending_turns)
@@ -0,0 +1,50 @@
+import asyncio
+import time
+from typing import Any, Callable, Optional
+
+import tiktoken
+from loguru import logger
+
+tiktoken_models = ["gpt-4", "gpt2"]
+
+
+def prime_tiktoken_encodings():
+    for model in tiktoken_models:
+        tiktoken.encoding_for_model(model)
+
+
+class StartupTracker:
+    """Records how long each component takes to initialize and whether the process is warm enough for traffic."""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.component_init_seconds: dict[str, float] = {}
+        self.failed_components: dict[str, str] = {}
+        self.total_seconds: Optional[float] = None
+        self.ready = False
+
+    async def init_component(self, name: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """run the blocking initializer in a worker thread, so independent components initialize concurrently"""
+        start_time = time.monotonic()
+        try:
+            result = await asyncio.to_thread(func, *args, **kwargs)
+        except Exception as err:
+            self.failed_components[name] = str(err)
+            logger.error(f"failed to initialize component {name}: {err}")
+            raise
+        self.component_init_seconds[name] = time.monotonic() - start_time
+        logger.info(f"component {name} initialized in {self.component_init_seconds[name]:.3f}s")
+        return result
+
+    def mark_ready(self):
+        self.total_seconds = time.monotonic() - self.started_at
+        self.ready = True
+        logger.info(f"startup finished in {self.total_seconds:.3f}s")
+
+    def status(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "failed" if self.failed_components else "starting",
+            "total_seconds": self.total_seconds,
+            "components": self.component_init_seconds,
+            "failed_components": self.failed_components,
+        }
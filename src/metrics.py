@@ -0,0 +1,169 @@
+import math
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterator, Sequence
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, math.inf)
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], **extra_labels) -> str:
+    labels = [*zip(labelnames, labelvalues), *extra_labels.items()]
+    if not labels:
+        return ""
+    escaped = [
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == math.inf else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: dict[tuple[str, ...], float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self.values[tuple(str(labels.get(name, "")) for name in self.labelnames)] += amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labelvalues, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels):
+        self.values[tuple(str(labels.get(name, "")) for name in self.labelnames)] = value
+
+    def render(self) -> list[str]:
+        return [line.replace(" counter", " gauge") if line.startswith("# TYPE") else line for line in super().render()]
+
+
+class Histogram:
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) if math.inf in buckets else (*sorted(buckets), math.inf)
+        self.bucket_counts: dict[tuple[str, ...], list[int]] = {}
+        self.sums: dict[tuple[str, ...], float] = defaultdict(float)
+
+    def observe(self, value: float, **labels):
+        labelvalues = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        counts = self.bucket_counts.setdefault(labelvalues, [0] * len(self.buckets))
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                counts[index] += 1
+        self.sums[labelvalues] += value
+
+    def get_count(self, **labels) -> int:
+        counts = self.bucket_counts.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return counts[-1] if counts else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labelvalues, counts in self.bucket_counts.items():
+            for upper_bound, count in zip(self.buckets, counts):
+                bucket_labels = _format_labels(self.labelnames, labelvalues, le=_format_value(upper_bound))
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self.sums[labelvalues])}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        counter = Counter(name, documentation, labelnames)
+        self.metrics.append(counter)
+        return counter
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        gauge = Gauge(name, documentation, labelnames)
+        self.metrics.append(gauge)
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Histogram:
+        histogram = Histogram(name, documentation, labelnames)
+        self.metrics.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        """render all metrics in the prometheus text exposition format"""
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+
+pipeline_stage_seconds = registry.histogram(
+    "dialog_pipeline_stage_seconds", "Latency of each stage of the dialog pipeline.", ["stage"]
+)
+llm_call_seconds = registry.histogram(
+    "llm_call_seconds", "Latency of LLM calls by scenario and sub scenario.", ["scenario", "sub_scenario"]
+)
+unified_search_seconds = registry.histogram(
+    "unified_search_request_seconds", "Latency of unified search requests by endpoint.", ["endpoint"]
+)
+errors_total = registry.counter("dialog_errors_total", "Errors raised by pipeline stages and calls.", ["kind", "name"])
+cache_requests_total = registry.counter(
+    "cache_requests_total", "Cache lookups by cache and result.", ["cache", "result"]
+)
+sessions_expired_total = registry.counter("sessions_expired_total", "Inactive sessions expired in the background.")
+session_expiry_seconds = registry.histogram("session_expiry_seconds", "Duration of one background expiry run.")
+tracked_sessions = registry.gauge("tracked_sessions", "Sessions waiting for expiry in this process.")
+tracker_cache_bytes = registry.gauge("tracker_cache_bytes", "Estimated size of the sessions cached in memory.")
+tracker_spilled_sessions = registry.gauge("tracker_spilled_sessions", "Sessions spilled from memory to disk.")
+lexical_router_decisions_total = registry.counter(
+    "lexical_router_decisions_total", "Lexical router decisions, saved ones skip an intent LLM call.", ["result"]
+)
+speculative_intent_classifications_total = registry.counter(
+    "speculative_intent_classifications_total", "Intent classifications run alongside the same topic check.", ["result"]
+)
+upload_store_bytes = registry.gauge("upload_store_bytes", "Size of the distinct uploaded files kept on disk.")
+
+
+def count_error(kind: str, name: str):
+    errors_total.inc(kind=kind, name=name)
+
+
+def count_cache_lookup(cache: str, hit: bool):
+    cache_requests_total.inc(cache=cache, result="hit" if hit else "miss")
+
+
+@contextmanager
+def _observe(histogram: Histogram, error_kind: str, error_name: str, **labels) -> Iterator[None]:
+    start_time = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        count_error(error_kind, error_name)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start_time, **labels)
+
+
+def stage_timer(stage: str):
+    return _observe(pipeline_stage_seconds, "stage", stage, stage=stage)
+
+
+def llm_timer(scenario: str, sub_scenario: str = ""):
+    return _observe(llm_call_seconds, "llm", scenario, scenario=scenario, sub_scenario=sub_scenario)
+
+
+def search_timer(endpoint: str):
+    return _observe(unified_search_seconds, "unified_search", endpoint, endpoint=endpoint)
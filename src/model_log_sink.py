@@ -0,0 +1,231 @@
+import asyncio
+import json
+import os
+import sqlite3
+from datetime import datetime
+from typing import Any, Optional
+
+from loguru import logger
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool
+
+model_log_sink_type = os.getenv("MODEL_LOG_SINK", "pg").lower()
+model_log_sqlite_path = os.getenv("MODEL_LOG_SQLITE_PATH", "model_log.db")
+model_log_queue_size = int(os.getenv("MODEL_LOG_QUEUE_SIZE", 1000))
+model_log_batch_size = int(os.getenv("MODEL_LOG_BATCH_SIZE", 50))
+model_log_flush_interval = float(os.getenv("MODEL_LOG_FLUSH_INTERVAL_SECONDS", 2))
+model_log_drop_when_full = os.getenv("MODEL_LOG_DROP_WHEN_FULL", "True") == "True"
+model_log_put_timeout = float(os.getenv("MODEL_LOG_PUT_TIMEOUT_SECONDS", 1))
+# empty connection info connects with the PGHOST, PGUSER, PGPASSWORD and PGDATABASE environment variables
+model_log_pg_conninfo = os.getenv("MODEL_LOG_PG_CONNINFO", "")
+model_log_pg_table = os.getenv("MODEL_LOG_PG_TABLE", "model_log")
+model_log_pg_pool_size = int(os.getenv("MODEL_LOG_PG_POOL_SIZE", 2))
+
+MODEL_LOG_COLUMNS = ("session_id", "scenario", "model", "messages", "response", "extra", "err_msg", "created_at")
+
+
+def model_log_row(record: dict[str, Any]) -> tuple:
+    return (
+        record["session_id"],
+        record["scenario"],
+        record["model"],
+        json.dumps(record["messages"], ensure_ascii=False, default=str),
+        record["response"],
+        json.dumps(record["extra"], ensure_ascii=False, default=str),
+        record["err_msg"],
+        record["created_at"],
+    )
+
+
+class ModelLogWriter:
+    async def write_batch(self, records: list[dict[str, Any]]):
+        raise NotImplementedError
+
+    async def close(self):
+        """release the connections, on shutdown"""
+
+
+class PGModelLogWriter(ModelLogWriter):
+    """writes each batch with one executemany on a pooled connection, instead of one insert per record"""
+
+    def __init__(
+        self,
+        conninfo: str = model_log_pg_conninfo,
+        table: str = model_log_pg_table,
+        pool_size: int = model_log_pg_pool_size,
+    ):
+        # opened by the first batch, on the event loop of the sink
+        self.pool = AsyncConnectionPool(conninfo, min_size=1, max_size=pool_size, open=False)
+        self.insert = sql.SQL("insert into {} ({}) values ({})").format(
+            sql.Identifier(*table.split(".")),
+            sql.SQL(", ").join(map(sql.Identifier, MODEL_LOG_COLUMNS)),
+            sql.SQL(", ").join(sql.Placeholder() * len(MODEL_LOG_COLUMNS)),
+        )
+
+    async def write_batch(self, records: list[dict[str, Any]]):
+        if self.pool.closed:
+            await self.pool.open()
+        async with self.pool.connection() as con:
+            async with con.cursor() as cursor:
+                await cursor.executemany(self.insert, [model_log_row(record) for record in records])
+
+    async def close(self):
+        await self.pool.close()
+
+
+class SQLiteModelLogWriter(ModelLogWriter):
+    """local stand-in of the PG model log table, so the sink can be used and tested offline"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with sqlite3.connect(self.db_path) as con:
+            con.execute(
+                """create table if not exists model_log
+                (
+                    id         INTEGER primary key autoincrement,
+                    session_id TEXT,
+                    scenario   TEXT,
+                    model      TEXT,
+                    messages   TEXT,
+                    response   TEXT,
+                    extra      TEXT,
+                    err_msg    TEXT,
+                    created_at TEXT
+                )"""
+            )
+
+    def _insert(self, records: list[dict[str, Any]]):
+        with sqlite3.connect(self.db_path) as con:
+            con.executemany(
+                "insert into model_log (session_id, scenario, model, messages, response, extra, err_msg, created_at) "
+                "values (?, ?, ?, ?, ?, ?, ?, ?)",
+                [model_log_row(record) for record in records],
+            )
+
+    async def write_batch(self, records: list[dict[str, Any]]):
+        await asyncio.to_thread(self._insert, records)
+
+
+class BatchedModelLogSink:
+    """
+    Process-wide sink of model logs: records are buffered in a bounded queue and written in batches
+    when the batch is full or the flush interval has passed, off the request path.
+    """
+
+    def __init__(
+        self,
+        writer: ModelLogWriter,
+        max_queue_size: int = model_log_queue_size,
+        batch_size: int = model_log_batch_size,
+        flush_interval: float = model_log_flush_interval,
+        drop_when_full: bool = model_log_drop_when_full,
+        put_timeout: float = model_log_put_timeout,
+    ):
+        self.writer = writer
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_when_full = drop_when_full
+        self.put_timeout = put_timeout
+        self.queue: Optional[asyncio.Queue] = None
+        self.runner: Optional[asyncio.Task] = None
+        self.written_count = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+
+    def start(self):
+        if self.runner is None:
+            self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self.runner = asyncio.create_task(self._run())
+
+    async def log(
+        self,
+        session_id: str,
+        scenario: str,
+        model: str,
+        messages: list[dict],
+        response: str,
+        extra: dict,
+        err_msg: str,
+    ) -> bool:
+        """returns False when the record is dropped because the sink is not running or the queue stays full"""
+        if self.runner is None:
+            self.dropped_count += 1
+            return False
+        record = dict(
+            session_id=session_id,
+            scenario=scenario,
+            model=model,
+            messages=messages,
+            response=response,
+            extra=extra,
+            err_msg=err_msg,
+            created_at=datetime.now().isoformat(),
+        )
+        try:
+            if self.drop_when_full:
+                self.queue.put_nowait(record)
+            else:
+                await asyncio.wait_for(self.queue.put(record), timeout=self.put_timeout)
+            return True
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self.dropped_count += 1
+            logger.warning(f"model log queue is full, drop the log of session {session_id}")
+            return False
+
+    async def _next_batch(self) -> tuple[list[dict[str, Any]], bool]:
+        loop = asyncio.get_running_loop()
+        batch = []
+        record = await self.queue.get()
+        deadline = loop.time() + self.flush_interval
+        while record is not None:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                return batch, False
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                return batch, False
+            try:
+                record = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return batch, False
+        return batch, True
+
+    async def _write(self, batch: list[dict[str, Any]]):
+        if not batch:
+            return
+        try:
+            await self.writer.write_batch(batch)
+            self.written_count += len(batch)
+        except Exception as err:
+            self.failed_count += len(batch)
+            logger.error(f"failed to write {len(batch)} model logs: {err}")
+
+    async def _run(self):
+        closing = False
+        while not closing:
+            batch, closing = await self._next_batch()
+            await self._write(batch)
+
+    async def shutdown(self):
+        """flush everything queued so far and stop the sink"""
+        if self.runner is None:
+            return
+        await self.queue.put(None)
+        await self.runner
+        self.runner = None
+        await self.writer.close()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "written": self.written_count,
+            "dropped": self.dropped_count,
+            "failed": self.failed_count,
+        }
+
+
+def create_model_log_sink() -> BatchedModelLogSink:
+    if model_log_sink_type == "sqlite":
+        return BatchedModelLogSink(SQLiteModelLogWriter(model_log_sqlite_path))
+    return BatchedModelLogSink(PGModelLogWriter())
@@ -0,0 +1,52 @@
+from gluon_meson_sdk.models.scenario_model_registry.base import DefaultScenarioModelRegistryCenter
+
+from dialog_manager.deadline import run_within_deadline
+from metrics import llm_timer
+
+
+class InstrumentedChatModel:
+    """
+    wraps a scenario chat model, records the latency of every call by scenario and sub scenario
+    and bounds the call by the deadline of the current request
+    """
+
+    def __init__(self, chat_model, scenario: str):
+        self.chat_model = chat_model
+        self.scenario = scenario
+
+    async def achat(self, *args, sub_scenario: str = None, **kwargs):
+        if sub_scenario is not None:
+            kwargs["sub_scenario"] = sub_scenario
+        with llm_timer(self.scenario, sub_scenario or ""):
+            return await run_within_deadline(
+                self.chat_model.achat(*args, **kwargs), f"llm call {self.scenario} {sub_scenario or ''}".strip()
+            )
+
+    def __getattr__(self, name):
+        # only called for attributes missing on the wrapper, e.g. astream when the model supports it
+        attribute = getattr(self.chat_model, name)
+        if name == "astream":
+            return self._timed_stream(attribute)
+        return attribute
+
+    def _timed_stream(self, astream):
+        async def timed_astream(*args, sub_scenario: str = None, **kwargs):
+            """the latency covers the whole stream, until its last delta or until the caller closes it"""
+            if sub_scenario is not None:
+                kwargs["sub_scenario"] = sub_scenario
+            with llm_timer(self.scenario, sub_scenario or ""):
+                deltas = astream(*args, **kwargs)
+                try:
+                    async for delta in deltas:
+                        yield delta
+                finally:
+                    if hasattr(deltas, "aclose"):
+                        await deltas.aclose()
+
+        return timed_astream
+
+
+class InstrumentedScenarioModelRegistryCenter(DefaultScenarioModelRegistryCenter):
+    async def get_model(self, scenario: str, *args, **kwargs):
+        chat_model = await super().get_model(scenario, *args, **kwargs)
+        return InstrumentedChatModel(chat_model, scenario)
@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import aiohttp
+import numpy as np
+from loguru import logger
+
+from metrics import count_cache_lookup, count_error
+
+embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+embedding_batch_wait_seconds = float(os.getenv("EMBEDDING_BATCH_WAIT_SECONDS", 0.01))
+embedding_lru_size = int(os.getenv("EMBEDDING_LRU_SIZE", 10000))
+embedding_store_dir = os.getenv("EMBEDDING_STORE_DIR")
+embedding_timeout_seconds = 30
+# known embedding size of the sentence transformers
+embedding_sizes = {"m3e-base": 768}
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+class EmbeddingVectorStore:
+    """
+    Vectors on disk in one float32 file read through a memory map, with the text keys in a file of their own.
+    Both files are only appended to, rows torn by a crash are cut off when the store is opened again.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self.keys_path = os.path.join(store_dir, "keys.txt")
+        self.vectors_path = os.path.join(store_dir, "vectors.f32")
+        self.meta_path = os.path.join(store_dir, "meta.json")
+        # guards the rows and the memory map, the appends to the files are serialized by write_lock
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.rows: dict[str, int] = {}
+        self.dimension: Optional[int] = None
+        self.vectors: Optional[np.memmap] = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dimension = json.load(f)["dimension"]
+            keys = []
+            if os.path.exists(self.keys_path):
+                with open(self.keys_path) as f:
+                    # a key torn by a crash has no line end yet
+                    keys = f.read().split("\n")[:-1]
+            vector_bytes = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+            keys = keys[: min(len(keys), vector_bytes // (4 * self.dimension))]
+            self._truncate(keys)
+            self.rows = {key: row for row, key in enumerate(keys)}
+
+    def _truncate(self, keys: list[str]):
+        """drop the vectors and keys left over by a crash, so the rows appended next line up again"""
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(len(keys) * 4 * self.dimension)
+        temp_path = self.keys_path + ".part"
+        with open(temp_path, "w") as f:
+            f.write("".join(f"{key}\n" for key in keys))
+        os.replace(temp_path, self.keys_path)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rows
+
+    def get(self, key: str) -> Optional[list[float]]:
+        with self.lock:
+            row = self.rows.get(key)
+            if row is None:
+                return None
+            if self.vectors is None or len(self.vectors) <= row:
+                # remapped after the file grew, the rows only count vectors already written
+                self.vectors = np.memmap(
+                    self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.rows), self.dimension)
+                )
+            vectors = self.vectors
+        return vectors[row].tolist()
+
+    def add_many(self, items: list[tuple[str, list[float]]]):
+        with self.write_lock:
+            items = [(key, vector) for key, vector in items if key not in self.rows]
+            if not items:
+                return
+            if self.dimension is None:
+                self.dimension = len(items[0][1])
+                with open(self.meta_path, "w") as f:
+                    json.dump({"dimension": self.dimension}, f)
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.asarray([vector for _, vector in items], dtype=np.float32).tobytes())
+            with open(self.keys_path, "a") as f:
+                f.write("".join(f"{key}\n" for key, _ in items))
+            with self.lock:
+                for key, _ in items:
+                    self.rows[key] = len(self.rows)
+
+
+class BatchedEmbeddingClient:
+    """
+    Encodes texts without blocking the event loop. Texts requested at the same time are sent in one request,
+    and the vectors are cached by the normalized text, in memory and optionally on disk.
+    The request goes to the embedding endpoint, or to a blocking embed_documents function run in a thread.
+    """
+
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        model: str = "m3e-base",
+        batch_size: int = embedding_batch_size,
+        batch_wait_seconds: float = embedding_batch_wait_seconds,
+        lru_size: int = embedding_lru_size,
+        store_dir: Optional[str] = embedding_store_dir,
+        embed_documents: Optional[Callable[[list[str]], list[list[float]]]] = None,
+    ):
+        self.endpoint = endpoint
+        self.embed_documents = embed_documents
+        self.model = model
+        self.batch_size = batch_size
+        self.batch_wait_seconds = batch_wait_seconds
+        self.lru_size = lru_size
+        self.lru: OrderedDict[str, list[float]] = OrderedDict()
+        self.store = EmbeddingVectorStore(store_dir) if store_dir else None
+        # texts being encoded, a text requested again meanwhile waits for the same vector
+        self.encoding: dict[str, asyncio.Future] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self.runner: Optional[asyncio.Task] = None
+        self.requests: set[asyncio.Task] = set()
+
+    @property
+    def embedding_size(self) -> int:
+        if self.model not in embedding_sizes:
+            raise Exception("Unsupported model name!")
+        return embedding_sizes[self.model]
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    async def _cached(self, key: str) -> Optional[list[float]]:
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            return self.lru[key]
+        if self.store is None or key not in self.store:
+            return None
+        # read from the memory mapped file, in a thread
+        vector = await asyncio.to_thread(self.store.get, key)
+        if vector is not None:
+            self._remember(key, vector)
+        return vector
+
+    def _remember(self, key: str, vector: list[float]):
+        self.lru[key] = vector
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    async def encode(self, text: str) -> list[float]:
+        key = self._key(text)
+        vector = await self._cached(key)
+        count_cache_lookup("embedding", vector is not None)
+        if vector is not None:
+            return vector
+        if key not in self.encoding:
+            self.encoding[key] = asyncio.get_running_loop().create_future()
+            self._start()
+            self.queue.put_nowait((key, normalize_text(text)))
+        return await asyncio.shield(self.encoding[key])
+
+    async def encode_many(self, texts: list[str]) -> list[list[float]]:
+        return list(await asyncio.gather(*[self.encode(text) for text in texts]))
+
+    def _start(self):
+        if self.runner is None or self.runner.done():
+            self.queue = asyncio.Queue()
+            self.runner = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.batch_wait_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), max(0.0, deadline - time.monotonic())))
+                except asyncio.TimeoutError:
+                    break
+            # the next batch is collected while this one is requested
+            request = asyncio.create_task(self._encode_batch(batch))
+            self.requests.add(request)
+            request.add_done_callback(self.requests.discard)
+
+    async def _encode_batch(self, batch: list[tuple[str, str]]):
+        try:
+            vectors = await self.request([text for _, text in batch])
+        except Exception as err:
+            logger.error(f"failed to encode {len(batch)} texts: {err}")
+            count_error("embedding", self.model)
+            for key, _ in batch:
+                self.encoding.pop(key).set_exception(err)
+            return
+        for (key, _), vector in zip(batch, vectors):
+            self._remember(key, vector)
+            self.encoding.pop(key).set_result(vector)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.add_many, [(key, vector) for (key, _), vector in zip(batch, vectors)])
+
+    async def request(self, texts: list[str]) -> list[list[float]]:
+        if self.embed_documents is not None:
+            embeddings = await asyncio.to_thread(self.embed_documents, texts)
+        else:
+            embeddings = await self.request_endpoint(texts)
+        if len(embeddings) != len(texts):
+            raise ValueError(f"got {len(embeddings)} embeddings for {len(texts)} texts")
+        return [list(embedding) for embedding in embeddings]
+
+    async def request_endpoint(self, texts: list[str]) -> list[list[float]]:
+        body = {"model": self.model, "query": texts, "normalize_embeddings": False}
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=embedding_timeout_seconds)) as session:
+            async with session.post(self.endpoint, json=body, headers={"accept": "application/json"}) as resp:
+                resp.raise_for_status()
+                return (await resp.json())["embeddings"]
+
+    async def shutdown(self):
+        """stop collecting batches, cancel the requests in flight and the texts still waiting for them"""
+        tasks = [self.runner, *self.requests] if self.runner else list(self.requests)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for future in self.encoding.values():
+            if not future.done():
+                future.cancel()
+        self.encoding.clear()
+        self.requests.clear()
+        self.runner = None
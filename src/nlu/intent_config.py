@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 
 import yaml
 
@@ -57,6 +58,7 @@ class IntentListConfig:
     def __init__(self, intents: list[IntentConfig]):
         self.intents = intents
         self._initialize_fixed_intents()
+        self._build_indexes()
 
     def _initialize_fixed_intents(self):
         fixed_intents = [
@@ -69,25 +71,90 @@ class IntentListConfig:
             intent = IntentConfig(name, description, business, action, slots, disabled)
             self.intents.append(intent)
 
+    def _build_indexes(self):
+        """
+        lookups of every turn are answered from indexes built once, the first intent of a duplicated name wins as in
+        a scan of the list
+        """
+        self.intents_by_name: dict[str, IntentConfig] = {}
+        self.intents_by_full_name: dict[str, IntentConfig] = {}
+        self.intents_by_parent: dict[Optional[str], list[IntentConfig]] = {}
+        for intent in self.intents:
+            self.intents_by_name.setdefault(intent.name, intent)
+            self.intents_by_full_name.setdefault(intent.get_full_intent_name(), intent)
+            self.intents_by_parent.setdefault(intent.full_name_of_parent_intent, []).append(intent)
+        self.intent_names_by_parent: dict[Optional[str], list[str]] = {
+            parent: [intent.name for intent in intents if intent.name != "unknown"]
+            for parent, intents in self.intents_by_parent.items()
+        }
+        # descendants by the full name of the intent, with the same prefix match as is_ancestor_of
+        self.descendant_intents: dict[str, list[IntentConfig]] = {
+            intent.get_full_intent_name(): [
+                descendant for descendant in self.intents if intent.is_ancestor_of(descendant)
+            ]
+            for intent in self.intents
+            if intent.has_children
+        }
+        self.ancestor_intents: dict[str, list[IntentConfig]] = {}
+        for intent in self.intents:
+            names = (intent.full_name_of_parent_intent or "").split(".")
+            ancestors = [self.intents_by_full_name.get(".".join(names[: index + 1])) for index in range(len(names))]
+            self.ancestor_intents.setdefault(
+                intent.get_full_intent_name(), [ancestor for ancestor in ancestors if ancestor]
+            )
+        self.leaf_intents: dict[Optional[str], list[IntentConfig]] = {}
+
     def get_intent_list(self) -> list[IntentConfig]:
         return self.intents
 
     def get_intent_name_list_by_their_parent_intent(self, parent_intent: str = None):
-        # read resources/intent.yaml file and get intent list
-        return [
-            intent.name
-            for intent in self.intents
-            if intent.name != "unknown" and intent.full_name_of_parent_intent == parent_intent
-        ]
+        return list(self.intent_names_by_parent.get(parent_intent, []))
+
+    def get_intents_by_parent_intent(self, parent_intent: str = None) -> list[IntentConfig]:
+        """intents of the layer under the parent intent, including unknown"""
+        return list(self.intents_by_parent.get(parent_intent, []))
 
     def get_children_intents(self, current_intent: IntentConfig):
-        children_intents = []
-        if current_intent.has_children:
+        if not current_intent.has_children:
+            return []
+        children_intents = self.descendant_intents.get(current_intent.get_full_intent_name())
+        if children_intents is None:
+            # an intent config which is not part of this list
             children_intents = [intent for intent in self.intents if current_intent.is_ancestor_of(intent)]
-        return children_intents
+        return list(children_intents)
 
     def get_intent(self, intent_name):
-        return next((intent for intent in self.intents if intent.name == intent_name), None)
+        return self.intents_by_name.get(intent_name)
+
+    def get_intent_by_full_name(self, full_intent_name: str):
+        return self.intents_by_full_name.get(full_intent_name)
+
+    def get_leaf_intents(self, parent_intent: str = None) -> list[IntentConfig]:
+        """intents without children under the parent intent, or in the whole tree when there is no parent"""
+        if parent_intent not in self.leaf_intents:
+            self.leaf_intents[parent_intent] = [
+                intent
+                for intent in self.intents
+                if intent.name != "unknown"
+                and not intent.has_children
+                and (
+                    parent_intent is None
+                    or intent.full_name_of_parent_intent == parent_intent
+                    or (intent.full_name_of_parent_intent or "").startswith(parent_intent + ".")
+                )
+            ]
+        return list(self.leaf_intents[parent_intent])
+
+    def get_ancestor_intents(self, intent: IntentConfig) -> list[IntentConfig]:
+        """from the root down to the parent of the intent"""
+        if not intent.full_name_of_parent_intent:
+            return []
+        ancestors = self.ancestor_intents.get(intent.get_full_intent_name())
+        if ancestors is None:
+            names = intent.full_name_of_parent_intent.split(".")
+            ancestors = [self.get_intent_by_full_name(".".join(names[: index + 1])) for index in range(len(names))]
+            ancestors = [ancestor for ancestor in ancestors if ancestor]
+        return list(ancestors)
 
     def get_intent_and_attrs(self):
         return [
@@ -2,9 +2,9 @@ from typing import List
 
 from gluon_meson_sdk.models.abstract_models.chat_message_preparation import ChatMessagePreparation
 from gluon_meson_sdk.models.chat_model import ChatModel
-from gluon_meson_sdk.models.scenario_model_registry.base import DefaultScenarioModelRegistryCenter
 from loguru import logger
 
+from models.chat_model.instrumented import InstrumentedScenarioModelRegistryCenter
 from nlu.base import EntityExtractor
 from nlu.forms import FormStore, Form
 from nlu.intent_with_entity import Entity, SlotType, Slot, Intent
@@ -41,7 +41,7 @@ class LLMEntityExtractor(EntityExtractor):
         self.prompt_manager = prompt_manager
         self.slot_extraction_prompt = prompt_manager.load("slot_extraction")
         self.examples = self.prepare_examples()
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = "llm_entity_extractor"
 
     def construct_messages(
@@ -55,7 +55,7 @@ class LLMEntityExtractor(EntityExtractor):
             self.slot_extraction_prompt.template,
             intent.name,
             form,
-            conversation_context.get_history().format_string_with_file_name(),
+            conversation_context.get_history_window(self.scenario_model).format_string_with_file_name(),
             conversation_context.get_file_name(),
             preparation,
         )
@@ -1,4 +1,7 @@
+import asyncio
 import json
+import os
+import re
 from typing import Any, Optional
 
 from gluon_meson_sdk.dbs.milvus.milvus_for_langchain import MilvusForLangchain
@@ -7,12 +10,17 @@ from langchain.schema import Document
 from loguru import logger
 from pymilvus import FieldSchema, DataType
 
+from caches.semantic_intent_cache import SemanticIntentCache
+from metrics import lexical_router_decisions_total, speculative_intent_classifications_total, stage_timer
+from models.embedding_model.batched import BatchedEmbeddingClient
 from nlu.base import IntentClassifier
 from nlu.intent_config import IntentListConfig
 from nlu.intent_with_entity import Intent
+from nlu.llm.intent_example_index import IntentExampleIndex
 from nlu.llm.intent_call import IntentCall
 from nlu.llm.intent_choosing_confirmer import IntentChoosingConfirmer
 from nlu.llm.same_topic_checker import SameTopicChecker
+from nlu.mlm.lexical_router import LexicalIntentRouter, lexical_intent_router_min_confidence
 from prompt_manager.base import PromptManager
 from third_system.search_entity import SearchResponse, SearchParam, SearchParamFilter
 from third_system.unified_search import UnifiedSearch
@@ -42,8 +50,26 @@ system_template_without_example = """
 
 topic = "hsbc_topic_for_intent"
 
+flat_intent_classification_feature_toggle = os.getenv("FLAT_INTENT_CLASSIFICATION_FEATURE_TOGGLE", "False") == "True"
+# above this many leaf intents one prompt listing all of them is too long, so the tree is walked layer by layer
+flat_intent_classification_max_leaves = int(os.getenv("FLAT_INTENT_CLASSIFICATION_MAX_LEAVES", 30))
+speculative_intent_classification_feature_toggle = (
+    os.getenv("SPECULATIVE_INTENT_CLASSIFICATION_FEATURE_TOGGLE", "False") == "True"
+)
 
-async def get_intent_examples(user_input: str, parent_intent_name: str = None) -> list[dict[str, Any]]:
+
+def is_same_request(new_request: Optional[str], user_input: str) -> bool:
+    """an empty new request, or one differing only in case, spaces and punctuation, asks the same as the input"""
+    if not new_request:
+        return True
+    return re.sub(r"[\W_]+", "", new_request.lower()) == re.sub(r"[\W_]+", "", user_input.lower())
+
+
+async def get_intent_examples(
+    user_input: str, parent_intent_name: str = None, intent_example_index: Optional[IntentExampleIndex] = None
+) -> list[dict[str, Any]]:
+    if intent_example_index is not None:
+        return await intent_example_index.search(user_input, parent_intent_name)
     unified_search_client = UnifiedSearch()
     filters = []
     if parent_intent_name:
@@ -79,8 +105,17 @@ class LLMIntentClassifier(IntentClassifier):
         intent_list_config: IntentListConfig,
         model_type: str,
         prompt_manager: PromptManager,
+        intent_example_index: Optional[IntentExampleIndex] = None,
+        intent_result_cache: Optional[SemanticIntentCache] = None,
+        lexical_intent_router: Optional[LexicalIntentRouter] = None,
+        embedding_client: Optional[BatchedEmbeddingClient] = None,
     ):
         self.embedding = embedding_model
+        self.embedding_client = embedding_client
+        # examples are searched remotely when there is no in process index
+        self.intent_example_index = intent_example_index
+        self.intent_result_cache = intent_result_cache
+        self.lexical_intent_router = lexical_intent_router
         self.milvus_for_langchain = milvus_for_langchain
         self.retrieval_counts = 4
         self.embedding_type = "BASE_CH_P"
@@ -155,7 +190,9 @@ class LLMIntentClassifier(IntentClassifier):
     async def check_is_providing_more_info(self, conversation: ConversationContext) -> bool:
         if not conversation.start_new_question:
             result = await self.same_topic_checker.check_is_providing_more_info(
-                conversation.get_history().format_messages(), conversation.session_id, conversation.get_unfilled_slots()
+                conversation.get_history_window(self.same_topic_checker.scenario_model).format_messages(),
+                conversation.session_id,
+                conversation.get_unfilled_slots(),
             )
             return result[0]
         return False
@@ -172,25 +209,78 @@ class LLMIntentClassifier(IntentClassifier):
                 return await self.classify_intent_until_leaf_or_confused(conversation, current_intent)
 
         # same topic check
-        chat_history = conversation.get_history().format_messages()
+        chat_history = conversation.get_history_window(self.same_topic_checker.scenario_model).format_messages()
         previous_intent = conversation.current_intent
 
         new_request = None
-        if len(chat_history) > 1:
-            start_new_topic, new_request = await self.same_topic_checker.check_same_topic(
-                chat_history, conversation.session_id
+        if len(conversation.get_history().rounds) > 1:
+            # the input is classified while the same topic check runs, in case it is neither needed nor rewritten
+            speculative_step = (
+                asyncio.create_task(self.classify_first_step(conversation))
+                if speculative_intent_classification_feature_toggle
+                else None
             )
+            try:
+                with stage_timer("same_topic_check"):
+                    start_new_topic, new_request = await self.same_topic_checker.check_same_topic(
+                        chat_history, conversation.session_id
+                    )
+            except BaseException:
+                self.discard_speculative_step(speculative_step)
+                raise
             if previous_intent and not start_new_topic:
+                self.discard_speculative_step(speculative_step)
                 return previous_intent
             else:
                 conversation.current_new_request = new_request
+            if speculative_step:
+                if is_same_request(new_request, conversation.current_user_input):
+                    speculative_intent_classifications_total.inc(result="kept")
+                    return await self.classify_intent_until_leaf_or_confused(
+                        conversation, None, new_request, first_step=await speculative_step
+                    )
+                self.discard_speculative_step(speculative_step)
 
         return await self.classify_intent_until_leaf_or_confused(conversation, None, new_request)
 
+    @classmethod
+    def discard_speculative_step(cls, speculative_step: Optional[asyncio.Task]):
+        if speculative_step is None:
+            return
+        speculative_intent_classifications_total.inc(result="discarded")
+        speculative_step.cancel()
+        # retrieve the exception of a step which failed before it was cancelled, so it is not logged as unhandled
+        speculative_step.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def classify_first_step(self, conversation: ConversationContext) -> tuple[Optional[Intent], Optional[Intent]]:
+        """the first step of classify_intent_until_leaf_or_confused from the root on the input of the user"""
+        if self.can_classify_leaf_intent_directly(None):
+            return await self.classify_leaf_intent(conversation)
+        return await self.classify_single_layer_intent(conversation)
+
     async def classify_intent_until_leaf_or_confused(
-        self, conversation: ConversationContext, start_intent: Optional[Intent], new_request: str = None
+        self,
+        conversation: ConversationContext,
+        start_intent: Optional[Intent],
+        new_request: str = None,
+        first_step: Optional[tuple[Optional[Intent], Optional[Intent]]] = None,
     ) -> Optional[Intent]:
+        """first_step is the result of classify_first_step, when it was run already"""
         current_intent = start_intent
+        if first_step is None and self.can_classify_leaf_intent_directly(start_intent):
+            first_step = await self.classify_leaf_intent(conversation, start_intent, new_request)
+        if first_step is not None:
+            current_intent, unique_intent_from_examples = first_step
+            if (
+                current_intent
+                and unique_intent_from_examples
+                and current_intent.name != unique_intent_from_examples.name
+            ):
+                conversation.set_confused_intents([current_intent, unique_intent_from_examples])
+                return current_intent
+            # answered with an intent having children, e.g. learnt from its examples, walk down from it
+            if current_intent is None or not self.intent_list_config.get_intent(current_intent.name).has_children:
+                return current_intent
         while current_intent is None or self.intent_list_config.get_intent(current_intent.name).has_children:
             current_intent, unique_intent_from_examples = await self.classify_single_layer_intent(
                 conversation, current_intent, new_request
@@ -215,7 +305,14 @@ class LLMIntentClassifier(IntentClassifier):
         else:
             user_input = conversation.current_user_input
         parent_intent_name_of_current_layer: str = parent_intent.get_full_intent_name() if parent_intent else None
-        intent_examples = await get_intent_examples(user_input, parent_intent_name_of_current_layer)
+        cache_scope = f"layer:{parent_intent_name_of_current_layer or ''}"
+        cached_result = await self.search_intent_result_cache(conversation, user_input, new_request, cache_scope)
+        if cached_result:
+            return cached_result
+        with stage_timer("intent_example_search"):
+            intent_examples = await get_intent_examples(
+                user_input, parent_intent_name_of_current_layer, self.intent_example_index
+            )
         logger.info(f'intent_examples{intent_examples}')
         for intent_example in intent_examples:
             intent_result = json.loads(intent_example["intent"])
@@ -230,18 +327,177 @@ class LLMIntentClassifier(IntentClassifier):
                 unique_intent_name_in_examples.name, 1.0, unique_intent_name_in_examples
             )
 
-        intent = await self.intent_call.classify_intent(
-            user_input, intent_examples, conversation.session_id, parent_intent_name_of_current_layer
+        routed_intent = self.route_lexically(
+            user_input, parent_intent_name_of_current_layer, unique_intent_name_in_examples, leaf=False
         )
+        if routed_intent:
+            return routed_intent, unique_intent_name_in_examples
+
+        with stage_timer("intent_call"):
+            intent = await self.intent_call.classify_intent(
+                user_input, intent_examples, conversation.session_id, parent_intent_name_of_current_layer
+            )
 
         if intent.intent in self.intent_list_config.get_intent_name_list_by_their_parent_intent(
             parent_intent_name_of_current_layer
         ):
             logger.info(f"session {conversation.session_id}, intent: {intent.intent}")
             intent_config = self.intent_list_config.get_intent(intent.intent)
-            return Intent.from_intent_config(
-                intent.intent, intent.confidence, intent_config
-            ), unique_intent_name_in_examples
+            current_intent = Intent.from_intent_config(intent.intent, intent.confidence, intent_config)
+            await self.add_intent_result_cache(
+                conversation, user_input, new_request, cache_scope, current_intent, unique_intent_name_in_examples
+            )
+            return current_intent, unique_intent_name_in_examples
 
         logger.info(f"intent: {intent.intent} is not predefined")
         return None, unique_intent_name_in_examples
+
+    def can_classify_leaf_intent_directly(self, start_intent: Optional[Intent]) -> bool:
+        if not flat_intent_classification_feature_toggle:
+            return False
+        if start_intent and not self.intent_list_config.get_intent(start_intent.name).has_children:
+            return False
+        parent_intent_name = start_intent.get_full_intent_name() if start_intent else None
+        leaf_intents = self.intent_list_config.get_leaf_intents(parent_intent_name)
+        return len(leaf_intents) <= flat_intent_classification_max_leaves
+
+    def get_intent_by_full_name(
+        self, full_intent_name: str, parent_intent_name: str = None, confidence: float = 1.0
+    ) -> Optional[Intent]:
+        intent_config = self.intent_list_config.get_intent_by_full_name(full_intent_name)
+        if intent_config is None or (parent_intent_name and not full_intent_name.startswith(parent_intent_name + ".")):
+            return None
+        return Intent.from_intent_config(intent_config.name, confidence, intent_config)
+
+    async def classify_leaf_intent(
+        self, conversation: ConversationContext, parent_intent: Intent = None, new_request: str = None
+    ) -> tuple[Optional[Intent], Optional[Intent]]:
+        """classify into a leaf intent under the parent intent with one example search and one llm call"""
+        user_input = new_request if new_request else conversation.current_user_input
+        parent_intent_name: str = parent_intent.get_full_intent_name() if parent_intent else None
+        cache_scope = f"leaf:{parent_intent_name or ''}"
+        cached_result = await self.search_intent_result_cache(conversation, user_input, new_request, cache_scope)
+        if cached_result:
+            return cached_result
+        with stage_timer("intent_example_search"):
+            # the examples keep the full intent names, the same names the leaf intents are listed by
+            intent_examples = await get_intent_examples(user_input, parent_intent_name, self.intent_example_index)
+        logger.info(f"intent_examples{intent_examples}")
+
+        unique_intent_name_in_examples = self.get_same_intent(intent_examples)
+        unique_intent_in_examples = (
+            self.get_intent_by_full_name(unique_intent_name_in_examples, parent_intent_name)
+            if unique_intent_name_in_examples
+            else None
+        )
+
+        routed_intent = self.route_lexically(user_input, parent_intent_name, unique_intent_in_examples, leaf=True)
+        if routed_intent:
+            return routed_intent, unique_intent_in_examples
+
+        with stage_timer("intent_call"):
+            intent = await self.intent_call.classify_leaf_intent(
+                user_input,
+                intent_examples,
+                conversation.session_id,
+                self.intent_list_config.get_leaf_intents(parent_intent_name),
+                parent_intent_name,
+            )
+
+        # unknown is answered for off-topic input, it ends the walk like it does in classify_single_layer_intent
+        current_intent = (
+            None
+            if intent.intent == "unknown"
+            else self.get_intent_by_full_name(intent.intent, parent_intent_name, intent.confidence)
+        )
+        if current_intent is None:
+            logger.info(f"intent: {intent.intent} is not predefined")
+            return None, unique_intent_in_examples
+        logger.info(f"session {conversation.session_id}, intent: {intent.intent}")
+        await self.add_intent_result_cache(
+            conversation, user_input, new_request, cache_scope, current_intent, unique_intent_in_examples
+        )
+        return current_intent, unique_intent_in_examples
+
+    @classmethod
+    def get_intent_name_of_layer(cls, full_intent_name: str, parent_intent_name: Optional[str]) -> Optional[str]:
+        """the ancestor of the intent, or the intent itself, which is a child of the parent intent"""
+        if not parent_intent_name:
+            return full_intent_name.split(".")[0]
+        if not full_intent_name.startswith(parent_intent_name + "."):
+            return None
+        return full_intent_name[len(parent_intent_name) + 1 :].split(".")[0]
+
+    def route_lexically(
+        self, user_input: str, parent_intent_name: Optional[str], unique_intent: Optional[Intent], leaf: bool
+    ) -> Optional[Intent]:
+        """
+        the intent of the examples, when the lexical router is confident of the same intent,
+        so the intent llm call is skipped
+        """
+        if self.lexical_intent_router is None or unique_intent is None:
+            return None
+        full_intent_name, confidence = self.lexical_intent_router.predict(user_input)
+        if leaf:
+            agreed = full_intent_name == unique_intent.get_full_intent_name()
+        else:
+            agreed = self.get_intent_name_of_layer(full_intent_name, parent_intent_name) == unique_intent.name
+        if confidence < lexical_intent_router_min_confidence or not agreed:
+            lexical_router_decisions_total.inc(result="fallthrough")
+            return None
+        lexical_router_decisions_total.inc(result="saved")
+        logger.info(f"lexical router intent: {full_intent_name}, confidence: {confidence}")
+        return unique_intent.model_copy(update={"confidence": confidence})
+
+    async def embed_user_input(self, user_input: str) -> Optional[list[float]]:
+        """the embedding from the batching client, which caches it for the example search of the same input"""
+        if self.embedding_client is None:
+            return None
+        return await self.embedding_client.encode(user_input)
+
+    def can_use_intent_result_cache(self, conversation: ConversationContext, new_request: Optional[str]) -> bool:
+        # only for an utterance understood without the history, the first one or the standalone request of a new topic
+        return self.intent_result_cache is not None and bool(new_request or len(conversation.get_history().rounds) <= 1)
+
+    async def search_intent_result_cache(
+        self, conversation: ConversationContext, user_input: str, new_request: Optional[str], scope: str
+    ) -> Optional[tuple[Optional[Intent], Optional[Intent]]]:
+        if not self.can_use_intent_result_cache(conversation, new_request):
+            return None
+        vector = await self.embed_user_input(user_input)
+        if vector is None:
+            # the cache embeds the utterance with a blocking call
+            cached = await asyncio.to_thread(self.intent_result_cache.search, user_input, scope=scope)
+        else:
+            cached = self.intent_result_cache.search(user_input, scope=scope, vector=vector)
+        if cached is None:
+            return None
+        result = json.loads(cached)
+        current_intent = self.get_intent_by_full_name(result["intent"], confidence=result["confidence"])
+        if current_intent is None:
+            return None
+        logger.info(f"session {conversation.session_id}, cached intent: {result['intent']}")
+        unique_intent = self.get_intent_by_full_name(result["unique_intent"]) if result["unique_intent"] else None
+        return current_intent, unique_intent
+
+    async def add_intent_result_cache(
+        self,
+        conversation: ConversationContext,
+        user_input: str,
+        new_request: Optional[str],
+        scope: str,
+        current_intent: Intent,
+        unique_intent: Optional[Intent],
+    ):
+        if not self.can_use_intent_result_cache(conversation, new_request):
+            return
+        result = {
+            "intent": current_intent.get_full_intent_name(),
+            "confidence": current_intent.confidence,
+            "unique_intent": unique_intent.get_full_intent_name() if unique_intent else None,
+        }
+        vector = await self.embed_user_input(user_input)
+        if vector is None:
+            await asyncio.to_thread(self.intent_result_cache.add_cache, user_input, json.dumps(result), scope)
+        else:
+            self.intent_result_cache.add_cache(user_input, json.dumps(result), scope, vector)
@@ -5,8 +5,8 @@ from gluon_meson_sdk.models.abstract_models.chat_message_preparation import Chat
 from loguru import logger
 from pydantic import BaseModel
 
-from nlu.intent_config import IntentListConfig
-from gluon_meson_sdk.models.scenario_model_registry.base import DefaultScenarioModelRegistryCenter
+from models.chat_model.instrumented import InstrumentedScenarioModelRegistryCenter
+from nlu.intent_config import IntentConfig, IntentListConfig
 
 from prompt_manager.base import PromptWrapper
 
@@ -24,31 +24,90 @@ class IntentCall:
     ):
         self.intent_list_config = intent_list_config
         self.template = template
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = "intent_call"
+        # system prompts only depend on the scenes, which are loaded once, so each one is rendered once
+        self.system_prompts: dict[str, str] = {}
+        # by the parent intent and the full names of the leaf intents
+        self.leaf_intent_system_prompts: dict[tuple[str, ...], str] = {}
 
-    def construct_system_prompt(
-        self, chat_message_preparation: ChatMessagePreparation, full_name_of_parent_intent: str = None
-    ):
-        intent_list = []
-        for intent in self.intent_list_config.intents:
-            if intent.full_name_of_parent_intent == full_name_of_parent_intent:
+    def render_system_prompt(self, intent_list: list[dict]) -> str:
+        return self.template.format({"intent_list": json.dumps(intent_list)})
+
+    def get_system_prompt(self, full_name_of_parent_intent: str = None) -> str:
+        if full_name_of_parent_intent not in self.system_prompts:
+            intent_list = []
+            for intent in self.intent_list_config.get_intents_by_parent_intent(full_name_of_parent_intent):
                 descriptions = [intent.description]
                 children_intents = self.intent_list_config.get_children_intents(intent)
                 descriptions.extend([intent.description for intent in children_intents])
                 intent_list.append({"name": intent.name, "description": descriptions})
+            self.system_prompts[full_name_of_parent_intent] = self.render_system_prompt(intent_list)
+        return self.system_prompts[full_name_of_parent_intent]
 
-        chat_message_preparation.add_message("system", self.template.template, intent_list=json.dumps(intent_list))
+    def construct_system_prompt(
+        self, chat_message_preparation: ChatMessagePreparation, full_name_of_parent_intent: str = None
+    ):
+        chat_message_preparation.add_message("system", self.get_system_prompt(full_name_of_parent_intent))
+
+    def construct_leaf_intent_system_prompt(
+        self,
+        chat_message_preparation: ChatMessagePreparation,
+        leaf_intents: list[IntentConfig],
+        full_name_of_parent_intent: str = None,
+    ):
+        key = (full_name_of_parent_intent or "", *(intent.get_full_intent_name() for intent in leaf_intents))
+        if key not in self.leaf_intent_system_prompts:
+            # the full names tell leaves of different branches apart, ancestors describe the branch of each leaf
+            intent_list = [
+                {
+                    "name": intent.get_full_intent_name(),
+                    "description": [
+                        *[ancestor.description for ancestor in self.intent_list_config.get_ancestor_intents(intent)],
+                        intent.description,
+                    ],
+                }
+                for intent in leaf_intents
+            ]
+            # offered like in the layer of the parent intent, so off-topic input is not pushed into a leaf
+            intent_list.extend(
+                {"name": intent.name, "description": [intent.description]}
+                for intent in self.intent_list_config.get_intents_by_parent_intent(full_name_of_parent_intent)
+                if intent.name == "unknown"
+            )
+            self.leaf_intent_system_prompts[key] = self.render_system_prompt(intent_list)
+        chat_message_preparation.add_message("system", self.leaf_intent_system_prompts[key])
 
     async def classify_intent(
         self, query: str, examples, session_id, full_name_of_parent_intent: str = None
     ) -> IntentClassificationResponse:
-        # TODO: drop history if it is too long
-        chat_model = await self.scenario_model_registry.get_model(self.scenario_model, session_id)
+        chat_message_preparation = ChatMessagePreparation()
+        self.construct_system_prompt(chat_message_preparation, full_name_of_parent_intent)
+        return await self.call(chat_message_preparation, query, examples, session_id, full_name_of_parent_intent)
 
+    async def classify_leaf_intent(
+        self,
+        query: str,
+        examples,
+        session_id,
+        leaf_intents: list[IntentConfig],
+        full_name_of_parent_intent: str = None,
+    ) -> IntentClassificationResponse:
+        """classify into the full name of a leaf intent in one call, instead of one call per layer"""
         chat_message_preparation = ChatMessagePreparation()
+        self.construct_leaf_intent_system_prompt(chat_message_preparation, leaf_intents, full_name_of_parent_intent)
+        return await self.call(chat_message_preparation, query, examples, session_id, full_name_of_parent_intent)
 
-        self.construct_system_prompt(chat_message_preparation, full_name_of_parent_intent)
+    async def call(
+        self,
+        chat_message_preparation: ChatMessagePreparation,
+        query: str,
+        examples,
+        session_id,
+        full_name_of_parent_intent: str = None,
+    ) -> IntentClassificationResponse:
+        # TODO: drop history if it is too long
+        chat_model = await self.scenario_model_registry.get_model(self.scenario_model, session_id)
         logger.debug(examples)
 
         for example in examples:
@@ -1,12 +1,10 @@
 from typing import Optional
 
 from gluon_meson_sdk.models.abstract_models.chat_message_preparation import ChatMessagePreparation
-from gluon_meson_sdk.models.scenario_model_registry.base import (
-    DefaultScenarioModelRegistryCenter,
-    BaseScenarioModelRegistryCenter,
-)
+from gluon_meson_sdk.models.scenario_model_registry.base import BaseScenarioModelRegistryCenter
 from loguru import logger
 
+from models.chat_model.instrumented import InstrumentedScenarioModelRegistryCenter
 from tracker.context import ConversationContext
 
 
@@ -14,7 +12,7 @@ class IntentChoosingConfirmer:
     def __init__(
         self,
         intent_choosing_template: str,
-        model_registry: BaseScenarioModelRegistryCenter = DefaultScenarioModelRegistryCenter(),
+        model_registry: BaseScenarioModelRegistryCenter = InstrumentedScenarioModelRegistryCenter(),
     ):
         self.scenario_model_registry = model_registry
         self.scenario_model = "intent_choosing_confirm"
@@ -28,7 +26,7 @@ class IntentChoosingConfirmer:
         chat_message_preparation.add_message(
             "system",
             self.intent_choosing_template,
-            history=conversation.get_history().format_string(),
+            history=conversation.get_history_window(self.scenario_model).format_string(),
             intent_list=[intent.minimal_info() for intent in conversation.confused_intents],
         )
         chat_message_preparation.log(logger)
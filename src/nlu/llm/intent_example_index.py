@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+from loguru import logger
+
+from models.embedding_model.batched import BatchedEmbeddingClient
+from nlu.llm.intent_examples import retrieve_intent_examples_from_intent_yaml
+
+intent_example_index_feature_toggle = os.getenv("INTENT_EXAMPLE_INDEX_FEATURE_TOGGLE", "False") == "True"
+intent_example_index_cache_dir = os.getenv(
+    "INTENT_EXAMPLE_INDEX_CACHE_DIR", os.path.join(tempfile.gettempdir(), "intent_example_index")
+)
+
+
+def hash_scenes(folder_path: str) -> str:
+    """changes with the content of any scene file, so cached embeddings of outdated examples are not used"""
+    sha256 = hashlib.sha256()
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file_name in sorted(files):
+            if file_name.endswith(".yaml"):
+                file_path = os.path.join(root, file_name)
+                sha256.update(os.path.relpath(file_path, folder_path).encode("utf-8"))
+                with open(file_path, "rb") as f:
+                    sha256.update(f.read())
+    return sha256.hexdigest()
+
+
+# attributes the embedding model may name its model by
+MODEL_NAME_ATTRIBUTES = ("model_name", "model", "model_type", "model_id", "deployment")
+FINGERPRINT_TEXT = "intent example index fingerprint"
+
+
+def embedding_model_id(embedding_model) -> str:
+    """
+    the names the embedding model exposes, with a digest of the embedding of a fixed text, so a model without a name
+    or a model changed behind the same name gets embeddings of its own
+    """
+    names = [
+        f"{attribute}={getattr(embedding_model, attribute)}"
+        for attribute in MODEL_NAME_ATTRIBUTES
+        if isinstance(getattr(embedding_model, attribute, None), str)
+    ]
+    # rounded so the noise of the last bits does not change the digest, adding 0.0 turns -0.0 into 0.0
+    probe = np.round(np.asarray(embedding_model.embed_query(FINGERPRINT_TEXT), dtype=np.float32), 3) + 0.0
+    digest = hashlib.sha256(f"{probe.shape}".encode("utf-8") + probe.tobytes()).hexdigest()[:16]
+    return ";".join([type(embedding_model).__name__, *names, f"probe={digest}"])
+
+
+def get_full_intent_name(intent_example: dict[str, Any]) -> str:
+    parent = intent_example["full_parent_intent"]
+    return f"{parent}.{intent_example['intent']}" if parent else intent_example["intent"]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class IntentExampleIndex:
+    """
+    Examples of the scenes with their normalized embeddings in one matrix, searched in process by cosine similarity
+    instead of a vector search request per intent layer.
+    """
+
+    def __init__(
+        self,
+        intent_examples: list[dict[str, Any]],
+        embeddings: np.ndarray,
+        embedding_model,
+        embedding_client: Optional[BatchedEmbeddingClient] = None,
+    ):
+        self.intent_examples = intent_examples
+        self.embeddings = normalize(np.asarray(embeddings, dtype=np.float32))
+        self.embedding_model = embedding_model
+        # queries are embedded through the batching client when there is one, it wraps the same embedding model
+        self.embedding_client = embedding_client
+        # query embeddings of the latest utterances, every layer of a turn searches with the same one
+        self.query_embeddings: OrderedDict[str, asyncio.Future] = OrderedDict()
+        self.max_query_embeddings = 64
+        self.full_parent_intents = [intent_example["full_parent_intent"] or "" for intent_example in intent_examples]
+        # examples under each parent intent searched so far, the same few parents are searched on every turn
+        self.parent_masks: dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_scenes(
+        cls,
+        folder_path: str,
+        embedding_model,
+        cache_dir: str = intent_example_index_cache_dir,
+        embedding_client: Optional[BatchedEmbeddingClient] = None,
+    ) -> "IntentExampleIndex":
+        model_id = embedding_model_id(embedding_model)
+        cache_key = hashlib.sha256(f"{hash_scenes(folder_path)}:{model_id}".encode("utf-8")).hexdigest()
+        cache_path = os.path.join(cache_dir, f"{cache_key}.npz")
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                logger.info(f"load intent example embeddings from {cache_path}")
+                return cls(
+                    json.loads(str(cached["intent_examples"])), cached["embeddings"], embedding_model, embedding_client
+                )
+
+        intent_examples = retrieve_intent_examples_from_intent_yaml(folder_path)
+        texts = [intent_example["example"] for intent_example in intent_examples]
+        embeddings = np.asarray(embedding_model.embed_documents(texts) if texts else [], dtype=np.float32)
+        os.makedirs(cache_dir, exist_ok=True)
+        # a file of its own, the workers starting at the same time may build the same index
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix=f"{cache_key}.", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, intent_examples=json.dumps(intent_examples), embeddings=embeddings)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        logger.info(f"embedded {len(texts)} intent examples into {cache_path}")
+        return cls(intent_examples, embeddings, embedding_model, embedding_client)
+
+    def _parent_mask(self, parent_intent_name: str) -> np.ndarray:
+        # the same prefix match as the like filter of the remote search
+        if parent_intent_name not in self.parent_masks:
+            self.parent_masks[parent_intent_name] = np.array(
+                [full_parent.startswith(parent_intent_name) for full_parent in self.full_parent_intents], dtype=bool
+            )
+        return self.parent_masks[parent_intent_name]
+
+    def search_by_vector(
+        self, query_embedding, parent_intent_name: Optional[str] = None, size: int = 3
+    ) -> list[dict[str, Any]]:
+        if len(self.intent_examples) == 0:
+            return []
+        scores = self.embeddings @ normalize(np.asarray(query_embedding, dtype=np.float32))
+        if parent_intent_name:
+            scores = np.where(self._parent_mask(parent_intent_name), scores, -np.inf)
+        size = min(size, len(scores))
+        top = np.argpartition(-scores, size - 1)[:size]
+        top = top[np.argsort(-scores[top])]
+        return [
+            dict(
+                intent=json.dumps({"intent": get_full_intent_name(self.intent_examples[index])}),
+                parent_intent=None,
+                example=self.intent_examples[index]["example"],
+                score=float(scores[index]),
+            )
+            for index in top
+            if scores[index] != -np.inf
+        ]
+
+    async def _embed(self, user_input: str) -> list[float]:
+        if self.embedding_client is not None:
+            return await self.embedding_client.encode(user_input)
+        return await asyncio.to_thread(self.embedding_model.embed_query, user_input)
+
+    async def embed_query(self, user_input: str) -> list[float]:
+        embedding = self.query_embeddings.get(user_input)
+        if embedding is None:
+            embedding = asyncio.ensure_future(self._embed(user_input))
+            self.query_embeddings[user_input] = embedding
+            if len(self.query_embeddings) > self.max_query_embeddings:
+                self.query_embeddings.popitem(last=False)
+        else:
+            self.query_embeddings.move_to_end(user_input)
+        try:
+            # shielded, a layer cancelled with its turn does not cancel the embedding other layers wait for
+            return await asyncio.shield(embedding)
+        except Exception:
+            if self.query_embeddings.get(user_input) is embedding and embedding.done():
+                del self.query_embeddings[user_input]
+            raise
+
+    async def search(self, user_input: str, parent_intent_name: Optional[str] = None, size: int = 3):
+        """returns examples in the format of get_intent_examples"""
+        return self.search_by_vector(await self.embed_query(user_input), parent_intent_name, size)
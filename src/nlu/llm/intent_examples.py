@@ -5,7 +5,6 @@ import uuid
 
 import yaml
 
-from nlu.llm.intent import topic
 from resources.util import get_resources
 from third_system.unified_search import UnifiedSearch
 
@@ -52,6 +51,8 @@ def generate_tmp_example_file(intent_examples):
 
 
 async def vectorize_examples(intent_examples):
+    from nlu.llm.intent import topic
+
     unified_search_client = UnifiedSearch()
 
     response = await unified_search_client.upload_intents_examples(table=topic, intent_examples=intent_examples)
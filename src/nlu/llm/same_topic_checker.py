@@ -1,7 +1,7 @@
-from gluon_meson_sdk.models.scenario_model_registry.base import DefaultScenarioModelRegistryCenter
 from gluon_meson_sdk.models.abstract_models.chat_message_preparation import ChatMessagePreparation
 from loguru import logger
 
+from models.chat_model.instrumented import InstrumentedScenarioModelRegistryCenter
 from nlu.intent_with_entity import Slot
 
 same_topic_prompt = """## ROLE
@@ -183,7 +183,7 @@ User: country is xxx and product is yyy
 
 class SameTopicChecker:
     def __init__(self):
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = "same_topic_check"
 
     def format_history(
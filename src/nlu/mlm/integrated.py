@@ -1,4 +1,6 @@
 from loguru import logger
+
+from metrics import stage_timer
 from tracker.context import ConversationContext
 from nlu.base import Nlu, IntentClassifier, EntityExtractor
 from nlu.intent_with_entity import IntentWithEntity, Intent
@@ -35,7 +37,8 @@ class IntegratedNLU(Nlu):
         conversation.set_status("analyzing user's intent")
 
         # previous_intent_name = conversation.current_intent.get_full_intent_name() if conversation.current_intent else ""
-        current_intent = await self.intent_classifier.classify_intent(conversation)
+        with stage_timer("intent_classification"):
+            current_intent = await self.intent_classifier.classify_intent(conversation)
 
         if current_intent is None:
             logger.info("No intent found")
@@ -59,7 +62,8 @@ class IntegratedNLU(Nlu):
         logger.info(f"Start new question: {conversation.start_new_question}")
 
         logger.info("extracting utterance's slots")
-        current_entities = await self.entity_extractor.extract_entity(conversation)
+        with stage_timer("entity_extraction"):
+            current_entities = await self.entity_extractor.extract_entity(conversation)
         # Retain entities
         # If the user start a new topic and the current intent is set to ignore previous slots, then the existing entities will be ignored
         # existing_entities = [] if use_latest_history else conversation.get_entities()
@@ -0,0 +1,141 @@
+import math
+import os
+import time
+import zlib
+from collections import Counter
+from typing import NamedTuple, Optional
+
+import numpy as np
+from loguru import logger
+
+from nlu.intent_config import IntentListConfig
+
+lexical_intent_router_feature_toggle = os.getenv("LEXICAL_INTENT_ROUTER_FEATURE_TOGGLE", "False") == "True"
+lexical_intent_router_min_confidence = float(os.getenv("LEXICAL_INTENT_ROUTER_MIN_CONFIDENCE", 0.8))
+NGRAM_SIZES = (1, 2, 3)
+# n-grams are hashed into this many columns, collisions of rare n-grams barely change the predictions
+FEATURE_DIMENSION = int(os.getenv("LEXICAL_INTENT_ROUTER_FEATURE_DIMENSION", 2**15))
+
+
+def char_ngrams(text: str) -> list[str]:
+    """character n-grams work for chinese, which has no spaces, as well as for english words"""
+    text = " " + " ".join(text.lower().split()) + " "
+    return [text[index : index + size] for size in NGRAM_SIZES for index in range(len(text) - size + 1)]
+
+
+def hashed_ngram_counts(text: str) -> Counter:
+    """n-gram counts by a stable hash of the n-gram, so the weights stay the same size however many examples"""
+    return Counter(zlib.crc32(ngram.encode("utf-8")) % FEATURE_DIMENSION for ngram in char_ngrams(text))
+
+
+def softmax(scores: np.ndarray) -> np.ndarray:
+    scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+    return scores / scores.sum(axis=1, keepdims=True)
+
+
+class SparseFeatures(NamedTuple):
+    """rows in compressed sparse row layout, every row has the bias column so none is empty"""
+
+    row_starts: np.ndarray
+    columns: np.ndarray
+    values: np.ndarray
+
+    def row_of_entries(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.row_starts) - 1), np.diff(self.row_starts))
+
+
+class LexicalIntentRouter:
+    """
+    Softmax regression over hashed character n-gram tf-idf vectors, trained from the examples of the scenes.
+    It recognizes utterances close to an example without a llm call, predictions are full intent names.
+    Features stay sparse and training runs in mini-batches, so its memory and time grow with the number of examples
+    instead of examples times n-grams.
+    """
+
+    def __init__(self, idf: np.ndarray, weights: np.ndarray, intent_names: list[str]):
+        self.idf = idf
+        self.weights = weights
+        self.intent_names = intent_names
+
+    @classmethod
+    def from_intent_list_config(
+        cls,
+        intent_list_config: IntentListConfig,
+        epochs: int = 5,
+        min_steps: int = 300,
+        batch_size: int = 32,
+        learning_rate: float = 2.0,
+        l2: float = 1e-4,
+    ) -> Optional["LexicalIntentRouter"]:
+        texts, labels, intent_names = [], [], []
+        # names are only unique under their parent, the full names are taken from the intents in the same order
+        for intent_config, intent_attrs in zip(intent_list_config.intents, intent_list_config.get_intent_and_attrs()):
+            if intent_attrs["intent"] == "unknown" or not intent_attrs["examples"]:
+                continue
+            intent_names.append(intent_config.get_full_intent_name())
+            for example in intent_attrs["examples"]:
+                texts.append(example)
+                labels.append(len(intent_names) - 1)
+        if len(intent_names) < 2:
+            logger.info("not enough intents with examples to train the lexical intent router")
+            return None
+
+        start_time = time.perf_counter()
+        counts = [hashed_ngram_counts(text) for text in texts]
+        document_frequency = np.zeros(FEATURE_DIMENSION, dtype=np.float32)
+        for text_counts in counts:
+            document_frequency[list(text_counts)] += 1
+        idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        weights = np.zeros((FEATURE_DIMENSION + 1, len(intent_names)), dtype=np.float32)
+        router = cls(idf, weights, intent_names)
+        labels = np.array(labels)
+
+        rng = np.random.default_rng(0)
+        batch_count = math.ceil(len(texts) / batch_size)
+        # small scenes get enough steps to converge, large ones a bounded number of passes
+        for _ in range(max(epochs, math.ceil(min_steps / batch_count))):
+            for batch in np.array_split(rng.permutation(len(texts)), batch_count):
+                features = router.vectorize_counts([counts[index] for index in batch])
+                # the batch as a dense matrix over the columns it touches, only their weights are read and updated
+                columns, batch_columns = np.unique(features.columns, return_inverse=True)
+                batch_features = np.zeros((len(batch), len(columns)), dtype=np.float32)
+                batch_features[features.row_of_entries(), batch_columns] = features.values
+                batch_weights = router.weights[columns]
+                targets = np.zeros((len(batch), len(intent_names)), dtype=np.float32)
+                targets[np.arange(len(batch)), labels[batch]] = 1
+                errors = (softmax(batch_features @ batch_weights) - targets) / len(batch)
+                gradient = batch_features.T @ errors
+                router.weights[columns] = batch_weights - learning_rate * (gradient + l2 * batch_weights)
+        logger.info(
+            f"trained lexical intent router on {len(texts)} examples of {len(intent_names)} intents "
+            f"in {time.perf_counter() - start_time:.2f}s"
+        )
+        return router
+
+    def vectorize_counts(self, counts: list[Counter]) -> SparseFeatures:
+        """l2 normalized tf-idf vectors, with a constant last column as the bias"""
+        row_starts, columns, values = [0], [], []
+        for text_counts in counts:
+            text_columns = np.fromiter(text_counts.keys(), dtype=np.int64, count=len(text_counts))
+            text_values = np.fromiter(text_counts.values(), dtype=np.float32, count=len(text_counts))
+            text_values *= self.idf[text_columns]
+            norm = np.linalg.norm(text_values)
+            columns.extend([text_columns, [FEATURE_DIMENSION]])
+            values.extend([text_values / norm if norm else text_values, [1.0]])
+            row_starts.append(row_starts[-1] + len(text_columns) + 1)
+        return SparseFeatures(
+            np.array(row_starts), np.concatenate(columns).astype(np.int64), np.concatenate(values).astype(np.float32)
+        )
+
+    def vectorize(self, texts: list[str]) -> SparseFeatures:
+        return self.vectorize_counts([hashed_ngram_counts(text) for text in texts])
+
+    def probabilities(self, features: SparseFeatures) -> np.ndarray:
+        contributions = features.values[:, None] * self.weights[features.columns]
+        return softmax(np.add.reduceat(contributions, features.row_starts[:-1], axis=0))
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """the full name of the most probable intent and its probability"""
+        probabilities = self.probabilities(self.vectorize([text]))[0]
+        best = int(np.argmax(probabilities))
+        return self.intent_names[best], float(probabilities[best])
@@ -1,9 +1,9 @@
 from gluon_meson_sdk.models.abstract_models.chat_message_preparation import ChatMessagePreparation
-from gluon_meson_sdk.models.scenario_model_registry.base import DefaultScenarioModelRegistryCenter
 from loguru import logger
 
 from action.base import ActionResponse
 from output_adapter.base import OutputAdapter
+from models.chat_model.instrumented import InstrumentedScenarioModelRegistryCenter
 from tracker.context import ConversationContext
 
 prompt = """## Role
@@ -45,7 +45,7 @@ TB Guru"""
 
 class EmailOutputAdapter(OutputAdapter):
     def __init__(self):
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = self.get_name() + "_output_adapter"
 
     def get_name(self) -> str:
@@ -59,7 +59,7 @@ class EmailOutputAdapter(OutputAdapter):
         chat_message_preparation.add_message(
             "system",
             draft_email_request_prompt,
-            history=conversation.get_history().format_string(),
+            history=conversation.get_history_window(self.scenario_model).format_string(),
         )
         chat_message_preparation.log(logger)
         json_response = (
@@ -24,6 +24,9 @@ class PromptManager:
     def load(self, name, domain=None) -> PromptWrapper:
         raise NotImplementedError()
 
+    def preload(self):
+        pass
+
 
 class BasePromptManager(PromptManager):
     def __init__(self, prompt_template_folder=None) -> None:
@@ -33,6 +36,9 @@ class BasePromptManager(PromptManager):
             prompt_template_folder = os.path.join(current_dir, "..", "resources", "prompt_templates")
         self.prompt_service = LocalPromptService(prompt_template_folder)
 
+    def preload(self):
+        self.prompt_service.preload()
+
     def load(self, name, domain=None) -> PromptWrapper:
         if domain is not None:
             name = domain + "_" + name
@@ -4,10 +4,19 @@ import os
 class LocalPromptService:
     def __init__(self, prompt_template_folder):
         self.prompt_template_folder = prompt_template_folder
+        self.prompts: dict[str, str] = {}
+
+    def preload(self):
+        for file_name in os.listdir(self.prompt_template_folder):
+            if file_name.endswith(".txt"):
+                self.get_prompt(file_name[: -len(".txt")])
 
     def get_prompt(self, name) -> str:
+        if name in self.prompts:
+            return self.prompts[name]
         prompt_file_path = os.path.join(self.prompt_template_folder, name + ".txt")
         if os.path.isfile(prompt_file_path):
             with open(prompt_file_path, "r", encoding="utf-8") as file:
-                return file.read()
+                self.prompts[name] = file.read()
+                return self.prompts[name]
         return None
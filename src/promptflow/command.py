@@ -11,3 +11,4 @@ class ScoreCommand(BaseModel):
     file_urls: Union[list[str], None] = None
     chat_history: Union[list[dict[str, Any]], None] = None
     from_email: Union[bool, None] = None
+    stream: Union[bool, None] = None
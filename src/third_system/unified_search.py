@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import mimetypes
 import os
 import re
@@ -9,6 +10,8 @@ import aiohttp
 from loguru import logger
 
 from action.base import Attachment, UploadFileContentType
+from dialog_manager.deadline import run_within_deadline
+from metrics import count_error, search_timer
 from third_system.search_entity import SearchParam, SearchResponse
 
 unified_search_url = os.environ.get("UNIFIED_SEARCH_URL", "http://localhost:8000")
@@ -16,7 +19,7 @@ unified_search_url = os.environ.get("UNIFIED_SEARCH_URL", "http://localhost:8000
 SPLIT_FILE_TOKEN_SiZE = 2000
 
 
-async def call_search_api(method: str, endpoint: str, payload: dict) -> SearchResponse:
+async def request_search_api(method: str, endpoint: str, payload: dict, endpoint_name: str) -> SearchResponse:
     async with aiohttp.ClientSession() as session:
         try:
             async with session.post(endpoint, json=payload) if method == "POST" else session.get(
@@ -26,9 +29,31 @@ async def call_search_api(method: str, endpoint: str, payload: dict) -> SearchRe
                 return SearchResponse.model_validate(await response.json())
         except Exception as err:
             logger.error(f"Error fetch url {endpoint}: {err}")
+            count_error("unified_search", endpoint_name)
             return SearchResponse()
 
 
+async def call_search_api(method: str, endpoint: str, payload: dict, endpoint_name: str) -> SearchResponse:
+    with search_timer(endpoint_name):
+        return await run_within_deadline(
+            request_search_api(method, endpoint, payload, endpoint_name), f"unified search {endpoint_name}"
+        )
+
+
+def bounded(endpoint_name: str):
+    """times the endpoint and bounds it by the deadline of the current request"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with search_timer(endpoint_name):
+                return await run_within_deadline(func(*args, **kwargs), f"unified search {endpoint_name}")
+
+        return wrapper
+
+    return decorator
+
+
 def extract_filename_from_header(header_value) -> str:
     if "''" in header_value:
         _, encoded_filename = header_value.split("''", 1)
@@ -47,6 +72,7 @@ class UnifiedSearch:
     def __init__(self):
         self.base_url = unified_search_url
 
+    @bounded("search")
     async def search(self, search_param: SearchParam, conversation_id) -> list[SearchResponse]:
         async with aiohttp.ClientSession() as session:
             try:
@@ -60,20 +86,26 @@ class UnifiedSearch:
                     return [SearchResponse.model_validate(item) for item in result]
             except Exception as err:
                 logger.error(f"Error search {search_param}: {err}")
+                count_error("unified_search", "search")
                 return []
 
     async def vector_search(self, search_param: SearchParam, table) -> list[SearchResponse]:
-        result = await call_search_api("POST", f"{self.base_url}/vector/{table}/search/", search_param.model_dump())
+        result = await call_search_api(
+            "POST", f"{self.base_url}/vector/{table}/search/", search_param.model_dump(), "vector_search"
+        )
         return [result] if result.items else []
 
     async def upload_intents_examples(self, table, intent_examples):
         return await call_search_api(
-            "POST", f"{self.base_url}/vector/{table}/intent_examples?recreate=True", intent_examples
+            "POST", f"{self.base_url}/vector/{table}/intent_examples?recreate=True", intent_examples, "intent_examples"
         )
 
     async def search_for_intent_examples(self, table, user_input):
-        return await call_search_api("POST", f"{self.base_url}/vector/{table}/search", {"query": user_input})
+        return await call_search_api(
+            "POST", f"{self.base_url}/vector/{table}/search", {"query": user_input}, "vector_search"
+        )
 
+    @bounded("file_download_raw")
     async def download_raw_file_from_minio(self, file_url: str) -> Union[Attachment, None]:
         async with aiohttp.ClientSession() as session:
             try:
@@ -90,6 +122,22 @@ class UnifiedSearch:
                     )
             except Exception as err:
                 logger.error(f"Error download {file_url}: {err}")
+                count_error("unified_search", "file_download_raw")
+                return None
+
+    @bounded("file_name")
+    async def fetch_raw_file_name(self, file_url: str) -> Union[str, None]:
+        """resolve the file name from the response headers, only the first byte of the body is requested"""
+        async with aiohttp.ClientSession() as session:
+            try:
+                async with session.get(
+                    f"{self.base_url}/file/download_raw", params={"file_url": file_url}, headers={"Range": "bytes=0-0"}
+                ) as resp:
+                    resp.raise_for_status()
+                    return extract_filename_from_header(resp.headers.get("Content-Disposition", ""))
+            except Exception as err:
+                logger.error(f"Error fetch file name of {file_url}: {err}")
+                count_error("unified_search", "file_name")
                 return None
 
     async def download_file_from_minio(
@@ -99,8 +147,10 @@ class UnifiedSearch:
             "GET",
             f"{self.base_url}/file/download",
             {"file_url": file_url, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
+            "file_download",
         )
 
+    @bounded("file_upload")
     async def upload_files_to_minio(self, files: list[Attachment], file_urls: list[str] = None) -> list[str]:
         data = aiohttp.FormData()
         if file_urls:
@@ -121,8 +171,10 @@ class UnifiedSearch:
                     return await response.json()
         except Exception as err:
             logger.error(f"Error upload files: {err}")
+            count_error("unified_search", "file_upload")
             return []
 
+    @bounded("file_new")
     async def generate_new_file(self, file: Attachment) -> str:
         data = aiohttp.FormData()
         if file.url:
@@ -141,8 +193,10 @@ class UnifiedSearch:
                     return await response.json()
         except Exception as err:
             logger.error(f"Error upload files: {err}")
+            count_error("unified_search", "file_new")
             return ""
 
+    @bounded("file_link")
     async def generate_file_link(self, filename: str) -> str:
         endpoint = f"{self.base_url}/file/link"
         async with aiohttp.ClientSession() as session:
@@ -152,6 +206,7 @@ class UnifiedSearch:
                     return await response.json()
             except Exception as err:
                 logger.error(f"Error fetch url {endpoint}: {err}")
+                count_error("unified_search", "file_link")
                 return ""
 
 
@@ -1,14 +1,16 @@
+import asyncio
 import os
-from typing import List
+from typing import Awaitable, Callable, List, Optional
 
-from gluon_meson_sdk.models.scenario_model_registry.base import DefaultScenarioModelRegistryCenter
 from gluon_meson_sdk.models.abstract_models.chat_message_preparation import ChatMessagePreparation
 from loguru import logger
 
+from dialog_manager.deadline import deadline_scope
+from models.chat_model.instrumented import InstrumentedScenarioModelRegistryCenter
 from tracker.context import ConversationContext
 
 
-summarize_history_count = os.getenv("SUMMARIZE_HISTORY_COUNT", 6)
+summarize_history_count = int(os.getenv("SUMMARIZE_HISTORY_COUNT", 6))
 
 prompt = """## ROLE
 you are a helpful chatbot, extract all the session names from this discussion:
@@ -17,22 +19,83 @@ you are a helpful chatbot, extract all the session names from this discussion:
 {{history}}
 """
 
+# saves a finished summary into the session, with the id of the latest round it covers
+SaveSummary = Callable[[str, str, int], Awaitable[None]]
+
 
 class HistorySummarizer:
+    """
+    Summarizes the history after the response is sent. A session has at most one summarization in flight,
+    rounds added meanwhile are merged into its summary by the next pass. Finished summaries are saved into the
+    session, so they survive a restart and are seen by any worker, only the passes in flight are lost.
+    """
+
     def __init__(self):
-        self.scenario_model_registry = DefaultScenarioModelRegistryCenter()
+        self.scenario_model_registry = InstrumentedScenarioModelRegistryCenter()
         self.scenario_model = "summarize_history"
+        self.running: dict[str, asyncio.Task] = {}
+        # latest unsummarized rounds and summary of a session, waiting for the running pass to finish
+        self.pending: dict[str, tuple[list[dict], Optional[str]]] = {}
 
     async def summarize_history(self, conversation: ConversationContext):
         history = conversation.get_unsummarized_history()
         if len(history) >= summarize_history_count:
-            if conversation.summarized_history_context:
-                history.insert(0, {"role": "system", "content": conversation.summarized_history_context})
-            summarized_history = await self.summarize(history, conversation.session_id)
-            conversation.summarized_history_context = summarized_history
-            conversation.history.flag_history_summarized(len(history))
+            summarized_history = await self.summarize(
+                self._with_summary(history, conversation.summarized_history_context), conversation.session_id
+            )
+            conversation.apply_history_summary(summarized_history, history[-1]["id"])
         return conversation
 
+    def summarize_in_background(self, conversation: ConversationContext, save_summary: SaveSummary):
+        history = conversation.get_unsummarized_history()
+        if len(history) < summarize_history_count:
+            return
+        session_id = conversation.session_id
+        # a newer snapshot replaces the waiting one, so passes are coalesced instead of queued
+        self.pending[session_id] = ([dict(entry) for entry in history], conversation.summarized_history_context)
+        if session_id not in self.running:
+            self.running[session_id] = asyncio.create_task(self._run(session_id, save_summary))
+
+    async def _run(self, session_id: str, save_summary: SaveSummary):
+        # summary of the previous pass, the snapshots taken meanwhile did not see it yet
+        summarized: Optional[tuple[str, int]] = None
+        try:
+            # not bounded by the deadline of the turn which scheduled it
+            with deadline_scope(None):
+                while session_id in self.pending:
+                    summarized = await self._summarize_pending(session_id, summarized, save_summary)
+        finally:
+            self.running.pop(session_id, None)
+
+    async def _summarize_pending(
+        self, session_id: str, summarized: Optional[tuple[str, int]], save_summary: SaveSummary
+    ) -> Optional[tuple[str, int]]:
+        history, summary = self.pending.pop(session_id)
+        if summarized:
+            summary, summarized_through_round_id = summarized
+            history = [entry for entry in history if entry["id"] > summarized_through_round_id]
+        if len(history) < summarize_history_count:
+            return summarized
+        try:
+            summarized_history = await self.summarize(self._with_summary(history, summary), session_id)
+            await save_summary(session_id, summarized_history, history[-1]["id"])
+        except Exception as err:
+            logger.error(f"failed to summarize history of session {session_id}: {err}")
+            return summarized
+        return summarized_history, history[-1]["id"]
+
+    @staticmethod
+    def _with_summary(history: List[dict], summary: Optional[str]) -> List[dict]:
+        if not summary:
+            return history
+        return [{"role": "system", "content": summary}, *history]
+
+    async def shutdown(self):
+        tasks = list(self.running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
     async def summarize(self, history: List[dict], session_id: str):
         chat_model = await self.scenario_model_registry.get_model(self.scenario_model, session_id)
         chat_message_preparation = ChatMessagePreparation()
@@ -1,11 +1,68 @@
 # import threading
+import asyncio
+import os
+import tempfile
 import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import Optional
 from loguru import logger
 
 import schedule
 
-from tracker.context import ConversationContext
+from metrics import tracked_sessions, tracker_cache_bytes, tracker_spilled_sessions
+from tracker.context import ConversationContext, ConversationFiles
+from tracker.expiry import ExpiryHeap, delete_conversation_files
+from tracker.journal import SessionJournal
+from tracker.session_store import (
+    SessionSpillDirectory,
+    SessionStore,
+    SQLiteSessionStore,
+    deserialize_conversation,
+    serialize_conversation,
+)
+
+conversation_tracker_backend = os.getenv("CONVERSATION_TRACKER_BACKEND", "memory").lower()
+session_store_sqlite_path = os.getenv("SESSION_STORE_SQLITE_PATH", "sessions.db")
+inactive_conversation_hours = 24
+tracker_cache_max_bytes = int(os.getenv("TRACKER_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+session_journal_dir = os.getenv("SESSION_JOURNAL_DIR", "session_journal")
+tracker_spill_dir = os.getenv("TRACKER_SPILL_DIR", os.path.join(tempfile.gettempdir(), "spilled_sessions"))
+
+
+def files_of_serialized_conversation(session_id: str, data: bytes) -> ConversationFiles:
+    """the files of a session saved elsewhere, with the digests of their stored content"""
+    try:
+        return deserialize_conversation(data).files
+    except Exception as err:
+        logger.error(f"failed to read the files of session {session_id}: {err}")
+        return ConversationFiles(session_id)
+
+
+# rough bytes held besides the text, by a session and by each round, entity, intent or file of it
+SESSION_OVERHEAD_BYTES = 4096
+ITEM_OVERHEAD_BYTES = 256
+
+# a session taken out of the cache, and the file it is spilled to
+SpillVictim = tuple[str, ConversationContext, str]
+
+
+def estimate_conversation_size(conversation: ConversationContext) -> int:
+    """
+    estimated from the text of the history and summary and the number of the other items, it grows like the memory
+    held by the session without serializing it on every save, at most max_history rounds are summed
+    """
+    size = SESSION_OVERHEAD_BYTES + len(conversation.summarized_history_context or "")
+    for entry in conversation.history.rounds:
+        size += ITEM_OVERHEAD_BYTES + len(str(entry["content"] or ""))
+    size += sum(len(url) for url in conversation.uploaded_file_urls)
+    item_count = (
+        len(conversation.entity_store)
+        + len(conversation.intent_queue)
+        + len(conversation.confused_intents)
+        + len(conversation.files.filenames)
+    )
+    return size + item_count * ITEM_OVERHEAD_BYTES
 
 
 class ConversationTracker:
@@ -17,9 +74,26 @@ class ConversationTracker:
     def load_conversation(self, session_id: str) -> ConversationContext:
         raise NotImplementedError
 
+    async def asave_conversation(self, session_id: str, conversation_context: ConversationContext):
+        """save from the event loop, trackers keeping sessions in process memory save in place"""
+        self.save_conversation(session_id, conversation_context)
+
+    async def aload_conversation(self, session_id: str) -> ConversationContext:
+        return self.load_conversation(session_id)
+
     def clear_inactive_conversations(self):
         raise NotImplementedError
 
+    def expire_conversations(self) -> list[ConversationFiles]:
+        """drop the sessions inactive for too long, and return their files for the caller to delete"""
+        raise NotImplementedError
+
+    async def aexpire_conversations(self) -> list[ConversationFiles]:
+        return self.expire_conversations()
+
+    def close(self):
+        """write out what is still buffered, on shutdown"""
+
 
 def start_schedule():
     # 无限循环，直到程序手动停止
@@ -29,8 +103,22 @@ def start_schedule():
 
 
 class BaseConversationTracker(ConversationTracker):
-    def __init__(self):
-        self.conversation_caches = {}
+    """
+    Keeps sessions in process memory in least recently used order. When their estimated size exceeds the budget,
+    the least recently used sessions are spilled to disk and loaded back on their next message.
+    """
+
+    def __init__(self, max_cache_bytes: int = tracker_cache_max_bytes, spill_dir: str = tracker_spill_dir):
+        self.conversation_caches: OrderedDict[str, ConversationContext] = OrderedDict()
+        self.conversation_sizes: dict[str, int] = {}
+        self.total_size = 0
+        self.max_cache_bytes = max_cache_bytes
+        self.spilled_sessions = SessionSpillDirectory(spill_dir)
+        # sessions taken out of the cache while their spill file is written, with the path of the file
+        self.spilling: dict[str, tuple[ConversationContext, str]] = {}
+        # sessions loaded by a turn and not saved yet
+        self.in_turn: set[str] = set()
+        self.expiry_heap = ExpiryHeap()
         # 每天固定时间执行clear_inactive_conversations函数
         # schedule.every().day.at("00:00").do(self.clear_inactive_conversations)
 
@@ -41,25 +129,316 @@ class BaseConversationTracker(ConversationTracker):
     def save_conversation(
         self, session_id: str, conversation_context: ConversationContext
     ):
-        self.conversation_caches[session_id] = conversation_context
+        self._spill(*self._save(session_id, conversation_context))
 
     def load_conversation(self, session_id: str) -> ConversationContext:
+        unspilled, path = self._take_spilled(session_id)
+        if path:
+            unspilled = deserialize_conversation(SessionSpillDirectory.read_taken(path))
+        conversation, victims = self._check_out(session_id, unspilled)
+        self._spill(victims, [])
+        return conversation
+
+    async def asave_conversation(self, session_id: str, conversation_context: ConversationContext):
+        # the sessions over the budget are serialized and written in a thread
+        await self._aspill(*self._save(session_id, conversation_context))
+
+    async def aload_conversation(self, session_id: str) -> ConversationContext:
+        unspilled, path = self._take_spilled(session_id)
+        if path:
+            unspilled = await asyncio.to_thread(self._read_spilled, path)
+        conversation, victims = self._check_out(session_id, unspilled)
+        await self._aspill(victims, [])
+        return conversation
+
+    def _save(self, session_id: str, conversation: ConversationContext) -> tuple[list[SpillVictim], list[str]]:
+        self.in_turn.discard(session_id)
+        # a copy spilled while the turn was running is outdated now
+        self.spilling.pop(session_id, None)
+        stale_path = self.spilled_sessions.take(session_id)
+        victims = self._cache(session_id, conversation)
+        self._touch(session_id)
+        return victims, [stale_path] if stale_path else []
+
+    def _take_spilled(self, session_id: str) -> tuple[Optional[ConversationContext], Optional[str]]:
+        """the session if it is still being spilled, otherwise the file to read it back from"""
+        if not session_id:
+            return None, None
+        if session_id in self.spilling:
+            return self.spilling.pop(session_id)[0], None
+        return None, self.spilled_sessions.take(session_id)
+
+    @staticmethod
+    def _read_spilled(path: str) -> ConversationContext:
+        return deserialize_conversation(SessionSpillDirectory.read_taken(path))
+
+    def _check_out(
+        self, session_id: str, unspilled: Optional[ConversationContext]
+    ) -> tuple[ConversationContext, list[SpillVictim]]:
+        victims = []
+        if unspilled is not None:
+            logger.info(f"load spilled session {session_id}")
+            victims = self._cache(session_id, unspilled)
         if session_id and session_id in self.conversation_caches:
             logger.info(f"session_id is {session_id}")
             conversation = self.conversation_caches[session_id]
             conversation.updated_at = datetime.now()
-            return conversation
-        return ConversationContext(current_user_input="", session_id=session_id)
+            self.conversation_caches.move_to_end(session_id)
+            self._touch(session_id)
+            self.in_turn.add(session_id)
+            return conversation, victims
+        return ConversationContext(current_user_input="", session_id=session_id), victims
+
+    def _cache(self, session_id: str, conversation: ConversationContext) -> list[SpillVictim]:
+        size = estimate_conversation_size(conversation)
+        self.total_size += size - self.conversation_sizes.get(session_id, 0)
+        self.conversation_sizes[session_id] = size
+        self.conversation_caches[session_id] = conversation
+        self.conversation_caches.move_to_end(session_id)
+        return self._take_over_budget(keep=session_id)
+
+    def _take_over_budget(self, keep: str) -> list[SpillVictim]:
+        """take the least recently used sessions out of the cache until within budget, for the caller to spill"""
+        excess = self.total_size - self.max_cache_bytes
+        victim_ids = []
+        for session_id in self.conversation_caches:
+            if excess <= 0 or session_id == keep or len(self.conversation_caches) - len(victim_ids) <= 1:
+                break
+            # a session of a running turn keeps changing on the event loop while it would be serialized in a thread,
+            # the mark is cleared by its next save or expiry
+            if session_id in self.in_turn:
+                continue
+            victim_ids.append(session_id)
+            excess -= self.conversation_sizes[session_id]
+        victims = []
+        for session_id in victim_ids:
+            path = self.spilled_sessions.new_path(session_id)
+            conversation = self._uncache(session_id)
+            self.spilling[session_id] = (conversation, path)
+            victims.append((session_id, conversation, path))
+        return victims
+
+    def _write_spills(self, victims: list[SpillVictim], stale_paths: list[str]) -> list[SpillVictim]:
+        """runs in a thread on the async path, returns the victims written"""
+        SessionSpillDirectory.remove_files(stale_paths)
+        written = []
+        for session_id, conversation, path in victims:
+            try:
+                self.spilled_sessions.write_file(path, serialize_conversation(conversation))
+                written.append((session_id, conversation, path))
+            except Exception as err:
+                logger.error(f"failed to spill session {session_id}, keep it in memory: {err}")
+        return written
+
+    def _finish_spills(self, victims: list[SpillVictim], written: list[SpillVictim]) -> list[str]:
+        """index the written files of the sessions not loaded back meanwhile, and return the files to remove"""
+        stale_paths = []
+        written_paths = {path for _, _, path in written}
+        for session_id, conversation, path in victims:
+            if self.spilling.get(session_id, (None, None))[1] != path:
+                # loaded back, saved or expired while its file was written
+                if path in written_paths:
+                    stale_paths.append(path)
+                continue
+            del self.spilling[session_id]
+            if path in written_paths:
+                old_path = self.spilled_sessions.add(session_id, path)
+                if old_path:
+                    stale_paths.append(old_path)
+                logger.info(f"spill session {session_id} to disk, cached sessions take {self.total_size} bytes")
+            else:
+                self._cache_back(session_id, conversation)
+        self._report_memory()
+        return stale_paths
+
+    def _cache_back(self, session_id: str, conversation: ConversationContext):
+        size = estimate_conversation_size(conversation)
+        self.total_size += size
+        self.conversation_sizes[session_id] = size
+        self.conversation_caches[session_id] = conversation
+        self.conversation_caches.move_to_end(session_id, last=False)
+
+    def _spill(self, victims: list[SpillVictim], stale_paths: list[str]):
+        written = self._write_spills(victims, stale_paths)
+        SessionSpillDirectory.remove_files(self._finish_spills(victims, written))
+
+    async def _aspill(self, victims: list[SpillVictim], stale_paths: list[str]):
+        if not victims and not stale_paths:
+            self._report_memory()
+            return
+        written = await asyncio.to_thread(self._write_spills, victims, stale_paths)
+        stale_paths = self._finish_spills(victims, written)
+        if stale_paths:
+            await asyncio.to_thread(SessionSpillDirectory.remove_files, stale_paths)
+
+    def _uncache(self, session_id: str) -> ConversationContext:
+        self.total_size -= self.conversation_sizes.pop(session_id, 0)
+        return self.conversation_caches.pop(session_id)
+
+    def _report_memory(self):
+        tracker_cache_bytes.set(self.total_size)
+        tracker_spilled_sessions.set(len(self.spilled_sessions))
+
+    def memory_stats(self, top_n: int = 20) -> dict:
+        largest = sorted(self.conversation_sizes.items(), key=lambda item: item[1], reverse=True)[:top_n]
+        return {
+            "max_bytes": self.max_cache_bytes,
+            "total_bytes": self.total_size,
+            "cached_sessions": len(self.conversation_caches),
+            "spilled_sessions": len(self.spilled_sessions),
+            "largest_sessions": dict(largest),
+        }
+
+    def _touch(self, session_id: str, idle_seconds: float = 0):
+        self.expiry_heap.touch(session_id, time.monotonic() + inactive_conversation_hours * 3600 - idle_seconds)
+        tracked_sessions.set(len(self.expiry_heap))
+
+    def _pop_expired(self) -> tuple[list[ConversationFiles], dict[str, str]]:
+        """take the expired sessions out, return the files of the cached ones and the spill files of the others"""
+        expired_files = []
+        spill_files = {}
+        for session_id in self.expiry_heap.pop_expired(time.monotonic()):
+            self.in_turn.discard(session_id)
+            if session_id in self.conversation_caches:
+                expired_files.append(self._uncache(session_id).files)
+            elif session_id in self.spilling:
+                expired_files.append(self.spilling.pop(session_id)[0].files)
+            elif session_id in self.spilled_sessions:
+                spill_files[session_id] = self.spilled_sessions.take(session_id)
+        tracked_sessions.set(len(self.expiry_heap))
+        self._report_memory()
+        return expired_files, spill_files
+
+    @staticmethod
+    def _files_of_spilled(spill_files: dict[str, str]) -> list[ConversationFiles]:
+        return [
+            files_of_serialized_conversation(session_id, SessionSpillDirectory.read_taken(path))
+            for session_id, path in spill_files.items()
+        ]
+
+    def expire_conversations(self) -> list[ConversationFiles]:
+        expired_files, spill_files = self._pop_expired()
+        return expired_files + self._files_of_spilled(spill_files)
+
+    async def aexpire_conversations(self) -> list[ConversationFiles]:
+        # the cached sessions are taken out in place, reading back the spilled ones runs in a thread
+        expired_files, spill_files = self._pop_expired()
+        if spill_files:
+            expired_files += await asyncio.to_thread(self._files_of_spilled, spill_files)
+        return expired_files
 
     def clear_inactive_conversations(self):
         current_time = datetime.now()
         inactive_conversations = [
             session_id
             for session_id, conversation in self.conversation_caches.items()
-            if (current_time - conversation.updated_at) > timedelta(hours=24)
+            if (current_time - conversation.updated_at) > timedelta(hours=inactive_conversation_hours)
         ]
         for session_id in inactive_conversations:
             logger.info(f"clear history for {session_id}")
-            conversation = self.conversation_caches[session_id]
+            conversation = self._uncache(session_id)
+            self.in_turn.discard(session_id)
             conversation.delete_files()
-            del self.conversation_caches[session_id]
+            self.expiry_heap.remove(session_id)
+        self._report_memory()
+
+
+class StoreBackedConversationTracker(ConversationTracker):
+    """
+    Keeps sessions in a store shared by all worker processes instead of the process memory.
+    A session is only saved when nobody else saved it since it was loaded, see SessionStore.save.
+    """
+
+    def __init__(self, session_store: SessionStore):
+        self.session_store = session_store
+
+    def save_conversation(self, session_id: str, conversation_context: ConversationContext):
+        conversation_context.store_version = self.session_store.save(
+            session_id, serialize_conversation(conversation_context), conversation_context.store_version
+        )
+
+    def load_conversation(self, session_id: str) -> ConversationContext:
+        stored = self.session_store.load(session_id) if session_id else None
+        if stored is None:
+            return ConversationContext(current_user_input="", session_id=session_id)
+        logger.info(f"session_id is {session_id}")
+        data, version = stored
+        try:
+            conversation = deserialize_conversation(data)
+        except ValueError as err:
+            # saved in a format this version cannot read, the session starts again and replaces the stored one
+            logger.warning(f"start session {session_id} again, the stored one is unreadable: {err}")
+            conversation = ConversationContext(current_user_input="", session_id=session_id)
+        conversation.store_version = version
+        conversation.updated_at = datetime.now()
+        return conversation
+
+    async def asave_conversation(self, session_id: str, conversation_context: ConversationContext):
+        # the store is queried with blocking calls, they run in a thread so other sessions are not held up
+        await asyncio.to_thread(self.save_conversation, session_id, conversation_context)
+
+    async def aload_conversation(self, session_id: str) -> ConversationContext:
+        return await asyncio.to_thread(self.load_conversation, session_id)
+
+    def clear_inactive_conversations(self):
+        delete_conversation_files(self.expire_conversations())
+
+    async def aexpire_conversations(self) -> list[ConversationFiles]:
+        return await asyncio.to_thread(self.expire_conversations)
+
+    def expire_conversations(self) -> list[ConversationFiles]:
+        # the store keeps an index on the last save time, so no scan of all sessions is needed
+        return [
+            files_of_serialized_conversation(session_id, data)
+            for session_id, data in self.session_store.delete_inactive(inactive_conversation_hours * 3600)
+        ]
+
+
+class JournaledConversationTracker(BaseConversationTracker):
+    """
+    Keeps sessions in process memory like BaseConversationTracker, and journals every save to a local file,
+    so the sessions of a crashed or redeployed process are rebuilt when it starts again.
+    """
+
+    def __init__(self, journal: SessionJournal, **kwargs):
+        super().__init__(**kwargs)
+        self.journal = journal
+        now = datetime.now()
+        for session_id, conversation in journal.replay().items():
+            self._spill(self._cache(session_id, conversation), [])
+            # a rebuilt session expires when it would have without the restart
+            self._touch(session_id, idle_seconds=(now - conversation.updated_at).total_seconds())
+
+    def save_conversation(self, session_id: str, conversation_context: ConversationContext):
+        super().save_conversation(session_id, conversation_context)
+        self.journal.append_turn(conversation_context)
+
+    async def asave_conversation(self, session_id: str, conversation_context: ConversationContext):
+        await super().asave_conversation(session_id, conversation_context)
+        self.journal.append_turn(conversation_context)
+
+    def expire_conversations(self) -> list[ConversationFiles]:
+        expired_files = super().expire_conversations()
+        self.journal.append_delete([conversation_files.session_id for conversation_files in expired_files])
+        return expired_files
+
+    async def aexpire_conversations(self) -> list[ConversationFiles]:
+        expired_files = await super().aexpire_conversations()
+        self.journal.append_delete([conversation_files.session_id for conversation_files in expired_files])
+        return expired_files
+
+    def close(self):
+        self.journal.close()
+
+    def clear_inactive_conversations(self):
+        session_ids = set(self.conversation_caches)
+        super().clear_inactive_conversations()
+        self.journal.append_delete(list(session_ids - set(self.conversation_caches)))
+
+
+def create_conversation_tracker() -> ConversationTracker:
+    if conversation_tracker_backend == "sqlite":
+        return StoreBackedConversationTracker(SQLiteSessionStore(session_store_sqlite_path))
+    if conversation_tracker_backend == "journal":
+        return JournaledConversationTracker(SessionJournal(session_journal_dir))
+    return BaseConversationTracker()
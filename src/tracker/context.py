@@ -1,11 +1,16 @@
+import asyncio
+import copy
 import os
 import shutil
 import uuid
 from datetime import datetime
-from typing import List, Any, Optional, Sequence
+from typing import List, Any, Optional, Sequence, Callable, Awaitable
 from fastapi import UploadFile
 
+from metrics import count_cache_lookup
+from tracker.file_store import get_upload_file_store, session_upload_max_bytes
 from nlu.intent_with_entity import Entity, Intent, Slot
+from utils.tokens import count_tokens, get_history_token_budget
 from collections import deque
 
 from loguru import logger
@@ -28,15 +33,67 @@ def prepare_response_content(answer):
         return ""
 
 
+# tokens of the role and separators added by the chat format to every message
+ROUND_TOKEN_OVERHEAD = 4
+
+
 class History:
+    __slots__ = ("max_history", "rounds", "token_counts", "version", "format_cache", "next_round_id")
+
     def __init__(self, rounds: List[dict[str, Any]], max_history: int = 9):
         self.max_history = max_history
-        self.rounds = rounds[-self.max_history :]
+        # every round gets the next id when it is added, ids are never reused, unlike the positions of the rounds
+        self.next_round_id = max((entry["id"] for entry in rounds if "id" in entry), default=-1) + 1
+        rounds = [entry if "id" in entry else self._with_next_id(entry) for entry in rounds]
+        # ring buffer, the oldest round is dropped when a round is added to a full history
+        self.rounds: deque[dict[str, Any]] = deque(rounds, maxlen=max_history)
+        # token count of each round, aligned with the rounds and counted on first use
+        self.token_counts: deque[Optional[int]] = deque([None] * len(self.rounds), maxlen=max_history)
+        # bumped by every change of the rounds
+        self.version = 0
+        # formatted views of the current version, keyed by view name and rename
+        self.format_cache: dict[tuple, Any] = {}
+
+    def __getstate__(self):
+        return {"max_history": self.max_history, "rounds": list(self.rounds), "next_round_id": self.next_round_id}
+
+    def __setstate__(self, state):
+        # rounds pickled before they had ids get them in their order
+        self.__init__(state["rounds"], state["max_history"])
+        self.next_round_id = max(self.next_round_id, state.get("next_round_id", 0))
+
+    def _with_next_id(self, entry: dict[str, Any]) -> dict[str, Any]:
+        self.next_round_id += 1
+        return {**entry, "id": self.next_round_id - 1}
+
+    def _changed(self):
+        self.version += 1
+        self.format_cache = {}
 
     def add_history(self, role: str, message: str, file_name: str = None):
-        if len(self.rounds) >= self.max_history:
-            self.rounds.pop(0)
-        self.rounds.append({"role": role, "content": message, "file_name": file_name})
+        self.append_round({"role": role, "content": message, "file_name": file_name})
+
+    def append_round(self, entry: dict[str, Any]):
+        """append a round, one replayed from a journal keeps its id"""
+        entry = entry if "id" in entry else self._with_next_id(entry)
+        self.next_round_id = max(self.next_round_id, entry["id"] + 1)
+        is_full = len(self.rounds) == self.max_history
+        self.rounds.append(entry)
+        self.token_counts.append(None)
+        if is_full:
+            # the oldest round is dropped, so every view changes from its start
+            self._changed()
+            return
+        self.version += 1
+        # the cached views only grow by the new round
+        for key, view in list(self.format_cache.items()):
+            if key[0] == "window":
+                del self.format_cache[key]
+            elif key[0] == "messages":
+                view.append(self.format_message(entry))
+            else:
+                formatted_entry = self._format_entry(key, entry)
+                self.format_cache[key] = view + "\n" + formatted_entry if len(self.rounds) > 1 else formatted_entry
 
     def delete_latest_conversation_history(self):
         round_to_delete = 2 if len(self.rounds) > 1 else len(self.rounds)
@@ -45,25 +102,39 @@ class History:
     def delete_n_round(self, n: int):
         for _ in range(n):
             self.rounds.pop()
+            self.token_counts.pop()
+        self._changed()
 
     def keep_latest_n_rounds(self, n: int):
         if n <= 0:
             return
-        self.rounds = self.rounds[-n:]
+        while len(self.rounds) > n:
+            self.rounds.popleft()
+            self.token_counts.popleft()
+        self._changed()
 
     def flag_history_summarized(self, n: int):
         if n <= 0:
             return
-        last_n_history = self.rounds[-n:]
-        last_n_summarized_history = [{**history, "summarized": True} for history in last_n_history]
-        self.rounds = self.rounds[:-n] + last_n_summarized_history
+        for index in range(max(0, len(self.rounds) - n), len(self.rounds)):
+            self.rounds[index] = {**self.rounds[index], "summarized": True}
+        # the summarized flag is not part of any formatted view, so the cached views stay valid
+        self.version += 1
+
+    def _cached_view(self, key: tuple, build: Callable[[], Any]) -> Any:
+        if key not in self.format_cache:
+            self.format_cache[key] = build()
+        return self.format_cache[key]
+
+    def _format_entry(self, key: tuple, entry: dict[str, Any]) -> str:
+        if key[0] == "string_with_file_name":
+            return self.format_message_with_file_name(entry)
+        rename = dict(key[1])
+        return f'### {rename.get(entry["role"], entry["role"])}:\n {entry["content"]}'
 
     def format_string(self, rename: dict = None):
-        if not rename:
-            rename = {}
-        return "\n".join(
-            [f'### {rename.get(entry["role"], entry["role"])}:\n {entry["content"]}' for entry in self.rounds]
-        )
+        key = ("string", tuple(sorted(rename.items())) if rename else ())
+        return self._cached_view(key, lambda: "\n".join([self._format_entry(key, entry) for entry in self.rounds]))
 
     @classmethod
     def format_message_with_file_name(cls, one_round):
@@ -73,37 +144,168 @@ class History:
             return f'{one_round["role"]}: {one_round["content"]} '
 
     def format_string_with_file_name(self):
-        return "\n".join([self.format_message_with_file_name(entry) for entry in self.rounds])
+        key = ("string_with_file_name",)
+        return self._cached_view(key, lambda: "\n".join([self._format_entry(key, entry) for entry in self.rounds]))
+
+    @classmethod
+    def format_message(cls, one_round):
+        return {"role": one_round["role"], "content": one_round["content"]}
 
     def format_messages(self):
-        return [{"role": entry["role"], "content": entry["content"]} for entry in self.rounds]
+        messages = self._cached_view(("messages",), lambda: [self.format_message(entry) for entry in self.rounds])
+        # callers may change the list, the cached one is kept intact
+        return [dict(message) for message in messages]
 
     def get_latest(self):
         return self.rounds[-1]["content"] if len(self.rounds) > 0 else ""
 
+    def get_round_token_count(self, index: int) -> int:
+        if self.token_counts[index] is None:
+            self.token_counts[index] = count_tokens(str(self.rounds[index]["content"])) + ROUND_TOKEN_OVERHEAD
+        return self.token_counts[index]
+
+    def window(self, max_tokens: int, summary: str = None) -> "History":
+        """
+        The newest rounds fitting the token budget, the latest round is always kept.
+        When older rounds are dropped, the summary of the conversation takes their place if there is one.
+        """
+        return self._cached_view(("window", max_tokens, summary), lambda: self._build_window(max_tokens, summary))
+
+    def _count_newest_rounds_within(self, max_tokens: int) -> int:
+        count, used_tokens = 0, 0
+        for index in range(len(self.rounds) - 1, -1, -1):
+            used_tokens += self.get_round_token_count(index)
+            if count > 0 and used_tokens > max_tokens:
+                break
+            count += 1
+        return count
+
+    def _build_window(self, max_tokens: int, summary: str = None) -> "History":
+        count = self._count_newest_rounds_within(max_tokens)
+        if count == len(self.rounds):
+            return self
+        summary_round = None
+        if summary:
+            summary_round = {
+                "role": "system",
+                "content": f"summary of the earlier conversation: {summary}",
+                "file_name": None,
+            }
+            count = self._count_newest_rounds_within(max_tokens - count_tokens(summary_round["content"]))
+        rounds = list(self.rounds)[len(self.rounds) - count :]
+        token_counts = list(self.token_counts)[len(self.rounds) - count :]
+        if summary_round:
+            rounds.insert(0, summary_round)
+            token_counts.insert(0, None)
+        window = History(rounds, max_history=len(rounds))
+        window.token_counts = deque(token_counts, maxlen=len(rounds))
+        return window
+
 
 class ConversationFiles:
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, max_bytes: int = session_upload_max_bytes):
         self.session_id = session_id
         self.file_dir = os.path.join(os.path.dirname(__file__), "../tmp", self.session_id)
         self.filenames = []
+        self.max_bytes = max_bytes
+        # content digest and size of each file name, a file sent again with the same content is not stored again
+        self.file_digests: dict[str, tuple[str, int]] = {}
+
+    def __setstate__(self, state):
+        # sessions pickled before the files were stored by content
+        self.__dict__.update({"max_bytes": session_upload_max_bytes, "file_digests": {}, **state})
 
-    def add_files(self, files: list[UploadFile]):
+    @property
+    def total_bytes(self) -> int:
+        return sum(size for _, size in self.file_digests.values())
+
+    async def add_files(self, files: list[UploadFile]):
         if files and len(files) > 0:
-            if not os.path.exists(self.file_dir):
-                os.makedirs(self.file_dir)
-            for f in files:
-                file_path = f"{self.file_dir}/{f.filename}"
-                self.filenames.append(f.filename)
-                with open(file_path, "wb+") as fo:
-                    shutil.copyfileobj(f.file, fo)
+            # the copy and hashing block, so they run in a thread instead of the event loop
+            await asyncio.to_thread(self._store_files, files)
+
+    def _store_files(self, files: list[UploadFile]):
+        file_store = get_upload_file_store()
+        os.makedirs(self.file_dir, exist_ok=True)
+        for f in files:
+            filename = os.path.basename(f.filename)
+            previous_digest, previous_size = self.file_digests.get(filename, (None, 0))
+            digest, size = file_store.store(
+                f.file, self.max_bytes - self.total_bytes + previous_size, os.path.join(self.file_dir, filename)
+            )
+            self.file_digests[filename] = (digest, size)
+            if previous_digest and digest != previous_digest:
+                file_store.release({previous_digest})
+            if filename not in self.filenames:
+                self.filenames.append(filename)
 
     def delete_files(self):
-        if os.path.exists(self.file_dir):
-            shutil.rmtree(self.file_dir)
+        if not os.path.exists(self.file_dir):
+            return
+        shutil.rmtree(self.file_dir)
+        if self.file_digests:
+            get_upload_file_store().release({digest for digest, _ in self.file_digests.values()})
+        self.file_digests = {}
+
+
+file_fetch_cache_session_scoped = os.getenv("FILE_FETCH_CACHE_SESSION_SCOPED", "False") == "True"
+
+
+class FileFetchCache:
+    """Fetches each file url once, concurrent fetches of the same url share one download."""
+
+    def __init__(self):
+        self.fetches: dict[tuple[str, str], asyncio.Future] = {}
+
+    async def get_or_fetch(self, kind: str, url: str, fetch: Callable[[str], Awaitable[Any]]) -> Any:
+        key = (kind, url)
+        count_cache_lookup("file_fetch", key in self.fetches)
+        if key not in self.fetches:
+            self.fetches[key] = asyncio.ensure_future(fetch(url))
+        fetching = self.fetches[key]
+        try:
+            result = await asyncio.shield(fetching)
+        except Exception:
+            self.fetches.pop(key, None)
+            raise
+        # failed downloads come back as None, let the next caller retry
+        if result is None and self.fetches.get(key) is fetching:
+            del self.fetches[key]
+        return result
+
+    def clear(self):
+        self.fetches = {}
 
 
 class ConversationContext:
+    __slots__ = (
+        "is_email_request",
+        "current_user_input",
+        "current_new_request",
+        "session_id",
+        "current_intent",
+        "current_intent_slots",
+        "intent_queue",
+        "history",
+        "summarized_history_context",
+        "status",
+        "state",
+        "entity_store",
+        "created_at",
+        "updated_at",
+        "inquiry_times",
+        "has_update",
+        "current_round",
+        "files",
+        "uploaded_file_urls",
+        "confused_intents",
+        "appended_history_count_in_one_chat",
+        "start_new_question",
+        "file_fetch_cache",
+        "store_version",
+        "summarized_through_round_id",
+    )
+
     def __init__(
         self,
         current_user_input: str,
@@ -119,11 +321,14 @@ class ConversationContext:
         self.intent_queue = deque(maxlen=3)
         self.history = History([])
         self.summarized_history_context = None
+        # id of the latest round covered by the summary
+        self.summarized_through_round_id = -1
         # used for logging
         self.status = "start"
         # used for condition jughment
         self.state = ""
-        self.entities: list[Entity] = []
+        # entities keyed by their type, in the order they were first added
+        self.entity_store: dict[str, Entity] = {}
         self.created_at = datetime.now()
         self.updated_at = datetime.now()
         # counter for inquiry times
@@ -135,9 +340,33 @@ class ConversationContext:
         self.confused_intents: list[Intent] = []
         self.appended_history_count_in_one_chat = 0
         self.start_new_question = False
+        self.file_fetch_cache = FileFetchCache()
+        # version of the session in the shared session store, 0 when it has never been stored
+        self.store_version = 0
+
+    def __getstate__(self):
+        # the fetch cache holds futures of the serving event loop, it is rebuilt when the session is loaded
+        return {name: getattr(self, name) for name in self.__slots__ if name != "file_fetch_cache"}
+
+    def __setstate__(self, state):
+        # sessions pickled before the summary covered rounds by their ids
+        self.summarized_through_round_id = -1
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.file_fetch_cache = FileFetchCache()
+
+    @property
+    def entities(self) -> list[Entity]:
+        return list(self.entity_store.values())
+
+    @entities.setter
+    def entities(self, entities: list[Entity]):
+        self.entity_store = {entity.type: entity for entity in entities}
 
     def start_one_chat(self):
         self.appended_history_count_in_one_chat = 0
+        if not file_fetch_cache_session_scoped:
+            self.file_fetch_cache.clear()
 
     def contains_multiple_files(self):
         return len(self.uploaded_file_urls) > 1
@@ -148,12 +377,49 @@ class ConversationContext:
     def get_history(self) -> History:
         return self.history
 
+    def get_history_window(self, scenario: str) -> History:
+        """the newest history rounds fitting the token budget of the scenario"""
+        return self.history.window(get_history_token_budget(scenario), self.summarized_history_context)
+
     def get_unsummarized_history(self) -> list[dict]:
-        return [history for history in self.history.rounds if history.get("summarized") is not True]
+        return [
+            history
+            for history in self.history.rounds
+            if history.get("summarized") is not True and history["id"] > self.summarized_through_round_id
+        ]
+
+    def apply_history_summary(self, summary: str, summarized_through_round_id: int) -> bool:
+        """take a summary unless the session has a newer one, or never had the rounds it covers"""
+        if (
+            summarized_through_round_id <= self.summarized_through_round_id
+            or summarized_through_round_id >= self.history.next_round_id
+        ):
+            return False
+        self.summarized_history_context = summary
+        self.summarized_through_round_id = summarized_through_round_id
+        return True
 
     def reset_history(self):
         self.history.delete_n_round(self.appended_history_count_in_one_chat)
 
+    def save_turn_state(self) -> dict[str, Any]:
+        """
+        copy of the state a turn changes, restored by restore_turn_state when the turn is aborted.
+        The stored files and the fetch cache outlive the turn, the rounds are never changed in place so they are shared
+        """
+        return {
+            name: copy.copy(self.history) if name == "history" else copy.deepcopy(getattr(self, name))
+            for name in self.__slots__
+            if name not in ("files", "file_fetch_cache", "store_version")
+        }
+
+    def restore_turn_state(self, state: dict[str, Any]):
+        # ids of the dropped rounds are not reused, a background summary may already cover them
+        next_round_id = self.history.next_round_id
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.history.next_round_id = max(self.history.next_round_id, next_round_id)
+
     def append_user_history(self, message: str, file_name: str = None):
         self.appended_history_count_in_one_chat += 1
         self.history.add_history("user", message, file_name)
@@ -163,8 +429,8 @@ class ConversationContext:
         response_content = prepare_response_content(answer)
         self.history.add_history("assistant", response_content)
 
-    def add_files(self, files: list[UploadFile]):
-        self.files.add_files(files)
+    async def add_files(self, files: list[UploadFile]):
+        await self.files.add_files(files)
 
     def add_file_urls(self, urls: list[str]):
         new_urls = list(set(urls) - set(self.uploaded_file_urls))
@@ -174,27 +440,22 @@ class ConversationContext:
         self.files.delete_files()
 
     def add_entity(self, entities: List[Entity]):
-        entity_map = {entity.type: entity for entity in self.entities}
-
         # todo: set as True when updated entity belong to current intent
         if len(entities) > 0:
             self.inquiry_times = 0
             self.has_update = True
 
         for new_entity in entities:
-            if new_entity.type in entity_map:
-                existing_entity = entity_map[new_entity.type]
+            if new_entity.type in self.entity_store:
+                existing_entity = self.entity_store[new_entity.type]
                 existing_entity.__dict__.update(new_entity.__dict__)
                 logger.info(f"Updated entity {new_entity.type} for session {self.session_id}")
             else:
-                self.entities.append(new_entity)
+                self.entity_store[new_entity.type] = new_entity
                 logger.info(f"Added entity {new_entity.type} for session {self.session_id}")
 
     def get_entity_by_name(self, entity_name: str) -> Optional[Entity]:
-        for entity in self.entities:
-            if entity.type == entity_name:
-                return entity
-        return None
+        return self.entity_store.get(entity_name)
 
     def get_entities(self):
         return self.entities
@@ -203,18 +464,17 @@ class ConversationContext:
         return [slot.name for slot in self.current_intent_slots]
 
     def get_extracted_entities(self) -> List[Entity]:
-        return [entity for entity in self.entities if entity.type in self.get_current_intent_slot_names()]
+        slot_names = set(self.get_current_intent_slot_names())
+        return [entity for entity in self.entity_store.values() if entity.type in slot_names]
 
     def get_unfilled_slots(self) -> List[Slot]:
-        return [
-            slot for slot in self.current_intent_slots if slot.name not in [entity.type for entity in self.entities]
-        ]
+        return [slot for slot in self.current_intent_slots if slot.name not in self.entity_store]
 
     def get_simplified_entities(self):
-        return {entity.type: entity.value for entity in self.entities}
+        return {entity_type: entity.value for entity_type, entity in self.entity_store.items()}
 
     def flush_entities(self):
-        self.entities = []
+        self.entity_store = {}
 
     def set_status(self, status: str):
         self.status = status
@@ -256,11 +516,10 @@ class ConversationContext:
         if next_intent.name in ["positive"] and self.state.split(":")[0] in ["slot_confirm"]:
             self.inquiry_times = 0
             slot_name = self.state.split(":")[1].strip()
-            for entity in self.entities:
-                if entity.type == slot_name:
-                    entity.confidence = 1.0
-                    entity.possible_slot.confidence = 1.0
-                    break
+            entity = self.entity_store.get(slot_name)
+            if entity:
+                entity.confidence = 1.0
+                entity.possible_slot.confidence = 1.0
 
         # if user deny intent in current round
         if next_intent.name in ["negative"] and self.state.split(":")[0] not in [
@@ -276,7 +535,7 @@ class ConversationContext:
             "slot_filling",
         ]:
             slot_name = self.state.split(":")[1].strip()
-            self.entities = [entity for entity in self.entities if entity.type != slot_name]
+            self.entity_store.pop(slot_name, None)
 
     def update_intent(self, intent: Intent):
         if intent is not None:
@@ -0,0 +1,99 @@
+import asyncio
+import heapq
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from loguru import logger
+
+from metrics import session_expiry_seconds, sessions_expired_total
+from tracker.context import ConversationFiles
+
+session_expiry_interval_seconds = float(os.getenv("SESSION_EXPIRY_INTERVAL_SECONDS", 60))
+
+
+class ExpiryHeap:
+    """
+    Min-heap of session expiry times. Touching a session pushes a new entry instead of updating the old one,
+    superseded entries are skipped when they reach the top.
+    """
+
+    def __init__(self):
+        self.heap: list[tuple[float, str]] = []
+        self.expires_at: dict[str, float] = {}
+
+    def touch(self, session_id: str, expires_at: float):
+        self.expires_at[session_id] = expires_at
+        heapq.heappush(self.heap, (expires_at, session_id))
+        # superseded entries pile up for busy sessions, rebuild once they outnumber the live ones
+        if len(self.heap) > 2 * len(self.expires_at) + 64:
+            self.heap = [(expires_at, session_id) for session_id, expires_at in self.expires_at.items()]
+            heapq.heapify(self.heap)
+
+    def remove(self, session_id: str):
+        self.expires_at.pop(session_id, None)
+
+    def pop_expired(self, now: float) -> list[str]:
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            expires_at, session_id = heapq.heappop(self.heap)
+            if self.expires_at.get(session_id) == expires_at:
+                del self.expires_at[session_id]
+                expired.append(session_id)
+        return expired
+
+    def __len__(self):
+        return len(self.expires_at)
+
+
+def delete_conversation_files(files: list[ConversationFiles]):
+    for conversation_files in files:
+        try:
+            conversation_files.delete_files()
+        except OSError as err:
+            logger.error(f"failed to delete files of session {conversation_files.session_id}: {err}")
+
+
+class SessionExpiryWorker:
+    """Expires inactive sessions in the background, off the request path, and deletes their files in a thread."""
+
+    def __init__(
+        self,
+        expire_conversations: Callable[[], Awaitable[list[ConversationFiles]]],
+        interval: float = session_expiry_interval_seconds,
+    ):
+        self.expire_conversations = expire_conversations
+        self.interval = interval
+        self.runner: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.runner is None:
+            self.runner = asyncio.create_task(self._run())
+
+    async def expire_once(self) -> int:
+        start_time = time.perf_counter()
+        expired_files = await self.expire_conversations()
+        if expired_files:
+            await asyncio.to_thread(delete_conversation_files, expired_files)
+            logger.info(f"expired {len(expired_files)} inactive sessions")
+        sessions_expired_total.inc(len(expired_files))
+        session_expiry_seconds.observe(time.perf_counter() - start_time)
+        return len(expired_files)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.expire_once()
+            except Exception as err:
+                logger.error(f"failed to expire inactive sessions: {err}")
+
+    async def shutdown(self):
+        if self.runner is None:
+            return
+        self.runner.cancel()
+        try:
+            await self.runner
+        except asyncio.CancelledError:
+            pass
+        self.runner = None
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from functools import lru_cache
+from typing import BinaryIO, Optional
+
+from loguru import logger
+
+from metrics import upload_store_bytes
+
+upload_blob_dir = os.getenv("UPLOAD_BLOB_DIR", os.path.join(os.path.dirname(__file__), "../tmp", ".blobs"))
+upload_store_max_bytes = int(os.getenv("UPLOAD_STORE_MAX_BYTES", 10 * 1024 * 1024 * 1024))
+session_upload_max_bytes = int(os.getenv("SESSION_UPLOAD_MAX_BYTES", 200 * 1024 * 1024))
+upload_chunk_bytes = 1024 * 1024
+
+
+class UploadQuotaExceededException(Exception):
+    def __init__(self, scope: str, max_bytes: int):
+        super().__init__(f"uploaded files exceed the {scope} quota of {max_bytes} bytes")
+        self.scope = scope
+        self.max_bytes = max_bytes
+
+
+class ContentAddressedFileStore:
+    """
+    Keeps one copy of each distinct uploaded file, named by the sha256 of its content. Sessions hard link the copy
+    into their own directory, so the link count of a file tells whether any session still uses it.
+    """
+
+    def __init__(self, blob_dir: str = upload_blob_dir, max_bytes: int = upload_store_max_bytes):
+        self.blob_dir = blob_dir
+        self.max_bytes = max_bytes
+        # guards the check and change of the blob files and their links, the copies themselves run without it
+        self.lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.total_bytes = 0
+        for entry in os.scandir(self.blob_dir):
+            if entry.name.endswith(".part"):
+                # left by a copy interrupted by a restart
+                os.remove(entry.path)
+            else:
+                self.total_bytes += entry.stat().st_size
+        upload_store_bytes.set(self.total_bytes)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest)
+
+    def store(self, source: BinaryIO, max_bytes: int, target_path: str) -> tuple[str, int]:
+        """
+        copy the stream into the store while hashing it, and link the content to the target path,
+        return the digest and size of the content
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.blob_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as target:
+                while chunk := source.read(upload_chunk_bytes):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise UploadQuotaExceededException("session", max_bytes)
+                    sha256.update(chunk)
+                    target.write(chunk)
+            digest = sha256.hexdigest()
+            # linked before the lock is released, so a concurrent release never sees the content unused
+            with self.lock:
+                if not os.path.exists(self._path(digest)):
+                    if self.total_bytes + size > self.max_bytes:
+                        raise UploadQuotaExceededException("global", self.max_bytes)
+                    os.replace(temp_path, self._path(digest))
+                    self.total_bytes += size
+                    upload_store_bytes.set(self.total_bytes)
+                self._link(digest, target_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return digest, size
+
+    def _link(self, digest: str, target_path: str):
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        try:
+            os.link(self._path(digest), target_path)
+        except OSError:
+            # e.g. the session directory is on another file system
+            shutil.copyfile(self._path(digest), target_path)
+
+    def release(self, digests: Optional[set[str]] = None):
+        """delete the given files, or any file, no session links to any more. Call it after removing links"""
+        with self.lock:
+            if digests is None:
+                digests = {entry.name for entry in os.scandir(self.blob_dir) if not entry.name.endswith(".part")}
+            for digest in digests:
+                path = self._path(digest)
+                if os.path.exists(path) and os.stat(path).st_nlink == 1:
+                    self.total_bytes -= os.path.getsize(path)
+                    os.remove(path)
+            upload_store_bytes.set(self.total_bytes)
+
+
+@lru_cache(maxsize=1)
+def get_upload_file_store() -> ContentAddressedFileStore:
+    logger.info(f"uploaded files are stored in {upload_blob_dir}")
+    return ContentAddressedFileStore()
@@ -0,0 +1,258 @@
+import os
+import pickle
+import queue
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Any, BinaryIO, Iterator, Optional
+
+from loguru import logger
+
+from tracker.context import ConversationContext
+from tracker.session_store import deserialize_conversation, serialize_conversation
+
+session_journal_snapshot_events = int(os.getenv("SESSION_JOURNAL_SNAPSHOT_EVENTS", 1000))
+session_journal_fsync = os.getenv("SESSION_JOURNAL_FSYNC", "False") == "True"
+
+# length and crc32 of the payload
+RECORD_HEADER = struct.Struct(">II")
+JOURNAL_FILE_PATTERN = re.compile(r"journal\.(\d+)\.log$")
+
+
+def history_delta(rounds: list[dict], journaled_through_id: int) -> dict[str, Any]:
+    """
+    the change of the history since the rounds up to journaled_through_id were journaled: the range of journaled round
+    ids still kept, the other journaled rounds were dropped from either end, and the rounds appended after them
+    """
+    kept_ids = [entry["id"] for entry in rounds if entry["id"] <= journaled_through_id]
+    return {
+        "kept_from_id": kept_ids[0] if kept_ids else journaled_through_id + 1,
+        "kept_through_id": kept_ids[-1] if kept_ids else -1,
+        "appended": [entry for entry in rounds if entry["id"] > journaled_through_id],
+    }
+
+
+def encode_record(event: Any) -> bytes:
+    payload = pickle.dumps(event, protocol=pickle.HIGHEST_PROTOCOL)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(f: BinaryIO) -> Iterator[Any]:
+    """read until the end, or until a record torn by a crash in the middle of its write"""
+    while header := f.read(RECORD_HEADER.size):
+        if len(header) < RECORD_HEADER.size:
+            return
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            logger.warning(f"skip the torn tail of session journal {f.name}")
+            return
+        yield pickle.loads(payload)
+
+
+class SessionJournal:
+    """
+    Append-only log of the session changes of every turn, for rebuilding the sessions after a restart.
+    Records are encoded on the caller and written by a thread of their own, so no file write or fsync blocks the
+    event loop. Every few events the journal moves on to a file of the next generation, and another thread compacts
+    the previous snapshot and the closed journal files into a new snapshot, without touching the live sessions.
+    """
+
+    def __init__(
+        self,
+        journal_dir: str,
+        snapshot_events: int = session_journal_snapshot_events,
+        fsync: bool = session_journal_fsync,
+    ):
+        self.journal_dir = journal_dir
+        self.snapshot_events = snapshot_events
+        self.fsync = fsync
+        self.generation = 0
+        self.events_since_snapshot = 0
+        # id of the latest round journaled of each session, the next turn only writes the rounds changed since
+        self.journaled_round_ids: dict[str, int] = {}
+        self.journal_file: Optional[BinaryIO] = None
+        self.records: queue.Queue[Optional[bytes]] = queue.Queue()
+        self.writer: Optional[threading.Thread] = None
+        self.compactor: Optional[threading.Thread] = None
+        os.makedirs(self.journal_dir, exist_ok=True)
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.journal_dir, "snapshot.bin")
+
+    def _journal_path(self, generation: int) -> str:
+        return os.path.join(self.journal_dir, f"journal.{generation}.log")
+
+    def _journal_generations(self) -> list[int]:
+        return sorted(
+            int(match.group(1)) for match in map(JOURNAL_FILE_PATTERN.match, os.listdir(self.journal_dir)) if match
+        )
+
+    def _load(self, max_generation: Optional[int] = None) -> tuple[dict[str, ConversationContext], int, int]:
+        """the sessions of the snapshot and the journal files after it, up to max_generation"""
+        sessions: dict[str, ConversationContext] = {}
+        snapshot_generation = -1
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+            snapshot_generation = snapshot["generation"]
+            for session_id, data in snapshot["sessions"].items():
+                try:
+                    sessions[session_id] = deserialize_conversation(data)
+                except ValueError as err:
+                    logger.warning(f"skip session {session_id} of the snapshot, it is unreadable: {err}")
+        event_count = 0
+        for generation in self._journal_generations():
+            if generation <= snapshot_generation or (max_generation is not None and generation > max_generation):
+                continue
+            with open(self._journal_path(generation), "rb") as f:
+                for event in read_records(f):
+                    self._apply(sessions, event)
+                    event_count += 1
+        return sessions, snapshot_generation, event_count
+
+    def replay(self) -> dict[str, ConversationContext]:
+        start_time = time.perf_counter()
+        sessions, snapshot_generation, event_count = self._load()
+        self.generation = max([snapshot_generation, *self._journal_generations()]) + 1
+        self.events_since_snapshot = event_count
+        self.journaled_round_ids = {
+            session_id: conversation.history.rounds[-1]["id"] if conversation.history.rounds else -1
+            for session_id, conversation in sessions.items()
+        }
+        self._open_journal()
+        logger.info(
+            f"replayed {len(sessions)} sessions from snapshot generation {snapshot_generation} "
+            f"and {event_count} events in {time.perf_counter() - start_time:.2f}s"
+        )
+        return sessions
+
+    @staticmethod
+    def _apply(sessions: dict[str, ConversationContext], event: dict):
+        session_id = event["session_id"]
+        if event["type"] == "delete":
+            sessions.pop(session_id, None)
+            return
+        if session_id not in sessions:
+            sessions[session_id] = ConversationContext(current_user_input="", session_id=session_id)
+        conversation = sessions[session_id]
+        for name, value in event["state"].items():
+            setattr(conversation, name, value)
+        history = conversation.history
+        truncate = sum(1 for entry in history.rounds if entry["id"] > event["kept_through_id"])
+        if truncate:
+            history.delete_n_round(truncate)
+        # the oldest rounds dropped by a full history or by keep_latest_n_rounds
+        kept = sum(1 for entry in history.rounds if entry["id"] >= event["kept_from_id"])
+        if kept == 0:
+            history.delete_n_round(len(history.rounds))
+        elif kept < len(history.rounds):
+            history.keep_latest_n_rounds(kept)
+        for entry in event["appended"]:
+            history.append_round(entry)
+        history.next_round_id = max(history.next_round_id, event["next_round_id"])
+
+    def _open_journal(self):
+        if self.journal_file:
+            self.journal_file.close()
+        self.journal_file = open(self._journal_path(self.generation), "ab")
+
+    def _enqueue(self, event: dict):
+        # encoded now, the session keeps changing on the event loop while the record waits for the writer
+        self.records.put(encode_record(event))
+        if self.writer is None:
+            self.writer = threading.Thread(target=self._run_writer, name="session-journal-writer", daemon=True)
+            self.writer.start()
+
+    def _run_writer(self):
+        while True:
+            record = self.records.get()
+            try:
+                if record is None:
+                    return
+                self._write(record)
+            except Exception as err:
+                logger.error(f"failed to write session journal: {err}")
+            finally:
+                self.records.task_done()
+
+    def _write(self, record: bytes):
+        if self.journal_file is None:
+            self._open_journal()
+        self.journal_file.write(record)
+        self.journal_file.flush()
+        if self.fsync:
+            os.fsync(self.journal_file.fileno())
+        self.events_since_snapshot += 1
+        if self.events_since_snapshot >= self.snapshot_events and not (self.compactor and self.compactor.is_alive()):
+            self._rotate()
+
+    def _rotate(self):
+        covered_generation = self.generation
+        self.generation += 1
+        self.events_since_snapshot = 0
+        self._open_journal()
+        self.compactor = threading.Thread(
+            target=self._compact, args=(covered_generation,), name="session-journal-compactor", daemon=True
+        )
+        self.compactor.start()
+
+    def _compact(self, covered_generation: int):
+        try:
+            sessions, _, _ = self._load(covered_generation)
+            self.write_snapshot(
+                {session_id: serialize_conversation(c) for session_id, c in sessions.items()}, covered_generation
+            )
+        except Exception as err:
+            logger.error(f"failed to compact session journal up to generation {covered_generation}: {err}")
+
+    def append_turn(self, conversation: ConversationContext):
+        session_id = conversation.session_id
+        history = conversation.history
+        delta = history_delta(list(history.rounds), self.journaled_round_ids.get(session_id, -1))
+        state = conversation.__getstate__()
+        del state["history"]
+        self._enqueue(
+            {"type": "turn", "session_id": session_id, "state": state, "next_round_id": history.next_round_id, **delta}
+        )
+        if history.rounds:
+            self.journaled_round_ids[session_id] = history.rounds[-1]["id"]
+
+    def append_delete(self, session_ids: list[str]):
+        for session_id in session_ids:
+            self._enqueue({"type": "delete", "session_id": session_id})
+            self.journaled_round_ids.pop(session_id, None)
+
+    def write_snapshot(self, sessions: dict[str, bytes], covered_generation: int):
+        """sessions are serialized by serialize_conversation, they must include all events up to covered_generation"""
+        start_time = time.perf_counter()
+        temp_path = self.snapshot_path + ".part"
+        with open(temp_path, "wb") as f:
+            pickle.dump({"generation": covered_generation, "sessions": sessions}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        for generation in self._journal_generations():
+            if generation <= covered_generation:
+                os.remove(self._journal_path(generation))
+        logger.info(f"wrote snapshot of {len(sessions)} sessions in {time.perf_counter() - start_time:.2f}s")
+
+    def flush(self):
+        """wait until the records appended so far are written, and the running compaction is done"""
+        self.records.join()
+        if self.compactor:
+            self.compactor.join()
+
+    def close(self):
+        if self.writer:
+            self.records.put(None)
+            self.writer.join()
+            self.writer = None
+        if self.compactor:
+            self.compactor.join()
+        if self.journal_file:
+            self.journal_file.close()
+            self.journal_file = None
@@ -0,0 +1,270 @@
+import json
+import os
+import shutil
+import sqlite3
+import time
+import urllib.parse
+import zlib
+from contextlib import closing, contextmanager
+from datetime import datetime
+from typing import Any, Iterator, Optional
+
+from loguru import logger
+
+from nlu.intent_with_entity import Entity, Intent, Slot
+from tracker.context import ConversationContext, History
+
+SESSION_FORMAT_VERSION = 2
+
+
+class SessionVersionConflictException(Exception):
+    def __init__(self, session_id: str, expected_version: int):
+        super().__init__(f"session {session_id} is changed by another worker since version {expected_version}")
+        self.session_id = session_id
+        self.expected_version = expected_version
+
+
+# plain fields of the session, copied as they are
+PLAIN_FIELDS = (
+    "current_user_input",
+    "current_new_request",
+    "is_email_request",
+    "summarized_history_context",
+    "summarized_through_round_id",
+    "status",
+    "state",
+    "inquiry_times",
+    "has_update",
+    "current_round",
+    "appended_history_count_in_one_chat",
+    "start_new_question",
+)
+
+
+def conversation_to_dict(conversation: ConversationContext) -> dict[str, Any]:
+    """
+    the session as json types, with an explicit field for each part of it, so a stored session does not depend on the
+    classes of the process that saved it, and loading it runs no code of the store
+    """
+    history = conversation.history
+    files = conversation.files
+    return {
+        "session_id": conversation.session_id,
+        **{name: getattr(conversation, name) for name in PLAIN_FIELDS},
+        "history": {
+            "max_history": history.max_history,
+            "rounds": list(history.rounds),
+            "next_round_id": history.next_round_id,
+        },
+        "current_intent": conversation.current_intent.model_dump(mode="json") if conversation.current_intent else None,
+        "current_intent_slots": [slot.model_dump(mode="json") for slot in conversation.current_intent_slots],
+        "intent_queue": [intent.model_dump(mode="json") for intent in conversation.intent_queue],
+        "confused_intents": [intent.model_dump(mode="json") for intent in conversation.confused_intents],
+        "entities": [entity.model_dump(mode="json") for entity in conversation.entity_store.values()],
+        "files": {"filenames": files.filenames, "file_digests": files.file_digests},
+        "uploaded_file_urls": conversation.uploaded_file_urls,
+        "created_at": conversation.created_at.isoformat(),
+        "updated_at": conversation.updated_at.isoformat(),
+    }
+
+
+def conversation_from_dict(data: dict[str, Any]) -> ConversationContext:
+    conversation = ConversationContext(current_user_input="", session_id=data["session_id"])
+    for name in PLAIN_FIELDS:
+        setattr(conversation, name, data[name])
+    history = data["history"]
+    conversation.history = History(history["rounds"], history["max_history"])
+    conversation.history.next_round_id = max(conversation.history.next_round_id, history["next_round_id"])
+    if data["current_intent"]:
+        conversation.current_intent = Intent.model_validate(data["current_intent"])
+    conversation.current_intent_slots = [Slot.model_validate(slot) for slot in data["current_intent_slots"]]
+    conversation.intent_queue.extend(Intent.model_validate(intent) for intent in data["intent_queue"])
+    conversation.confused_intents = [Intent.model_validate(intent) for intent in data["confused_intents"]]
+    conversation.entities = [Entity.model_validate(entity) for entity in data["entities"]]
+    conversation.files.filenames = data["files"]["filenames"]
+    conversation.files.file_digests = {
+        filename: (digest, size) for filename, (digest, size) in data["files"]["file_digests"].items()
+    }
+    conversation.uploaded_file_urls = data["uploaded_file_urls"]
+    conversation.created_at = datetime.fromisoformat(data["created_at"])
+    conversation.updated_at = datetime.fromisoformat(data["updated_at"])
+    return conversation
+
+
+def serialize_conversation(conversation: ConversationContext) -> bytes:
+    payload = json.dumps(conversation_to_dict(conversation), ensure_ascii=False, default=str, separators=(",", ":"))
+    return bytes([SESSION_FORMAT_VERSION]) + zlib.compress(payload.encode("utf-8"))
+
+
+def deserialize_conversation(data: bytes) -> ConversationContext:
+    """raises ValueError for the sessions of an unsupported format, like the pickled ones of version 1"""
+    if not data or data[0] != SESSION_FORMAT_VERSION:
+        raise ValueError(f"unsupported session format version {data[0] if data else None}")
+    return conversation_from_dict(json.loads(zlib.decompress(data[1:])))
+
+
+class SessionStore:
+    """Stores serialized sessions shared by all worker processes, every save bumps the session version."""
+
+    def load(self, session_id: str) -> Optional[tuple[bytes, int]]:
+        raise NotImplementedError
+
+    def save(self, session_id: str, data: bytes, expected_version: int) -> int:
+        """save only if the stored version is still the expected one, and return the new version"""
+        raise NotImplementedError
+
+    def delete_inactive(self, inactive_seconds: float) -> list[tuple[str, bytes]]:
+        """delete the sessions not saved within the given seconds, and return their ids and last saved data"""
+        raise NotImplementedError
+
+
+class SQLiteSessionStore(SessionStore):
+    """local stand-in of a shared session store, the file can be shared by the workers of one node"""
+
+    def __init__(self, db_path: str, busy_timeout_seconds: float = 5):
+        self.db_path = db_path
+        self.busy_timeout_seconds = busy_timeout_seconds
+        with self._connect() as con:
+            con.execute("pragma journal_mode=wal")
+            con.execute(
+                """create table if not exists session
+                (
+                    session_id TEXT primary key,
+                    version    INTEGER not null,
+                    data       BLOB    not null,
+                    updated_at REAL    not null
+                )"""
+            )
+            con.execute("create index if not exists session_updated_at on session (updated_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """commits or rolls back on exit like a connection, and closes the connection as well"""
+        with closing(sqlite3.connect(self.db_path, timeout=self.busy_timeout_seconds)) as con, con:
+            yield con
+
+    def load(self, session_id: str) -> Optional[tuple[bytes, int]]:
+        with self._connect() as con:
+            row = con.execute("select data, version from session where session_id = ?", (session_id,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def save(self, session_id: str, data: bytes, expected_version: int) -> int:
+        new_version = expected_version + 1
+        with self._connect() as con:
+            if expected_version == 0:
+                cursor = con.execute(
+                    "insert or ignore into session (session_id, version, data, updated_at) values (?, ?, ?, ?)",
+                    (session_id, new_version, data, time.time()),
+                )
+            else:
+                cursor = con.execute(
+                    "update session set version = ?, data = ?, updated_at = ? where session_id = ? and version = ?",
+                    (new_version, data, time.time(), session_id, expected_version),
+                )
+        if cursor.rowcount == 0:
+            raise SessionVersionConflictException(session_id, expected_version)
+        return new_version
+
+    def delete_inactive(self, inactive_seconds: float) -> list[tuple[str, bytes]]:
+        before = time.time() - inactive_seconds
+        with self._connect() as con:
+            rows = con.execute("select session_id, data from session where updated_at < ?", (before,)).fetchall()
+            # a session saved by another worker in the meantime is kept
+            sessions = [
+                (session_id, data)
+                for session_id, data in rows
+                if con.execute(
+                    "delete from session where session_id = ? and updated_at < ?", (session_id, before)
+                ).rowcount
+            ]
+        if sessions:
+            logger.info(f"deleted {len(sessions)} inactive sessions from the session store")
+        return sessions
+
+
+def process_exited(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+class SessionSpillDirectory:
+    """
+    Serialized sessions evicted from memory, read back when the session is active again. Every spill goes to a new
+    file, and the index only points to files completely written, so they can be written and read in threads.
+    """
+
+    def __init__(self, spill_dir: str):
+        # one directory per process, the workers of a node share the parent directory
+        self.spill_dir = os.path.join(spill_dir, str(os.getpid()))
+        self.paths: dict[str, str] = {}
+        self.file_count = 0
+        self._remove_left_over(spill_dir)
+
+    def _remove_left_over(self, parent_dir: str):
+        """the files of a previous process are never read back, its index is gone with it"""
+        if not os.path.isdir(parent_dir):
+            return
+        for name in os.listdir(parent_dir):
+            path = os.path.join(parent_dir, name)
+            if path == self.spill_dir or (name.isdigit() and process_exited(int(name))):
+                logger.info(f"remove sessions spilled by a previous process in {path}")
+                shutil.rmtree(path, ignore_errors=True)
+
+    def new_path(self, session_id: str) -> str:
+        self.file_count += 1
+        return os.path.join(self.spill_dir, f"{urllib.parse.quote(session_id, safe='')}.{self.file_count}.session")
+
+    def write_file(self, path: str, data: bytes):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def add(self, session_id: str, path: str) -> Optional[str]:
+        """index the file written for the session, the file of an older spill is returned for the caller to remove"""
+        old_path = self.paths.get(session_id)
+        self.paths[session_id] = path
+        return old_path
+
+    def take(self, session_id: str) -> Optional[str]:
+        """drop the session from the index and return its file, for the caller to read with read_taken"""
+        return self.paths.pop(session_id, None)
+
+    @staticmethod
+    def read_taken(path: str) -> bytes:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.remove(path)
+        return data
+
+    @staticmethod
+    def remove_files(paths: list[str]):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write(self, session_id: str, data: bytes):
+        path = self.new_path(session_id)
+        self.write_file(path, data)
+        old_path = self.add(session_id, path)
+        if old_path:
+            self.remove_files([old_path])
+
+    def pop(self, session_id: str) -> Optional[bytes]:
+        path = self.take(session_id)
+        return self.read_taken(path) if path else None
+
+    def delete(self, session_id: str):
+        path = self.take(session_id)
+        if path:
+            self.remove_files([path])
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.paths
+
+    def __len__(self):
+        return len(self.paths)
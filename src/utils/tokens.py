@@ -0,0 +1,28 @@
+import functools
+import json
+import os
+
+bundled_tiktoken_cache_dir = os.path.join(os.path.dirname(__file__), "..", "..", "tiktoken_cache")
+# use the encodings shipped with the repo when the cache dir is not configured, so no download is needed
+if "TIKTOKEN_CACHE_DIR" not in os.environ and os.path.isdir(bundled_tiktoken_cache_dir):
+    os.environ["TIKTOKEN_CACHE_DIR"] = os.path.abspath(bundled_tiktoken_cache_dir)
+
+import tiktoken  # noqa: E402
+
+token_encoding_model = os.getenv("TOKEN_ENCODING_MODEL", "gpt-4")
+default_history_token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", 3000))
+# e.g. {"same_topic_check": 1500, "chit_chat_action": 4000}
+history_token_budgets: dict[str, int] = json.loads(os.getenv("HISTORY_TOKEN_BUDGETS", "{}"))
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model(token_encoding_model)
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text or "", disallowed_special=()))
+
+
+def get_history_token_budget(scenario: str) -> int:
+    return history_token_budgets.get(scenario, default_history_token_budget)
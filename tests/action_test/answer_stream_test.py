@@ -0,0 +1,85 @@
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+from gluon_meson_sdk.models.chat_model import ChatModel
+
+from action.stream import AnswerStream, achat_with_stream
+from dialog_manager.deadline import Deadline, deadline_scope
+from metrics import errors_total
+
+
+class StreamingChatModel:
+    def __init__(self, deltas):
+        self.deltas = deltas
+
+    async def astream(self, **kwargs):
+        for delta in self.deltas:
+            yield delta
+
+
+async def test_answer_stream_should_yield_deltas_until_closed():
+    answer_stream = AnswerStream()
+    await answer_stream.put("Hello")
+    await answer_stream.put("")
+    await answer_stream.put(" world")
+    answer_stream.close()
+
+    assert [delta async for delta in answer_stream] == ["Hello", " world"]
+    assert answer_stream.has_delta
+
+
+async def test_achat_with_stream_should_forward_deltas_and_return_full_answer():
+    answer_stream = AnswerStream()
+
+    result = await achat_with_stream(StreamingChatModel(["TB ", "Guru"]), answer_stream, max_length=16)
+    answer_stream.close()
+
+    assert result == "TB Guru"
+    assert [delta async for delta in answer_stream] == ["TB ", "Guru"]
+
+
+async def test_achat_with_stream_should_fall_back_to_achat_without_stream():
+    chat_model = MagicMock(spec=["achat"])
+    chat_model.achat = AsyncMock(return_value=MagicMock(response="full answer"))
+
+    result = await achat_with_stream(chat_model, None, max_length=16)
+
+    assert result == "full answer"
+    chat_model.achat.assert_awaited_once_with(max_length=16)
+
+
+async def test_achat_with_stream_should_count_fallback_of_streamed_turn():
+    chat_model = MagicMock(spec=["achat"])
+    chat_model.achat = AsyncMock(return_value=MagicMock(response="full answer"))
+    fallbacks_before = errors_total.get(kind="stream", name="fallback_to_achat")
+
+    result = await achat_with_stream(chat_model, AnswerStream(), max_length=16)
+
+    assert result == "full answer"
+    assert errors_total.get(kind="stream", name="fallback_to_achat") == fallbacks_before + 1
+
+
+async def test_achat_with_stream_should_close_stream_when_deadline_expires():
+    closed = False
+
+    class SlowChatModel:
+        async def astream(self, **kwargs):
+            nonlocal closed
+            try:
+                yield "TB "
+                time.sleep(0.06)
+                yield "Guru"
+                yield " never streamed"
+            finally:
+                closed = True
+
+    with deadline_scope(Deadline(0.05)):
+        result = await achat_with_stream(SlowChatModel(), AnswerStream())
+
+    assert result == "TB Guru ..."
+    assert closed
+
+
+def test_chat_model_of_sdk_should_stream():
+    # without astream every streamed turn silently falls back to a single achat call
+    assert callable(getattr(ChatModel, "astream", None))
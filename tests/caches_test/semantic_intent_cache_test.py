@@ -0,0 +1,46 @@
+from caches.semantic_intent_cache import SemanticIntentCache
+
+VOCABULARY = ["price", "rate", "hello", "check", "please"]
+
+
+class KeywordEmbedding:
+    def __init__(self):
+        self.embedded = []
+
+    def __call__(self, text):
+        self.embedded.append(text)
+        return [float(word in text) for word in VOCABULARY]
+
+
+def test_should_find_same_or_similar_utterance_in_same_scope():
+    embed = KeywordEmbedding()
+    cache = SemanticIntentCache(embed, "v1", max_distance=0.2)
+    cache.add_cache("Check the price rate please", '{"intent": "pricing"}', scope="layer:")
+
+    assert cache.search("check the  price rate please", scope="layer:") == '{"intent": "pricing"}'
+    assert cache.search("please check price rate", scope="layer:") == '{"intent": "pricing"}'
+    assert cache.search("check the price rate please", scope="layer:pricing") is None
+    assert cache.search("hello", scope="layer:") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_should_embed_utterance_once_when_adding_after_miss():
+    embed = KeywordEmbedding()
+    cache = SemanticIntentCache(embed, "v1")
+    cache.add_cache("hello", '{"intent": "chitchat"}')
+
+    assert cache.search("price please") is None
+    cache.add_cache("price please", '{"intent": "pricing"}')
+
+    assert embed.embedded == ["hello", "price please"]
+
+
+def test_should_overwrite_oldest_entry_when_full():
+    cache = SemanticIntentCache(KeywordEmbedding(), "v1", max_entries=2)
+    for content in ["hello", "price", "rate"]:
+        cache.add_cache(content, content)
+
+    assert cache.search("hello", exact_match=True) is None
+    assert cache.search("rate", exact_match=True) == "rate"
+    assert cache.stats()["entries"] == 2
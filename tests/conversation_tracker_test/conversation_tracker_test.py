@@ -1,10 +1,11 @@
+import tempfile
 import unittest
 from datetime import datetime, timedelta
-from tracker.base import BaseConversationTracker
+from tracker.base import BaseConversationTracker, estimate_conversation_size
 from tracker.context import ConversationContext
 
-class TestConversation(unittest.TestCase):
 
+class TestConversation(unittest.TestCase):
     def test_save_conversation(self):
         tracker = BaseConversationTracker()
         session_id = "123"
@@ -38,5 +39,46 @@ class TestConversation(unittest.TestCase):
         tracker.clear_inactive_conversations()
         self.assertNotIn(session_id, tracker.conversation_caches)
 
-if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    def test_spill_least_recently_used_conversation_when_over_budget(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            tracker = BaseConversationTracker(max_cache_bytes=1, spill_dir=spill_dir)
+            tracker.save_conversation("123", ConversationContext("Hello", "123"))
+            tracker.save_conversation("456", ConversationContext("Hi", "456"))
+
+            self.assertNotIn("123", tracker.conversation_caches)
+            self.assertIn("123", tracker.spilled_sessions)
+            self.assertEqual(tracker.memory_stats()["total_bytes"], tracker.conversation_sizes["456"])
+
+            loaded_context = tracker.load_conversation("123")
+            self.assertEqual(loaded_context.current_user_input, "Hello")
+            self.assertIn("123", tracker.conversation_caches)
+            self.assertIn("456", tracker.spilled_sessions)
+
+    def test_estimate_size_grows_with_history(self):
+        context = ConversationContext("Hello", "123")
+        empty_size = estimate_conversation_size(context)
+        context.history.add_history("user", "x" * 1000)
+        self.assertGreater(estimate_conversation_size(context), empty_size + 1000)
+
+    def test_restore_turn_state_of_aborted_turn(self):
+        context = ConversationContext("Hello", "123")
+        context.history.add_history("user", "Hello")
+        context.set_state("slot_filling:country")
+        turn_state = context.save_turn_state()
+
+        context.append_user_history("Hi")
+        context.set_state("")
+        context.entity_store["country"] = "China"
+        context.current_round += 1
+        context.restore_turn_state(turn_state)
+
+        self.assertEqual([entry["content"] for entry in context.history.rounds], ["Hello"])
+        self.assertEqual(context.state, "slot_filling:country")
+        self.assertEqual(context.entity_store, {})
+        self.assertEqual(context.current_round, 0)
+        context.append_user_history("Hi")
+        self.assertEqual(context.history.rounds[-1]["id"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
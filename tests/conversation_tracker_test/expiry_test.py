@@ -0,0 +1,50 @@
+import os
+import time
+
+from tracker.base import BaseConversationTracker
+from tracker.context import ConversationContext
+from tracker.expiry import ExpiryHeap, SessionExpiryWorker
+
+
+def test_should_pop_sessions_in_expiry_order():
+    heap = ExpiryHeap()
+    heap.touch("a", 10)
+    heap.touch("b", 5)
+    heap.touch("c", 20)
+
+    assert heap.pop_expired(12) == ["b", "a"]
+    assert len(heap) == 1
+
+
+def test_should_skip_superseded_expiry_of_touched_session():
+    heap = ExpiryHeap()
+    heap.touch("a", 10)
+    heap.touch("a", 30)
+
+    assert heap.pop_expired(20) == []
+    assert heap.pop_expired(30) == ["a"]
+
+
+async def test_should_expire_inactive_sessions_in_background_worker():
+    tracker = BaseConversationTracker()
+    tracker.save_conversation("123", ConversationContext("Hello", "123"))
+    tracker.save_conversation("456", ConversationContext("Hi", "456"))
+    tracker.expiry_heap.touch("123", time.monotonic() - 1)
+
+    expired_count = await SessionExpiryWorker(tracker.aexpire_conversations).expire_once()
+
+    assert expired_count == 1
+    assert list(tracker.conversation_caches) == ["456"]
+
+
+async def test_should_expire_spilled_sessions_in_background_worker(tmp_path):
+    tracker = BaseConversationTracker(max_cache_bytes=1, spill_dir=str(tmp_path))
+    tracker.save_conversation("123", ConversationContext("Hello", "123"))
+    tracker.save_conversation("456", ConversationContext("Hi", "456"))
+    tracker.expiry_heap.touch("123", time.monotonic() - 1)
+
+    expired_count = await SessionExpiryWorker(tracker.aexpire_conversations).expire_once()
+
+    assert expired_count == 1
+    assert "123" not in tracker.spilled_sessions
+    assert os.listdir(tracker.spilled_sessions.spill_dir) == []
@@ -0,0 +1,43 @@
+import asyncio
+
+from tracker.context import FileFetchCache
+
+
+class CountingFetcher:
+    def __init__(self, result="contents"):
+        self.result = result
+        self.calls = []
+
+    async def __call__(self, url):
+        self.calls.append(url)
+        await asyncio.sleep(0.01)
+        return self.result
+
+
+async def test_should_fetch_each_url_once():
+    cache = FileFetchCache()
+    fetch = CountingFetcher()
+
+    results = await asyncio.gather(
+        cache.get_or_fetch("raw", "http://minio/a.txt", fetch),
+        cache.get_or_fetch("raw", "http://minio/a.txt", fetch),
+    )
+    await cache.get_or_fetch("raw", "http://minio/a.txt", fetch)
+
+    assert results == ["contents", "contents"]
+    assert fetch.calls == ["http://minio/a.txt"]
+
+
+async def test_should_cache_kinds_separately_and_retry_failed_fetch():
+    cache = FileFetchCache()
+    failed_fetch = CountingFetcher(result=None)
+
+    assert await cache.get_or_fetch("raw", "http://minio/a.txt", failed_fetch) is None
+    assert await cache.get_or_fetch("raw", "http://minio/a.txt", failed_fetch) is None
+    assert len(failed_fetch.calls) == 2
+
+    fetch = CountingFetcher()
+    await cache.get_or_fetch("processed", "http://minio/a.txt", fetch)
+    cache.clear()
+    await cache.get_or_fetch("processed", "http://minio/a.txt", fetch)
+    assert len(fetch.calls) == 2
@@ -0,0 +1,58 @@
+import io
+import os
+
+import pytest
+
+from tracker.file_store import ContentAddressedFileStore, UploadQuotaExceededException
+
+
+def test_should_store_same_content_once_and_link_it_per_session(tmp_path):
+    store = ContentAddressedFileStore(str(tmp_path / "blobs"), max_bytes=1024)
+    os.makedirs(tmp_path / "session_1")
+    os.makedirs(tmp_path / "session_2")
+
+    digest_1, size = store.store(io.BytesIO(b"report"), 100, str(tmp_path / "session_1" / "report.txt"))
+    digest_2, _ = store.store(io.BytesIO(b"report"), 100, str(tmp_path / "session_2" / "copy.txt"))
+
+    assert digest_1 == digest_2
+    assert size == 6
+    assert store.total_bytes == 6
+    assert os.listdir(tmp_path / "blobs") == [digest_1]
+    assert (tmp_path / "session_2" / "copy.txt").read_bytes() == b"report"
+
+
+def test_should_delete_content_when_no_session_links_to_it(tmp_path):
+    store = ContentAddressedFileStore(str(tmp_path / "blobs"), max_bytes=1024)
+    digest, _ = store.store(io.BytesIO(b"report"), 100, str(tmp_path / "report.txt"))
+
+    store.release({digest})
+    assert store.total_bytes == 6
+    os.remove(tmp_path / "report.txt")
+    store.release()
+
+    assert store.total_bytes == 0
+    assert os.listdir(tmp_path / "blobs") == []
+
+
+def test_should_reject_files_over_session_or_global_quota(tmp_path):
+    store = ContentAddressedFileStore(str(tmp_path / "blobs"), max_bytes=10)
+
+    with pytest.raises(UploadQuotaExceededException) as session_err:
+        store.store(io.BytesIO(b"x" * 20), 5, str(tmp_path / "large.txt"))
+    digest, _ = store.store(io.BytesIO(b"x" * 8), 100, str(tmp_path / "small.txt"))
+    with pytest.raises(UploadQuotaExceededException) as global_err:
+        store.store(io.BytesIO(b"y" * 8), 100, str(tmp_path / "other.txt"))
+
+    assert session_err.value.scope == "session"
+    assert global_err.value.scope == "global"
+    assert os.listdir(tmp_path / "blobs") == [digest]
+    assert not os.path.exists(tmp_path / "other.txt")
+
+
+def test_should_keep_content_linked_by_a_session_when_the_store_is_swept(tmp_path):
+    store = ContentAddressedFileStore(str(tmp_path / "blobs"), max_bytes=1024)
+    digest, _ = store.store(io.BytesIO(b"report"), 100, str(tmp_path / "report.txt"))
+
+    store.release()
+
+    assert os.listdir(tmp_path / "blobs") == [digest]
@@ -0,0 +1,33 @@
+from tracker.context import History
+
+
+def test_should_extend_cached_views_when_round_is_added():
+    history = History([], max_history=3)
+    assert history.format_string() == ""
+    assert history.format_messages() == []
+
+    history.add_history("user", "hello")
+    history.add_history("assistant", "hi")
+
+    assert history.format_string({"user": "human"}) == "### human:\n hello\n### assistant:\n hi"
+    assert history.format_string() == "### user:\n hello\n### assistant:\n hi"
+    assert history.format_messages() == [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}]
+    assert history.version == 2
+
+
+def test_should_rebuild_views_when_oldest_round_is_dropped():
+    history = History([], max_history=2)
+    history.add_history("user", "hello")
+    history.add_history("assistant", "hi")
+    history.format_string_with_file_name()
+
+    history.add_history("user", "bye", "a.docx")
+
+    assert history.format_string_with_file_name() == "assistant: hi \nuser: bye (with file name :a.docx)"
+
+
+def test_should_not_change_cached_messages_when_caller_changes_them():
+    history = History([{"role": "user", "content": "hello", "file_name": None}])
+    history.format_messages()[0]["content"] = "changed"
+
+    assert history.format_messages() == [{"role": "user", "content": "hello"}]
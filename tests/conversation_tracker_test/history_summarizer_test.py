@@ -0,0 +1,82 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+from tracker.HistorySummarizer import HistorySummarizer, summarize_history_count
+from tracker.context import ConversationContext
+
+
+def create_conversation(round_count: int, start: int = 0) -> ConversationContext:
+    conversation = ConversationContext(current_user_input="", session_id="session")
+    add_rounds(conversation, round_count, start)
+    return conversation
+
+
+def add_rounds(conversation: ConversationContext, round_count: int, start: int = 0):
+    for index in range(start, start + round_count):
+        conversation.history.add_history("user" if index % 2 == 0 else "assistant", f"message {index}")
+
+
+async def wait_for_summaries(summarizer: HistorySummarizer):
+    while summarizer.running:
+        await asyncio.sleep(0)
+
+
+def save_into(conversation: ConversationContext):
+    async def save_summary(session_id, summary, summarized_through_round_id):
+        conversation.apply_history_summary(summary, summarized_through_round_id)
+
+    return save_summary
+
+
+async def test_should_summarize_in_background_and_save_summary_into_session():
+    summarizer = HistorySummarizer()
+    summarizer.summarize = AsyncMock(return_value="summary 1")
+    conversation = create_conversation(summarize_history_count)
+    stored = ConversationContext(current_user_input="", session_id="session")
+    add_rounds(stored, summarize_history_count)
+
+    summarizer.summarize_in_background(conversation, save_into(stored))
+    await wait_for_summaries(summarizer)
+
+    assert conversation.summarized_history_context is None
+    assert stored.summarized_history_context == "summary 1"
+    assert stored.summarized_through_round_id == summarize_history_count - 1
+    assert stored.get_unsummarized_history() == []
+
+
+async def test_should_coalesce_turns_into_one_pass_and_merge_only_new_rounds():
+    summarizer = HistorySummarizer()
+    release = asyncio.Event()
+    summarized = []
+
+    async def summarize(history, session_id):
+        summarized.append(history)
+        await release.wait()
+        return f"summary {len(summarized)}"
+
+    summarizer.summarize = summarize
+    conversation = create_conversation(summarize_history_count)
+    summarizer.summarize_in_background(conversation, save_into(conversation))
+    await asyncio.sleep(0)
+    for turn in range(3):
+        add_rounds(conversation, summarize_history_count, start=(turn + 1) * summarize_history_count)
+        summarizer.summarize_in_background(conversation, save_into(conversation))
+    release.set()
+    await wait_for_summaries(summarizer)
+
+    assert len(summarized) == 2
+    assert summarized[1][0] == {"role": "system", "content": "summary 1"}
+    assert "message 0" not in [entry["content"] for entry in summarized[1]]
+    assert conversation.summarized_history_context == "summary 2"
+    assert conversation.get_unsummarized_history() == []
+
+
+def test_should_keep_new_round_repeating_the_text_of_a_summarized_round():
+    conversation = ConversationContext(current_user_input="", session_id="session")
+    conversation.history.add_history("user", "yes")
+    conversation.apply_history_summary("the user agreed", conversation.history.rounds[-1]["id"])
+
+    conversation.history.add_history("user", "yes")
+
+    assert [entry["content"] for entry in conversation.get_unsummarized_history()] == ["yes"]
+    assert not conversation.apply_history_summary("outdated", 0)
@@ -0,0 +1,41 @@
+from tracker.context import History
+
+
+def create_history(round_count: int) -> History:
+    history = History([])
+    for index in range(round_count):
+        history.add_history("user" if index % 2 == 0 else "assistant", f"message {index} " * 20)
+    return history
+
+
+def test_should_keep_newest_rounds_within_token_budget():
+    history = create_history(5)
+    round_tokens = history.get_round_token_count(-1)
+
+    window = history.window(round_tokens * 2)
+
+    assert [entry["content"] for entry in window.rounds] == [history.rounds[3]["content"], history.rounds[4]["content"]]
+
+
+def test_should_keep_latest_round_even_if_it_exceeds_budget():
+    history = create_history(3)
+
+    assert list(history.window(1).rounds) == [history.rounds[-1]]
+
+
+def test_should_return_whole_history_when_it_fits_budget():
+    history = create_history(3)
+
+    assert history.window(100000) is history
+
+
+def test_should_put_summary_in_place_of_dropped_rounds():
+    history = create_history(5)
+    round_tokens = history.get_round_token_count(-1)
+
+    window = history.window(round_tokens * 3, summary="user asked about pricing")
+
+    assert window.rounds[0]["role"] == "system"
+    assert "user asked about pricing" in window.rounds[0]["content"]
+    assert window.rounds[-1] == history.rounds[-1]
+    assert len(window.rounds) < len(history.rounds)
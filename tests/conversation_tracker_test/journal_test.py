@@ -0,0 +1,107 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+from tracker.base import JournaledConversationTracker
+from tracker.context import ConversationContext
+from tracker.journal import SessionJournal, history_delta
+
+
+def save_turn(tracker: JournaledConversationTracker, session_id: str, message: str, state: str = ""):
+    conversation = tracker.load_conversation(session_id)
+    conversation.append_user_history(message)
+    conversation.history.add_history("assistant", f"answer of {message}")
+    conversation.set_state(state)
+    conversation.current_round += 1
+    tracker.save_conversation(session_id, conversation)
+
+
+def restart(journal_dir, snapshot_events: int = 1000) -> JournaledConversationTracker:
+    return JournaledConversationTracker(SessionJournal(str(journal_dir), snapshot_events=snapshot_events))
+
+
+def test_should_only_journal_rounds_changed_since_last_turn():
+    rounds = [{"id": index} for index in range(2, 11)]
+
+    assert history_delta(rounds, journaled_through_id=8) == {
+        "kept_from_id": 2,
+        "kept_through_id": 8,
+        "appended": rounds[-2:],
+    }
+    assert history_delta([{"id": 0}, {"id": 1}, {"id": 5}], journaled_through_id=3)["kept_through_id"] == 1
+
+
+def test_should_rebuild_history_that_was_cut_at_both_ends(tmp_path):
+    tracker = restart(tmp_path)
+    for index in range(3):
+        save_turn(tracker, "session_1", f"message {index}")
+    conversation = tracker.load_conversation("session_1")
+    conversation.history.keep_latest_n_rounds(4)
+    conversation.history.delete_n_round(1)
+    conversation.append_user_history("message 3")
+    tracker.save_conversation("session_1", conversation)
+    tracker.journal.close()
+
+    rebuilt = restart(tmp_path).load_conversation("session_1")
+
+    assert list(rebuilt.history.rounds) == list(conversation.history.rounds)
+    assert rebuilt.history.next_round_id == conversation.history.next_round_id
+
+
+def test_should_rebuild_sessions_after_restart(tmp_path):
+    tracker = restart(tmp_path)
+    for index in range(6):
+        save_turn(tracker, "session_1", f"message {index}", state="slot_filling:amount")
+    save_turn(tracker, "session_2", "hello")
+    tracker.journal.close()
+
+    rebuilt = restart(tmp_path)
+    conversation = rebuilt.load_conversation("session_1")
+
+    assert list(conversation.history.rounds) == list(tracker.conversation_caches["session_1"].history.rounds)
+    assert conversation.state == "slot_filling:amount"
+    assert conversation.current_round == 6
+    assert set(rebuilt.conversation_caches) == {"session_1", "session_2"}
+
+
+def test_should_replay_journal_written_after_snapshot(tmp_path):
+    tracker = restart(tmp_path, snapshot_events=3)
+    for index in range(5):
+        save_turn(tracker, "session_1", f"message {index}")
+    tracker.journal.append_delete(["missing"])
+    tracker.journal.close()
+
+    rebuilt = restart(tmp_path, snapshot_events=3)
+
+    assert os.path.exists(tmp_path / "snapshot.bin")
+    assert rebuilt.load_conversation("session_1").current_round == 5
+    assert rebuilt.load_conversation("session_1").history.rounds[-2]["content"] == "message 4"
+
+
+def test_should_ignore_torn_tail_of_journal(tmp_path):
+    tracker = restart(tmp_path)
+    save_turn(tracker, "session_1", "message 0")
+    save_turn(tracker, "session_1", "message 1")
+    journal_path = tracker.journal.journal_file.name
+    tracker.journal.close()
+    with open(journal_path, "r+b") as f:
+        f.truncate(os.path.getsize(journal_path) - 3)
+
+    conversation = restart(tmp_path).load_conversation("session_1")
+
+    assert isinstance(conversation, ConversationContext)
+    assert conversation.current_round == 1
+
+
+def test_should_keep_expiry_of_rebuilt_sessions(tmp_path):
+    tracker = restart(tmp_path)
+    conversation = tracker.load_conversation("session_1")
+    conversation.updated_at = datetime.now() - timedelta(hours=30)
+    tracker.save_conversation("session_1", conversation)
+    save_turn(tracker, "session_2", "hello")
+    tracker.journal.close()
+
+    rebuilt = restart(tmp_path)
+
+    assert [files.session_id for files in rebuilt.expire_conversations()] == ["session_1"]
+    assert rebuilt.expiry_heap.pop_expired(time.monotonic() + 23 * 3600) == []
@@ -0,0 +1,108 @@
+import json
+import zlib
+from collections import deque
+
+import pytest
+
+from nlu.intent_with_entity import Entity, Intent
+from tracker.base import StoreBackedConversationTracker
+from tracker.context import ConversationContext
+from tracker.session_store import (
+    SQLiteSessionStore,
+    SessionVersionConflictException,
+    deserialize_conversation,
+    serialize_conversation,
+)
+
+
+def test_should_keep_conversation_state_after_serialization():
+    conversation = ConversationContext("Hello", "123")
+    conversation.append_user_history("Hello", "a.docx")
+    conversation.add_entity([Entity(type="country", value="China", confidence=1.0)])
+    conversation.add_file_urls(["http://minio/a.docx"])
+    conversation.set_state("slot_filling:country")
+
+    restored = deserialize_conversation(serialize_conversation(conversation))
+
+    assert restored.session_id == "123"
+    assert restored.history.rounds == conversation.history.rounds
+    assert restored.get_simplified_entities() == {"country": "China"}
+    assert restored.uploaded_file_urls == ["http://minio/a.docx"]
+    assert restored.state == "slot_filling:country"
+    assert restored.file_fetch_cache.fetches == {}
+
+
+def test_should_share_sessions_between_trackers(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    worker_1 = StoreBackedConversationTracker(SQLiteSessionStore(db_path))
+    worker_2 = StoreBackedConversationTracker(SQLiteSessionStore(db_path))
+
+    conversation = worker_1.load_conversation("123")
+    conversation.append_user_history("Hello")
+    worker_1.save_conversation("123", conversation)
+
+    loaded = worker_2.load_conversation("123")
+    assert loaded.history.format_messages() == [{"role": "user", "content": "Hello"}]
+    assert loaded.store_version == 1
+
+
+def test_should_reject_save_of_outdated_session(tmp_path):
+    db_path = str(tmp_path / "sessions.db")
+    worker_1 = StoreBackedConversationTracker(SQLiteSessionStore(db_path))
+    worker_2 = StoreBackedConversationTracker(SQLiteSessionStore(db_path))
+    worker_1.save_conversation("123", worker_1.load_conversation("123"))
+
+    conversation_1 = worker_1.load_conversation("123")
+    conversation_2 = worker_2.load_conversation("123")
+    worker_1.save_conversation("123", conversation_1)
+
+    with pytest.raises(SessionVersionConflictException):
+        worker_2.save_conversation("123", conversation_2)
+
+
+def test_should_delete_inactive_sessions(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    store.save("123", b"data", 0)
+
+    assert store.delete_inactive(3600) == []
+    assert store.delete_inactive(-1) == [("123", b"data")]
+    assert store.load("123") is None
+
+
+async def test_should_save_and_load_sessions_off_the_event_loop(tmp_path):
+    tracker = StoreBackedConversationTracker(SQLiteSessionStore(str(tmp_path / "sessions.db")))
+
+    conversation = await tracker.aload_conversation("123")
+    conversation.append_user_history("Hello")
+    await tracker.asave_conversation("123", conversation)
+
+    loaded = await tracker.aload_conversation("123")
+    assert loaded.history.rounds == conversation.history.rounds
+    assert loaded.store_version == conversation.store_version == 1
+
+
+def test_should_serialize_sessions_as_json_fields_instead_of_pickle():
+    conversation = ConversationContext("Hello", "123")
+    conversation.update_intent(Intent(name="rma_check", full_name_of_parent_intent="pricing"))
+    conversation.files.filenames = ["a.docx"]
+    conversation.files.file_digests = {"a.docx": ("abc", 10)}
+    data = serialize_conversation(conversation)
+
+    assert json.loads(zlib.decompress(data[1:]))["current_intent"]["name"] == "rma_check"
+    restored = deserialize_conversation(data)
+    assert restored.current_intent == conversation.current_intent
+    assert list(restored.intent_queue) == [conversation.current_intent]
+    assert restored.files.file_digests == {"a.docx": ("abc", 10)}
+    assert restored.created_at == conversation.created_at
+
+
+def test_should_start_session_again_when_stored_format_is_unreadable(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    store.save("123", bytes([1]) + b"pickled", 0)
+    tracker = StoreBackedConversationTracker(store)
+
+    conversation = tracker.load_conversation("123")
+    tracker.save_conversation("123", conversation)
+
+    assert conversation.history.rounds == deque()
+    assert tracker.load_conversation("123").store_version == 2
@@ -0,0 +1,58 @@
+import asyncio
+import os
+
+from tracker.base import BaseConversationTracker
+from tracker.context import ConversationContext
+from tracker.session_store import SessionSpillDirectory
+
+
+async def test_should_spill_and_load_back_sessions_from_the_event_loop(tmp_path):
+    tracker = BaseConversationTracker(max_cache_bytes=1, spill_dir=str(tmp_path))
+    await tracker.asave_conversation("123", ConversationContext("Hello", "123"))
+    await tracker.asave_conversation("456", ConversationContext("Hi", "456"))
+
+    assert "123" in tracker.spilled_sessions
+    assert tracker.spilling == {}
+
+    loaded = await tracker.aload_conversation("123")
+
+    assert loaded.current_user_input == "Hello"
+    assert "456" in tracker.spilled_sessions
+    assert os.listdir(tracker.spilled_sessions.spill_dir) == [os.path.basename(tracker.spilled_sessions.paths["456"])]
+
+
+async def test_should_return_session_loaded_while_its_spill_file_is_written(tmp_path):
+    tracker = BaseConversationTracker(max_cache_bytes=1, spill_dir=str(tmp_path))
+    first = ConversationContext("Hello", "123")
+    await tracker.asave_conversation("123", first)
+    saving = asyncio.create_task(tracker.asave_conversation("456", ConversationContext("Hi", "456")))
+    await asyncio.sleep(0)
+
+    assert "123" in tracker.spilling
+    assert await tracker.aload_conversation("123") is first
+
+    await saving
+    assert "123" not in tracker.spilled_sessions
+    assert "123" in tracker.conversation_caches
+    assert len(os.listdir(tracker.spilled_sessions.spill_dir)) == len(tracker.spilled_sessions)
+
+
+async def test_should_not_spill_session_of_running_turn(tmp_path):
+    tracker = BaseConversationTracker(max_cache_bytes=1, spill_dir=str(tmp_path))
+    await tracker.asave_conversation("123", ConversationContext("Hello", "123"))
+    await tracker.aload_conversation("123")
+    await tracker.asave_conversation("456", ConversationContext("Hi", "456"))
+
+    assert "123" in tracker.conversation_caches
+    assert "456" in tracker.conversation_caches
+
+
+def test_should_remove_sessions_spilled_by_previous_processes(tmp_path):
+    left_over = tmp_path / str(os.getpid())
+    left_over.mkdir()
+    (left_over / "123.1.session").write_bytes(b"data")
+
+    spilled_sessions = SessionSpillDirectory(str(tmp_path))
+
+    assert not left_over.exists()
+    assert len(spilled_sessions) == 0
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from dialog_manager.admission_control import AdmissionController, AdmissionRejectedException
+
+
+async def test_should_queue_turns_beyond_max_in_flight():
+    controller = AdmissionController(max_in_flight=1, max_queue_depth=1, max_queue_wait=1)
+    await controller.acquire()
+
+    queued = asyncio.ensure_future(controller.acquire())
+    await asyncio.sleep(0)
+    assert controller.stats()["queue_depth"] == 1
+
+    controller.release()
+    await queued
+    assert controller.stats()["in_flight"] == 1
+    assert controller.stats()["admitted"] == 2
+
+
+async def test_should_reject_turn_when_queue_is_full():
+    controller = AdmissionController(max_in_flight=1, max_queue_depth=0, max_queue_wait=1)
+    await controller.acquire()
+
+    with pytest.raises(AdmissionRejectedException):
+        await controller.acquire()
+    assert controller.stats()["rejected_queue_full"] == 1
+
+
+async def test_should_reject_turn_when_queue_wait_expires():
+    controller = AdmissionController(max_in_flight=1, max_queue_depth=1, max_queue_wait=0.01)
+
+    async with controller.admit():
+        with pytest.raises(AdmissionRejectedException):
+            await controller.acquire()
+
+    stats = controller.stats()
+    assert stats["rejected_wait_timeout"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from dialog_manager.deadline import Deadline, DeadlineExceededException, deadline_scope, run_within_deadline
+
+
+async def test_should_cancel_call_when_deadline_expires():
+    cancelled = asyncio.Event()
+
+    async def slow_call():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with deadline_scope(Deadline(0.01)):
+        with pytest.raises(DeadlineExceededException):
+            await run_within_deadline(slow_call(), "slow call")
+
+    assert cancelled.is_set()
+
+
+async def test_should_not_start_call_when_deadline_already_expired():
+    started = False
+
+    async def call():
+        nonlocal started
+        started = True
+
+    with deadline_scope(Deadline(0)):
+        with pytest.raises(DeadlineExceededException):
+            await run_within_deadline(call(), "call")
+
+    assert not started
+
+
+async def test_should_pass_deadline_to_tasks_created_in_scope():
+    async def call():
+        return await run_within_deadline(asyncio.sleep(1), "call")
+
+    with deadline_scope(Deadline(0.01)):
+        task = asyncio.ensure_future(call())
+
+    with pytest.raises(DeadlineExceededException):
+        await task
+
+
+async def test_should_run_without_timeout_when_no_deadline():
+    assert await run_within_deadline(asyncio.sleep(0, result="done"), "call") == "done"
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from dialog_manager.session_turn import SessionTurnScheduler, StaleTurnCancelledException
+
+
+def recording_turn(events: list, name: str, delay: float = 0.01):
+    async def turn():
+        events.append(f"{name} start")
+        await asyncio.sleep(delay)
+        events.append(f"{name} end")
+        return name
+
+    return turn
+
+
+async def test_turns_of_same_session_should_run_one_after_another():
+    scheduler = SessionTurnScheduler()
+    events = []
+
+    results = await asyncio.gather(
+        scheduler.run("session", recording_turn(events, "first")),
+        scheduler.run("session", recording_turn(events, "second")),
+    )
+
+    assert results == ["first", "second"]
+    assert events == ["first start", "first end", "second start", "second end"]
+    assert scheduler.in_flight_session_count() == 0
+
+
+async def test_turns_of_different_sessions_should_run_concurrently():
+    scheduler = SessionTurnScheduler()
+    events = []
+
+    await asyncio.gather(
+        scheduler.run("session_a", recording_turn(events, "a")),
+        scheduler.run("session_b", recording_turn(events, "b")),
+    )
+
+    assert events[:2] == ["a start", "b start"]
+
+
+async def test_newer_turn_should_cancel_stale_turns_when_enabled():
+    scheduler = SessionTurnScheduler(cancel_stale_turn=True)
+    events = []
+
+    first = asyncio.ensure_future(scheduler.run("session", recording_turn(events, "first", delay=1)))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(scheduler.run("session", recording_turn(events, "second")))
+    third = asyncio.ensure_future(scheduler.run("session", recording_turn(events, "third")))
+
+    assert await third == "third"
+    with pytest.raises(StaleTurnCancelledException):
+        await first
+    with pytest.raises(StaleTurnCancelledException):
+        await second
+    assert events == ["first start", "third start", "third end"]
+    assert scheduler.in_flight_session_count() == 0
+
+
+async def test_work_between_turns_should_wait_for_running_turn_without_cancelling_it():
+    scheduler = SessionTurnScheduler(cancel_stale_turn=True)
+    events = []
+
+    results = await asyncio.gather(
+        scheduler.run("session", recording_turn(events, "turn")),
+        scheduler.run_between_turns("session", recording_turn(events, "summary")),
+    )
+
+    assert results == ["turn", "summary"]
+    assert events == ["turn start", "turn end", "summary start", "summary end"]
+    assert scheduler.in_flight_session_count() == 0
@@ -0,0 +1,31 @@
+import pytest
+
+from dialog_manager.startup import StartupTracker
+
+
+async def test_should_record_component_init_time_and_readiness():
+    startup_tracker = StartupTracker()
+
+    result = await startup_tracker.init_component("component", lambda value: value * 2, 21)
+    assert result == 42
+    assert startup_tracker.status()["status"] == "starting"
+
+    startup_tracker.mark_ready()
+    status = startup_tracker.status()
+    assert status["status"] == "ready"
+    assert "component" in status["components"]
+    assert status["total_seconds"] is not None
+
+
+async def test_should_report_failed_component():
+    startup_tracker = StartupTracker()
+
+    def broken_component():
+        raise ValueError("cannot connect")
+
+    with pytest.raises(ValueError):
+        await startup_tracker.init_component("broken", broken_component)
+
+    status = startup_tracker.status()
+    assert status["status"] == "failed"
+    assert status["failed_components"] == {"broken": "cannot connect"}
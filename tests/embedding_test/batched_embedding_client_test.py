@@ -0,0 +1,95 @@
+import asyncio
+
+from models.embedding_model.batched import BatchedEmbeddingClient, EmbeddingVectorStore
+
+
+class FakeEmbeddingClient(BatchedEmbeddingClient):
+    def __init__(self, **kwargs):
+        super().__init__("http://embedding", **kwargs)
+        self.requested_batches = []
+
+    async def request(self, texts):
+        self.requested_batches.append(texts)
+        await asyncio.sleep(0)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+async def test_should_encode_concurrent_texts_in_one_request():
+    client = FakeEmbeddingClient(batch_wait_seconds=0.05)
+
+    vectors = await client.encode_many(["hi", "hello", "hi  ", "hello"])
+
+    assert vectors == [[2.0, 1.0], [5.0, 1.0], [2.0, 1.0], [5.0, 1.0]]
+    assert client.requested_batches == [["hi", "hello"]]
+    await client.shutdown()
+
+
+async def test_should_serve_repeated_texts_from_cache(tmp_path):
+    client = FakeEmbeddingClient(lru_size=1, store_dir=str(tmp_path))
+    await client.encode("system prompt")
+    await client.encode("user input")
+    while client.requests:
+        await asyncio.sleep(0)
+
+    assert await client.encode("system prompt") == [13.0, 1.0]
+    assert len(client.requested_batches) == 2
+    assert len(EmbeddingVectorStore(str(tmp_path))) == 2
+    await client.shutdown()
+
+
+async def test_should_batch_texts_into_blocking_embed_documents():
+    calls = []
+
+    def embed_documents(texts):
+        calls.append(texts)
+        return [[float(len(text))] for text in texts]
+
+    client = BatchedEmbeddingClient(embed_documents=embed_documents, batch_wait_seconds=0.05, store_dir=None)
+
+    assert await client.encode_many(["hi", "hello"]) == [[2.0], [5.0]]
+    assert calls == [["hi", "hello"]]
+    await client.shutdown()
+
+
+def test_should_cut_off_torn_rows_when_opened_again(tmp_path):
+    store = EmbeddingVectorStore(str(tmp_path))
+    store.add_many([("a", [1.0, 2.0]), ("b", [3.0, 4.0])])
+    with open(store.vectors_path, "ab") as f:
+        f.write(b"\x00" * 6)
+    with open(store.keys_path, "a") as f:
+        f.write("c\nd")
+
+    reopened = EmbeddingVectorStore(str(tmp_path))
+    reopened.add_many([("e", [5.0, 6.0])])
+
+    assert len(reopened) == 3
+    assert reopened.get("b") == [3.0, 4.0]
+    assert reopened.get("e") == [5.0, 6.0]
+    assert EmbeddingVectorStore(str(tmp_path)).get("e") == [5.0, 6.0]
+
+
+async def test_should_cancel_texts_waiting_for_request_in_flight_on_shutdown():
+    requested = asyncio.Event()
+
+    class HangingEmbeddingClient(BatchedEmbeddingClient):
+        async def request(self, texts):
+            requested.set()
+            await asyncio.Event().wait()
+
+    client = HangingEmbeddingClient("http://embedding", batch_wait_seconds=0, store_dir=None)
+    encoding = asyncio.create_task(client.encode("hi"))
+    await requested.wait()
+
+    await client.shutdown()
+
+    assert client.requests == set()
+    assert client.encoding == {}
+    assert isinstance((await asyncio.gather(encoding, return_exceptions=True))[0], asyncio.CancelledError)
+
+
+def test_should_read_stored_vector_while_another_thread_appends(tmp_path):
+    store = EmbeddingVectorStore(str(tmp_path))
+    store.add_many([("a", [1.0, 2.0])])
+
+    with store.write_lock:
+        assert store.get("a") == [1.0, 2.0]
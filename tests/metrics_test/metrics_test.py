@@ -0,0 +1,57 @@
+import pytest
+
+from metrics import MetricsRegistry, _observe, errors_total, llm_call_seconds
+from models.chat_model.instrumented import InstrumentedChatModel
+
+
+def test_should_render_histogram_and_counter_in_prometheus_text_format():
+    registry = MetricsRegistry()
+    latency = registry.histogram("stage_seconds", "Stage latency.", ["stage"])
+    errors = registry.counter("errors_total", "Errors.", ["kind", "name"])
+
+    latency.observe(0.2, stage="action")
+    latency.observe(3, stage="action")
+    errors.inc(kind="llm", name="intent_call")
+
+    text = registry.render()
+
+    assert "# TYPE stage_seconds histogram" in text
+    assert 'stage_seconds_bucket{stage="action",le="0.25"} 1' in text
+    assert 'stage_seconds_bucket{stage="action",le="+Inf"} 2' in text
+    assert 'stage_seconds_count{stage="action"} 2' in text
+    assert 'stage_seconds_sum{stage="action"} 3.2' in text
+    assert 'errors_total{kind="llm",name="intent_call"} 1.0' in text
+
+
+def test_should_observe_latency_and_count_error_when_stage_fails():
+    registry = MetricsRegistry()
+    latency = registry.histogram("stage_seconds", "Stage latency.", ["stage"])
+    errors_before = errors_total.get(kind="stage", name="action")
+
+    with pytest.raises(ValueError):
+        with _observe(latency, "stage", "action", stage="action"):
+            raise ValueError("failed")
+
+    assert latency.get_count(stage="action") == 1
+    assert errors_total.get(kind="stage", name="action") == errors_before + 1
+
+
+async def test_should_time_the_whole_stream_of_instrumented_chat_model():
+    class StreamingChatModel:
+        async def astream(self, **kwargs):
+            yield "a"
+            raise ValueError("stream broken")
+
+    chat_model = InstrumentedChatModel(StreamingChatModel(), "answer")
+    count_before = llm_call_seconds.get_count(scenario="answer", sub_scenario="")
+    errors_before = errors_total.get(kind="llm", name="answer")
+
+    deltas = []
+    with pytest.raises(ValueError):
+        async for delta in chat_model.astream(messages=[]):
+            deltas.append(delta)
+
+    assert deltas == ["a"]
+    assert llm_call_seconds.get_count(scenario="answer", sub_scenario="") == count_before + 1
+    assert errors_total.get(kind="llm", name="answer") == errors_before + 1
+    assert not hasattr(InstrumentedChatModel(object(), "answer"), "astream")
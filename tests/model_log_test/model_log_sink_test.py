@@ -0,0 +1,80 @@
+import sqlite3
+from contextlib import asynccontextmanager
+
+from model_log_sink import BatchedModelLogSink, PGModelLogWriter, SQLiteModelLogWriter
+
+
+def count_logs(db_path) -> int:
+    with sqlite3.connect(db_path) as con:
+        return con.execute("select count(*) from model_log").fetchone()[0]
+
+
+async def log_turn(sink: BatchedModelLogSink, session_id: str) -> bool:
+    return await sink.log(session_id, "overall", "no_model", [{"role": "user", "content": "hi"}], "hello", {}, "")
+
+
+async def test_should_write_logs_in_batches_and_flush_on_shutdown(tmp_path):
+    db_path = tmp_path / "model_log.db"
+    sink = BatchedModelLogSink(SQLiteModelLogWriter(str(db_path)), batch_size=2, flush_interval=60)
+    sink.start()
+
+    for index in range(5):
+        assert await log_turn(sink, f"session_{index}")
+    await sink.shutdown()
+
+    assert count_logs(db_path) == 5
+    assert sink.stats()["written"] == 5
+
+
+async def test_should_drop_logs_when_queue_is_full(tmp_path):
+    sink = BatchedModelLogSink(SQLiteModelLogWriter(str(tmp_path / "model_log.db")), max_queue_size=1)
+    sink.start()
+
+    assert await log_turn(sink, "first")
+    assert not await log_turn(sink, "second")
+    assert sink.stats()["dropped"] == 1
+    await sink.shutdown()
+
+
+async def test_should_drop_logs_when_sink_is_not_started(tmp_path):
+    sink = BatchedModelLogSink(SQLiteModelLogWriter(str(tmp_path / "model_log.db")))
+
+    assert not await log_turn(sink, "session")
+
+
+class FakePool:
+    def __init__(self):
+        self.closed = True
+        self.executed = []
+
+    async def open(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+    @asynccontextmanager
+    async def connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self):
+        yield self
+
+    async def executemany(self, query, rows):
+        self.executed.append((query, rows))
+
+
+async def test_should_insert_each_batch_with_one_executemany_on_pg():
+    writer = PGModelLogWriter("", table="logs.model_log")
+    writer.pool = FakePool()
+    sink = BatchedModelLogSink(writer, batch_size=3, flush_interval=60)
+    sink.start()
+
+    for index in range(5):
+        assert await log_turn(sink, f"session_{index}")
+    await sink.shutdown()
+
+    assert [len(rows) for _, rows in writer.pool.executed] == [3, 2]
+    assert writer.pool.executed[0][1][0][:3] == ("session_0", "overall", "no_model")
+    assert writer.pool.closed
@@ -1,9 +1,57 @@
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 
-from nlu.llm.intent import get_intent_examples
+from nlu.intent_config import IntentConfig, IntentListConfig
+from nlu.llm.intent import LLMIntentClassifier, get_intent_examples, is_same_request
+from nlu.llm.intent_call import IntentClassificationResponse
 from unified_search_client.unified_search_client import UnifiedSearchClient
 
 
+def intent_config(name, full_name_of_parent_intent=None, has_children=False):
+    return IntentConfig(
+        name=name,
+        description=f"{name}_description",
+        action=name,
+        slots=[],
+        business=False,
+        full_name_of_parent_intent=full_name_of_parent_intent,
+        disabled=False,
+        has_children=has_children,
+    )
+
+
+def create_classifier(mocker, layer_answers=(), leaf_answers=()):
+    """a classifier over a small intent tree, the llm answers the given intent names in order"""
+    mocker.patch("nlu.llm.intent.get_intent_examples", AsyncMock(return_value=[]))
+    classifier = LLMIntentClassifier.__new__(LLMIntentClassifier)
+    classifier.intent_list_config = IntentListConfig(
+        [
+            intent_config("pricing", has_children=True),
+            intent_config("standard", "pricing"),
+            intent_config("rma", "pricing", has_children=True),
+            intent_config("rma_check", "pricing.rma"),
+            intent_config("unknown"),
+        ]
+    )
+    classifier.intent_example_index = None
+    classifier.intent_result_cache = None
+    classifier.lexical_intent_router = None
+    classifier.embedding_client = None
+    classifier.intent_call = MagicMock()
+    classifier.intent_call.classify_intent = AsyncMock(
+        side_effect=[IntentClassificationResponse(intent=name, confidence=0.9) for name in layer_answers]
+    )
+    classifier.intent_call.classify_leaf_intent = AsyncMock(
+        side_effect=[IntentClassificationResponse(intent=name, confidence=0.9) for name in leaf_answers]
+    )
+    return classifier
+
+
+def create_conversation():
+    conversation = MagicMock(current_user_input="check my rma", session_id="123")
+    conversation.get_history.return_value.rounds = [{}]
+    return conversation
+
+
 class TestIntents:
     async def test_get_intent_examples_should_generate_the_list_of_examples(self, mocker):
         mocker.patch.object(UnifiedSearchClient, "send_request")
@@ -22,3 +70,68 @@ class TestIntents:
             "score": 109.81185150146484
         }]
         assert result == expected_result
+
+    def test_is_same_request_ignores_case_spaces_and_punctuation(self):
+        assert is_same_request("", "what is the price?")
+        assert is_same_request("What is the price", "what is  the price?")
+        assert not is_same_request("what is the price of the laptop", "what about the laptop?")
+
+    async def test_speculative_first_step_is_kept_when_the_request_is_not_rewritten(self, mocker):
+        mocker.patch("nlu.llm.intent.speculative_intent_classification_feature_toggle", True)
+        classifier = LLMIntentClassifier.__new__(LLMIntentClassifier)
+        classifier.same_topic_checker = MagicMock()
+        classifier.same_topic_checker.check_same_topic = AsyncMock(return_value=(True, "What is the price"))
+        first_step = (MagicMock(), None)
+        classifier.classify_first_step = AsyncMock(return_value=first_step)
+        classifier.classify_intent_until_leaf_or_confused = AsyncMock()
+        conversation = MagicMock(current_user_input="what is the price?")
+        conversation.is_confused_with_intents.return_value = False
+        conversation.get_history.return_value.rounds = [{}, {}, {}]
+
+        await classifier.classify_intent(conversation)
+
+        classifier.classify_intent_until_leaf_or_confused.assert_awaited_once_with(
+            conversation, None, "What is the price", first_step=first_step
+        )
+
+    def test_can_classify_leaf_intent_directly_below_the_leaf_threshold(self, mocker):
+        classifier = create_classifier(mocker)
+        pricing = classifier.get_intent_by_full_name("pricing")
+        standard = classifier.get_intent_by_full_name("pricing.standard")
+
+        mocker.patch("nlu.llm.intent.flat_intent_classification_feature_toggle", False)
+        assert not classifier.can_classify_leaf_intent_directly(None)
+        mocker.patch("nlu.llm.intent.flat_intent_classification_feature_toggle", True)
+        assert classifier.can_classify_leaf_intent_directly(None)
+        assert classifier.can_classify_leaf_intent_directly(pricing)
+        assert not classifier.can_classify_leaf_intent_directly(standard)
+        mocker.patch("nlu.llm.intent.flat_intent_classification_max_leaves", 1)
+        assert not classifier.can_classify_leaf_intent_directly(None)
+
+    async def test_walk_layers_when_there_are_more_leaves_than_the_threshold(self, mocker):
+        mocker.patch("nlu.llm.intent.flat_intent_classification_feature_toggle", True)
+        mocker.patch("nlu.llm.intent.flat_intent_classification_max_leaves", 2)
+        classifier = create_classifier(mocker, layer_answers=["pricing", "standard"])
+
+        intent = await classifier.classify_intent_until_leaf_or_confused(create_conversation(), None)
+
+        assert intent.get_full_intent_name() == "pricing.standard"
+        classifier.intent_call.classify_leaf_intent.assert_not_awaited()
+
+    async def test_walk_down_from_a_leaf_answer_with_children(self, mocker):
+        mocker.patch("nlu.llm.intent.flat_intent_classification_feature_toggle", True)
+        classifier = create_classifier(mocker, layer_answers=["rma_check"], leaf_answers=["pricing.rma"])
+
+        intent = await classifier.classify_intent_until_leaf_or_confused(create_conversation(), None)
+
+        assert intent.get_full_intent_name() == "pricing.rma.rma_check"
+        assert classifier.intent_call.classify_intent.await_args.args[3] == "pricing.rma"
+
+    async def test_unknown_leaf_answer_is_no_intent(self, mocker):
+        mocker.patch("nlu.llm.intent.flat_intent_classification_feature_toggle", True)
+        classifier = create_classifier(mocker, leaf_answers=["unknown"])
+
+        intent = await classifier.classify_intent_until_leaf_or_confused(create_conversation(), None)
+
+        assert intent is None
+        classifier.intent_call.classify_intent.assert_not_awaited()
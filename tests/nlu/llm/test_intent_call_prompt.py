@@ -0,0 +1,53 @@
+import json
+from unittest.mock import MagicMock
+
+from nlu.intent_config import IntentConfig, IntentListConfig
+from nlu.llm.intent_call import IntentCall
+from prompt_manager.base import PromptWrapper
+
+
+def intent_config(name, full_name_of_parent_intent=None, has_children=False):
+    return IntentConfig(
+        name=name,
+        description=f"{name}_description",
+        action=name,
+        slots=[],
+        business=False,
+        full_name_of_parent_intent=full_name_of_parent_intent,
+        disabled=False,
+        has_children=has_children,
+    )
+
+
+def intent_call():
+    intent_list_config = IntentListConfig(
+        [intent_config("pricing", has_children=True), intent_config("standard", "pricing"), intent_config("rma")]
+    )
+    return IntentCall(intent_list_config, PromptWrapper("INTENTS {{intent_list}}"))
+
+
+def test_system_prompt_of_layer_is_rendered_once():
+    call = intent_call()
+
+    prompt = call.get_system_prompt()
+
+    intent_list = json.loads(prompt[len("INTENTS ") :])
+    assert intent_list[0] == {"name": "pricing", "description": ["pricing_description", "standard_description"]}
+    assert [intent["name"] for intent in intent_list] == ["pricing", "rma", "positive", "negative"]
+    assert call.get_system_prompt() is prompt
+    assert json.loads(call.get_system_prompt("pricing")[len("INTENTS ") :])[0]["name"] == "standard"
+
+
+def test_leaf_intent_system_prompt_offers_unknown_of_the_layer():
+    intent_list_config = IntentListConfig(
+        [intent_config("pricing", has_children=True), intent_config("standard", "pricing"), intent_config("unknown")]
+    )
+    call = IntentCall(intent_list_config, PromptWrapper("INTENTS {{intent_list}}"))
+    chat_message_preparation = MagicMock()
+
+    call.construct_leaf_intent_system_prompt(chat_message_preparation, intent_list_config.get_leaf_intents())
+
+    prompt = chat_message_preparation.add_message.call_args.args[1]
+    intent_names = [intent["name"] for intent in json.loads(prompt[len("INTENTS ") :])]
+    assert intent_names[0] == "pricing.standard"
+    assert intent_names[-1] == "unknown"
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import yaml
+
+from nlu.llm.intent_example_index import FINGERPRINT_TEXT, IntentExampleIndex
+
+VOCABULARY = ["price", "rate", "hello", "file", "upload"]
+
+
+class KeywordEmbeddingModel:
+    def __init__(self):
+        self.embedded_texts = []
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [float(word in text) for word in VOCABULARY]
+
+    def embed_documents(self, texts):
+        self.embedded_texts.extend(texts)
+        return [[float(word in text) for word in VOCABULARY] for text in texts]
+
+
+def write_scene(folder, name, examples, has_children=False):
+    folder.mkdir(parents=True, exist_ok=True)
+    scene = {"name": name, "description": name, "examples": examples, "has_children": has_children}
+    (folder / f"{name}.yaml").write_text(yaml.safe_dump(scene))
+
+
+def create_scenes(tmp_path):
+    scenes = tmp_path / "scenes"
+    write_scene(scenes, "chitchat", ["hello there"])
+    write_scene(scenes, "pricing", ["price please"], has_children=True)
+    write_scene(scenes / "pricing", "standard_price", ["standard price rate"])
+    write_scene(scenes / "pricing", "file_price", ["upload file price"])
+    return scenes
+
+
+def intent_names(intent_examples):
+    return [json.loads(intent_example["intent"])["intent"] for intent_example in intent_examples]
+
+
+def test_should_return_most_similar_examples_under_parent_intent(tmp_path):
+    index = IntentExampleIndex.from_scenes(str(create_scenes(tmp_path)), KeywordEmbeddingModel(), str(tmp_path))
+
+    assert intent_names(index.search_by_vector(index.embedding_model.embed_query("hello"), size=1)) == ["chitchat"]
+    assert intent_names(index.search_by_vector(index.embedding_model.embed_query("file price"), "pricing", size=3)) == [
+        "pricing.file_price",
+        "pricing.standard_price",
+    ]
+
+
+def test_should_load_cached_embeddings_until_scenes_change(tmp_path):
+    scenes = create_scenes(tmp_path)
+    IntentExampleIndex.from_scenes(str(scenes), KeywordEmbeddingModel(), str(tmp_path / "cache"))
+    embedding_model = KeywordEmbeddingModel()
+
+    IntentExampleIndex.from_scenes(str(scenes), embedding_model, str(tmp_path / "cache"))
+    assert embedding_model.embedded_texts == []
+
+    write_scene(scenes, "chitchat", ["hello there", "hello again"])
+    index = IntentExampleIndex.from_scenes(str(scenes), embedding_model, str(tmp_path / "cache"))
+    assert len(embedding_model.embedded_texts) == 5
+    assert len(index.intent_examples) == 5
+
+
+def test_should_embed_examples_again_for_another_model_of_the_same_class(tmp_path):
+    scenes = create_scenes(tmp_path)
+    IntentExampleIndex.from_scenes(str(scenes), KeywordEmbeddingModel(), str(tmp_path / "cache"))
+    embedding_model = KeywordEmbeddingModel()
+    embedding_model.embed_query = lambda text: [1.0] * len(VOCABULARY)
+
+    IntentExampleIndex.from_scenes(str(scenes), embedding_model, str(tmp_path / "cache"))
+
+    assert len(embedding_model.embedded_texts) == 4
+    assert [path.suffix for path in (tmp_path / "cache").iterdir()] == [".npz", ".npz"]
+
+
+async def test_should_embed_user_input_once_for_all_layers(tmp_path):
+    index = IntentExampleIndex.from_scenes(str(create_scenes(tmp_path)), KeywordEmbeddingModel(), str(tmp_path))
+
+    first_layer, second_layer = await asyncio.gather(index.search("hello"), index.search("hello", "pricing"))
+    await index.search("hello", "pricing")
+
+    assert intent_names(first_layer)[0] == "chitchat"
+    assert "chitchat" not in intent_names(second_layer)
+    # the fixed text is embedded once to tell the embedding model apart
+    assert index.embedding_model.queries == [FINGERPRINT_TEXT, "hello"]
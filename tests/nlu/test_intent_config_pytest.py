@@ -1,6 +1,6 @@
 import pytest
 
-from nlu.intent_config import IntentConfig
+from nlu.intent_config import IntentConfig, IntentListConfig
 
 
 def intent_with_full_name_of_parent_intent(full_name_of_parent_intent):
@@ -36,3 +36,66 @@ def ancestor_intent_config():
 )
 def test_is_ancestor_of(descendant, ancestor, expected):
     assert ancestor.is_ancestor_of(descendant) == expected
+
+
+def intent_config(name, full_name_of_parent_intent=None, has_children=False):
+    return IntentConfig(
+        name=name,
+        description=f"{name}_description",
+        action=name,
+        slots=[],
+        business=False,
+        full_name_of_parent_intent=full_name_of_parent_intent,
+        disabled=False,
+        has_children=has_children,
+    )
+
+
+def intent_tree():
+    return IntentListConfig(
+        [
+            intent_config("pricing", has_children=True),
+            intent_config("standard", "pricing"),
+            intent_config("rma", "pricing", has_children=True),
+            intent_config("rma_check", "pricing.rma"),
+            intent_config("pricing_other"),
+            intent_config("unknown"),
+        ]
+    )
+
+
+def test_get_leaf_intents_under_parent():
+    intent_list_config = intent_tree()
+
+    assert [intent.get_full_intent_name() for intent in intent_list_config.get_leaf_intents("pricing")] == [
+        "pricing.standard",
+        "pricing.rma.rma_check",
+    ]
+    assert "pricing_other" in [intent.name for intent in intent_list_config.get_leaf_intents()]
+    assert "unknown" not in [intent.name for intent in intent_list_config.get_leaf_intents()]
+
+
+def test_get_ancestor_intents_from_root():
+    intent_list_config = intent_tree()
+    leaf = intent_list_config.get_intent_by_full_name("pricing.rma.rma_check")
+
+    assert [intent.name for intent in intent_list_config.get_ancestor_intents(leaf)] == ["pricing", "rma"]
+
+
+def test_lookups_by_layer_and_name():
+    intent_list_config = intent_tree()
+
+    assert intent_list_config.get_intent_name_list_by_their_parent_intent("pricing") == ["standard", "rma"]
+    assert "unknown" not in intent_list_config.get_intent_name_list_by_their_parent_intent()
+    assert "unknown" in [intent.name for intent in intent_list_config.get_intents_by_parent_intent()]
+    assert intent_list_config.get_intent("rma_check").full_name_of_parent_intent == "pricing.rma"
+    assert intent_list_config.get_intent("missing") is None
+
+
+def test_get_children_intents_with_the_prefix_match_of_is_ancestor_of():
+    intent_list_config = intent_tree()
+
+    children = intent_list_config.get_children_intents(intent_list_config.get_intent("pricing"))
+
+    assert [intent.name for intent in children] == ["standard", "rma", "rma_check"]
+    assert intent_list_config.get_children_intents(intent_list_config.get_intent("standard")) == []
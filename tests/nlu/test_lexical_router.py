@@ -0,0 +1,78 @@
+import random
+import time
+
+from nlu.intent_config import IntentConfig, IntentListConfig
+from nlu.llm.intent import LLMIntentClassifier
+from nlu.mlm.lexical_router import FEATURE_DIMENSION, LexicalIntentRouter, char_ngrams
+
+
+def intent_config(name, examples, full_name_of_parent_intent=None):
+    return IntentConfig(
+        name=name,
+        description=f"{name}_description",
+        action=name,
+        slots=[],
+        business=False,
+        full_name_of_parent_intent=full_name_of_parent_intent,
+        disabled=False,
+        examples=examples,
+    )
+
+
+def intent_list_config():
+    return IntentListConfig(
+        [
+            intent_config("pricing", ["what is the price of the server", "how much does the laptop cost"]),
+            intent_config("check", ["check the status of my rma", "where is my rma order"], "after_sales.rma"),
+            intent_config("unknown", ["hello"]),
+        ]
+    )
+
+
+def test_char_ngrams_of_words_and_chinese():
+    assert " a" in char_ngrams("A b")
+    assert "价格" in char_ngrams("价格是多少")
+
+
+def test_predict_full_intent_name_of_similar_utterance():
+    router = LexicalIntentRouter.from_intent_list_config(intent_list_config())
+
+    assert router.intent_names == ["pricing", "after_sales.rma.check"]
+    intent_name, confidence = router.predict("check status of the rma")
+    assert intent_name == "after_sales.rma.check"
+    assert confidence > 0.5
+
+
+def test_not_trained_without_two_intents():
+    config = IntentListConfig([intent_config("pricing", ["what is the price"]), intent_config("unknown", ["hi"])])
+
+    assert LexicalIntentRouter.from_intent_list_config(config) is None
+
+
+def test_get_intent_name_of_layer():
+    assert LLMIntentClassifier.get_intent_name_of_layer("after_sales.rma.check", None) == "after_sales"
+    assert LLMIntentClassifier.get_intent_name_of_layer("after_sales.rma.check", "after_sales") == "rma"
+    assert LLMIntentClassifier.get_intent_name_of_layer("pricing", "after_sales") is None
+
+
+def test_train_hundreds_of_intents_within_bounded_time_and_memory():
+    rng = random.Random(0)
+    words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 8))) for _ in range(3000)]
+    topics = [rng.sample(words, 6) for _ in range(300)]
+    config = IntentListConfig(
+        [
+            intent_config(f"intent_{index}", [" ".join(rng.sample(topic, 3) + rng.sample(words, 3)) for _ in range(20)])
+            for index, topic in enumerate(topics)
+        ]
+    )
+
+    start_time = time.perf_counter()
+    router = LexicalIntentRouter.from_intent_list_config(config)
+
+    assert time.perf_counter() - start_time < 60
+    assert router.weights.shape == (FEATURE_DIMENSION + 1, 300)
+    correct = sum(
+        router.predict(" ".join(rng.sample(topic, 3) + rng.sample(words, 2)))[0] == f"intent_{index}"
+        for index, topic in enumerate(topics)
+    )
+    assert correct / len(topics) > 0.95